@@ -0,0 +1,93 @@
+"""Logins per second per core for each password hashing cost.
+
+Usage: python benchmarks/password_hashing.py [--duration SECONDS] [--json] [METHOD ...]
+
+For every method a hash is checked in a loop on one thread for `duration` seconds, which is
+the rate a single core sustains. The same is then repeated with as many concurrent logins as
+there are hashing workers, to show how the pool scales over the available cores.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("FLASK_SQLALCHEMY_DATABASE_URI", "sqlite+pysqlite:///:memory:")
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from coverletter import app
+from coverletter.passwords import PasswordHasher
+
+METHODS = [
+    "pbkdf2:sha256:260000",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:1000000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:65536:8:1",
+]
+
+
+def rate(check, duration: float, concurrency: int = 1) -> float:
+    """Checks per second of `check` with `concurrency` callers."""
+
+    def run() -> int:
+        checks = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            check()
+            checks += 1
+        return checks
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as callers:
+        checks = sum(callers.map(lambda _: run(), range(concurrency)))
+    return checks / (time.perf_counter() - started)
+
+
+def benchmark(method: str, duration: float, workers: int) -> dict:
+    password_hash = generate_password_hash("correct horse battery staple", method)
+    hasher = PasswordHasher(method=method, workers=workers)
+    try:
+        per_core = rate(
+            lambda: check_password_hash(password_hash, "correct horse battery staple"), duration
+        )
+        pooled = rate(
+            lambda: hasher.check(password_hash, "correct horse battery staple"), duration, workers
+        )
+    finally:
+        hasher.shutdown()
+    return {
+        "method": method,
+        "logins_per_second_per_core": round(per_core, 2),
+        "logins_per_second": round(pooled, 2),
+        "workers": workers,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("methods", nargs="*", default=METHODS)
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=app.config["PASSWORD_HASH_WORKERS"])
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args(argv)
+
+    results = [benchmark(method, args.duration, args.workers) for method in args.methods]
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print(f"{'method':<24} {'logins/s/core':>14} {'logins/s':>10}  ({args.workers} workers)")
+    for result in results:
+        print(
+            f"{result['method']:<24} {result['logins_per_second_per_core']:>14.2f} "
+            f"{result['logins_per_second']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Time and queries of the main request paths, by resume size and depth of the letter history.
+
+Usage: python benchmarks/request_paths.py [--items N ...] [--letters N ...] [--repeat N]
+                                          [--json] [--baseline FILE] [--tolerance RATIO]
+
+For every combination of resume size and history depth an in-memory database is seeded with one
+user, a resume of that many items and that many cover letters. Then every benchmark runs once to
+warm the caches and `repeat` times to measure: `compose_prompt`, `create_resume_table`,
+`Resume.get_items_per_category`, `User.previous_coverletters`, the profile view, a login and the
+whole `create` flow with the offline "local" model, which adds a letter to the history each run.
+
+Times are reported in milliseconds as the median and 90th percentile of the repeats, queries as
+the number of statements of one run. With --baseline, the results are compared against an
+earlier --json output and the exit status is 1 if a median got slower by more than the
+tolerance or a benchmark runs more queries than before.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("FLASK_SQLALCHEMY_DATABASE_URI", "sqlite+pysqlite:///:memory:")
+os.environ.setdefault("LLM_PROVIDER", "local")
+os.environ.setdefault("GENERATION_QUEUE_BACKEND", "inline")
+os.environ.setdefault("MODEL_POOL_WARMUP", "0")
+# every letter of the create flow is generated instead of answered from the cache
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+os.environ.setdefault("SCHEDULER_REQUESTS_PER_MINUTE", "1000000000")
+os.environ.setdefault("SCHEDULER_TOKENS_PER_MINUTE", "1000000000000")
+
+from sqlalchemy import event
+
+from coverletter import app, db
+from coverletter.db_models import (
+    CoverLetter,
+    JobPosting,
+    ModelConfig,
+    Prompt,
+    Resume,
+    ResumeItem,
+    User,
+    user_cache,
+)
+from coverletter.llm import response_cache
+from coverletter.ranking import resume_indexes
+from coverletter.similarity import similarity_index
+from coverletter.views.applications import (
+    DEFAULT_MODEL_CONFIG,
+    compose_prompt,
+    create_resume_table,
+    generation_queue,
+)
+
+ITEMS = [10, 50, 200]
+LETTERS = [0, 100, 1000]
+EMAIL = "benchmark@example.com"
+PASSWORD = "benchmark password"
+CATEGORIES = ["work", "education", "project", "skill", "certification", "course"]
+WORDS = (
+    "python sql spark kafka airflow data pipeline engineer analytics cloud aws gcp azure docker "
+    "kubernetes terraform java scala go rust react typescript frontend backend api rest graphql "
+    "machine learning model training statistics research team lead mentoring agile scrum "
+    "berlin munich remote startup consulting banking retail logistics healthcare security"
+).split()
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args) -> None:
+        self.count += 1
+
+
+def seed(items: int, letters: int, rng: random.Random) -> tuple[int, int, int]:
+    """A fresh database with one user, a resume of `items` items and `letters` cover letters,
+    returns the ids of the user, the resume and a posting."""
+    db.drop_all()
+    db.create_all()
+    for cache in (user_cache, response_cache, resume_indexes, similarity_index):
+        cache.clear()
+
+    user = User(name="Benchmark", email=EMAIL)
+    user.set_password(PASSWORD)
+    resume = Resume(language="en", user=user)
+    for index in range(items):
+        resume.resume_items.append(
+            ResumeItem(
+                title=f"{' '.join(rng.sample(WORDS, 2))} {index}",
+                description=" ".join(rng.choices(WORDS, k=rng.randint(10, 60))),
+                category=CATEGORIES[index % len(CATEGORIES)],
+                begin_date=datetime(2000 + index % 24, 1 + index % 12, 1),
+                end_date=datetime(2001 + index % 24, 1 + index % 12, 1),
+                grade=1.0,
+                location=rng.choice(WORDS),
+            )
+        )
+    posting = JobPosting(
+        text=" ".join(rng.choices(WORDS, k=400)), company="ACME", location="Berlin", language="en"
+    )
+    db.session.add_all([user, resume, posting])
+    config = ModelConfig.get_or_create(**DEFAULT_MODEL_CONFIG)
+
+    started = datetime(2020, 1, 1)
+    for index in range(letters):
+        prompt = Prompt(
+            prompt="prompt",
+            resume=resume,
+            posting=JobPosting(text=f"{' '.join(rng.choices(WORDS, k=200))} {index}"),
+        )
+        db.session.add(
+            CoverLetter(
+                prompt=prompt,
+                config=config,
+                response=" ".join(rng.choices(WORDS, k=300)),
+                timestamp=started + timedelta(hours=index),
+            )
+        )
+    db.session.commit()
+    return user.id, resume.id, posting.id
+
+
+def measure(run, repeat: int, counter: StatementCounter) -> dict:
+    run()
+    timings = []
+    for _ in range(repeat):
+        counter.count = 0
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "p90_ms": round(
+            (statistics.quantiles(timings, n=10)[-1] if len(timings) > 1 else timings[0]) * 1000,
+            3,
+        ),
+        "queries": counter.count,
+    }
+
+
+def benchmark(items: int, letters: int, repeat: int, counter: StatementCounter) -> list[dict]:
+    rng = random.Random(items * 100003 + letters)
+    results = []
+
+    def record(name: str, run) -> None:
+        results.append(
+            {"benchmark": name, "items": items, "letters": letters, **measure(run, repeat, counter)}
+        )
+
+    with app.app_context():
+        user_id, resume_id, posting_id = seed(items, letters, rng)
+        user = db.session.get(User, user_id)
+        resume = db.session.get(Resume, resume_id)
+        posting = db.session.get(JobPosting, posting_id)
+        config = ModelConfig.get_or_create(**DEFAULT_MODEL_CONFIG)
+
+        def run_compose_prompt():
+            compose_prompt(posting, resume, user, config)
+            # the prompt is not stored, forget it in the collections it was appended to
+            db.session.expire(resume, ["prompts"])
+            db.session.expire(posting, ["prompts"])
+
+        record("compose_prompt", run_compose_prompt)
+        record("create_resume_table", lambda: create_resume_table(resume))
+        record("get_items_per_category", resume.get_items_per_category)
+        record("previous_coverletters", lambda: user.previous_coverletters().all())
+        db.session.commit()
+
+    # requests run outside of the app context above, each one gets its own like in production
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+
+    def run_profile():
+        response = client.get(f"/user/{EMAIL}")
+        assert response.status_code == 200, response.status
+
+    def run_login():
+        response = app.test_client().post("/login", data={"email": EMAIL, "password": PASSWORD})
+        assert response.status_code == 302 and "/login" not in response.location, response.status
+
+    postings = iter(range(10**9))
+
+    def run_create():
+        # a new posting each time, an identical one would be deduplicated
+        text = f"{' '.join(rng.choices(WORDS, k=400))} {next(postings)}"
+        response = client.post(
+            "/create", data={"company": "ACME", "posting_text": text, "language": "EN"}
+        )
+        assert response.status_code == 302 and "/jobs/" in response.location, response.status
+
+    record("profile_view", run_profile)
+    record("login", run_login)
+    # last, it grows the history
+    record("create", run_create)
+    return results
+
+
+def regressions(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """The benchmarks that are slower than the tolerance allows or run more queries."""
+    previous = {(row["benchmark"], row["items"], row["letters"]): row for row in baseline}
+    found = []
+    for row in results:
+        before = previous.get((row["benchmark"], row["items"], row["letters"]))
+        if before is None:
+            continue
+        name = f"{row['benchmark']} items={row['items']} letters={row['letters']}"
+        if row["median_ms"] > before["median_ms"] * (1 + tolerance):
+            found.append(f"{name}: {before['median_ms']:.3f} ms -> {row['median_ms']:.3f} ms")
+        if row["queries"] > before["queries"]:
+            found.append(f"{name}: {before['queries']} queries -> {row['queries']} queries")
+    return found
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", nargs="+", type=int, default=ITEMS)
+    parser.add_argument("--letters", nargs="+", type=int, default=LETTERS)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--baseline", type=argparse.FileType(), help="JSON of an earlier run.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    counter = StatementCounter()
+    results = []
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        for items in args.items:
+            for letters in args.letters:
+                results += benchmark(items, letters, args.repeat, counter)
+    finally:
+        generation_queue.shutdown()
+        event.remove(engine, "before_cursor_execute", counter)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(
+            f"{'benchmark':<24} {'items':>6} {'letters':>8} {'median ms':>10} {'p90 ms':>9} "
+            f"{'queries':>8}"
+        )
+        for result in results:
+            print(
+                f"{result['benchmark']:<24} {result['items']:>6} {result['letters']:>8} "
+                f"{result['median_ms']:>10.3f} {result['p90_ms']:>9.3f} {result['queries']:>8}"
+            )
+
+    if args.baseline is not None:
+        found = regressions(results, json.load(args.baseline), args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
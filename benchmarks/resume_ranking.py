@@ -0,0 +1,91 @@
+"""Time to rank the items of a resume against a job posting, by resume size.
+
+Usage: python benchmarks/resume_ranking.py [--repeat N] [--json] [ITEMS ...]
+
+For every size a synthetic resume is indexed once, which happens once per resume version, and
+then scored against a posting `repeat` times, which happens for every prompt. Both are reported
+in milliseconds, scoring as the median of the repeats.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("FLASK_SQLALCHEMY_DATABASE_URI", "sqlite+pysqlite:///:memory:")
+
+from coverletter import app
+from coverletter.db_models import ResumeItem
+from coverletter.ranking import ResumeIndex
+
+SIZES = [50, 200, 500, 1000]
+CATEGORIES = ["work", "education", "project", "skill", "certification", "course"]
+WORDS = (
+    "python sql spark kafka airflow data pipeline engineer analytics cloud aws gcp azure docker "
+    "kubernetes terraform java scala go rust react typescript frontend backend api rest graphql "
+    "machine learning model training statistics research team lead mentoring agile scrum "
+    "berlin munich remote startup consulting banking retail logistics healthcare security"
+).split()
+
+
+def synthetic_items(count: int, rng: random.Random) -> list[ResumeItem]:
+    return [
+        ResumeItem(
+            title=f"{' '.join(rng.sample(WORDS, 2))} {index}",
+            description=" ".join(rng.choices(WORDS, k=rng.randint(10, 60))),
+            category=rng.choice(CATEGORIES),
+            begin_date=datetime(2000 + index % 24, 1 + index % 12, 1),
+        )
+        for index in range(count)
+    ]
+
+
+def benchmark(size: int, repeat: int, per_category: int) -> dict:
+    rng = random.Random(size)
+    items = synthetic_items(size, rng)
+    posting = " ".join(rng.choices(WORDS, k=400))
+
+    started = time.perf_counter()
+    index = ResumeIndex(items)
+    build = time.perf_counter() - started
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        index.top_items(posting, per_category)
+        timings.append(time.perf_counter() - started)
+    return {
+        "items": size,
+        "terms": len(index.vocabulary),
+        "index_ms": round(build * 1000, 3),
+        "score_ms": round(statistics.median(timings) * 1000, 3),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=SIZES)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--per-category", type=int, default=app.config["RESUME_TOP_K_PER_CATEGORY"])
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args(argv)
+
+    results = [benchmark(size, args.repeat, args.per_category) for size in args.sizes]
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print(f"{'items':>6} {'terms':>6} {'index ms':>9} {'score ms':>9}")
+    for result in results:
+        print(
+            f"{result['items']:>6} {result['terms']:>6} {result['index_ms']:>9.3f} "
+            f"{result['score_ms']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
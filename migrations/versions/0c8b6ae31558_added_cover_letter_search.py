@@ -0,0 +1,86 @@
+"""added full-text search over cover letters
+
+Revision ID: 0c8b6ae31558
+Revises: a8500b971d03
+Create Date: 2026-10-18 20:12:05.614820
+
+"""
+
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0c8b6ae31558"
+down_revision = "a8500b971d03"
+branch_labels = None
+depends_on = None
+
+# same structure as coverletter.search at the time of this revision
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE cover_letter_search USING fts5("
+    "company, location, posting, response, user_id UNINDEXED, tokenize = 'porter unicode61')"
+]
+POSTGRES_DDL = [
+    "CREATE TABLE cover_letter_search ("
+    "cover_letter_id INTEGER PRIMARY KEY REFERENCES cover_letters (id) ON DELETE CASCADE, "
+    "user_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+    "CREATE INDEX ix_cover_letter_search_document ON cover_letter_search USING GIN (document)",
+    "CREATE INDEX ix_cover_letter_search_user_id ON cover_letter_search (user_id)",
+]
+SQLITE_INSERT = (
+    "INSERT INTO cover_letter_search (rowid, company, location, posting, response, user_id) "
+    "VALUES (:id, :company, :location, :posting, :response, :user_id)"
+)
+POSTGRES_INSERT = (
+    "INSERT INTO cover_letter_search (cover_letter_id, user_id, document) VALUES (:id, "
+    ":user_id, setweight(to_tsvector('english', :company), 'A') "
+    "|| setweight(to_tsvector('english', :location), 'B') "
+    "|| setweight(to_tsvector('english', :posting), 'C') "
+    "|| setweight(to_tsvector('english', :response), 'D'))"
+)
+
+
+def decompress(value: bytes | None) -> str:
+    # same format as coverletter.db_models.CompressedText
+    if value is None:
+        return ""
+    value = bytes(value)
+    if value[:1] == b"\x01":
+        return zlib.decompress(value[1:]).decode("utf-8")
+    return value[1:].decode("utf-8")
+
+
+def upgrade():
+    connection = op.get_bind()
+    postgres = connection.dialect.name == "postgresql"
+    for statement in POSTGRES_DDL if postgres else SQLITE_DDL:
+        op.execute(statement)
+
+    rows = connection.execute(
+        sa.text(
+            "SELECT cover_letters.id, cover_letters.user_id, postings.company, postings.location, "
+            "postings.text, cover_letters.response FROM cover_letters "
+            "JOIN prompts ON prompts.id = cover_letters.prompt_id "
+            "JOIN postings ON postings.id = prompts.posting_id"
+        )
+    ).all()
+    documents = [
+        {
+            "id": row[0],
+            "user_id": row[1],
+            "company": row[2] or "",
+            "location": row[3] or "",
+            "posting": decompress(row[4]),
+            "response": decompress(row[5]),
+        }
+        for row in rows
+    ]
+    if documents:
+        connection.execute(sa.text(POSTGRES_INSERT if postgres else SQLITE_INSERT), documents)
+    print(f"Indexed {len(documents)} cover letters for search")
+
+
+def downgrade():
+    op.execute("DROP TABLE cover_letter_search")
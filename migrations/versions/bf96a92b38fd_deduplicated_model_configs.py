@@ -0,0 +1,81 @@
+"""deduplicated model configs
+
+Revision ID: bf96a92b38fd
+Revises: fdbf95c456f8
+Create Date: 2026-10-18 15:41:09.772180
+
+"""
+
+from hashlib import sha256
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "bf96a92b38fd"
+down_revision = "fdbf95c456f8"
+branch_labels = None
+depends_on = None
+
+# parameter columns and their types, as hashed by ModelConfig.content_hash
+PARAMETERS = {
+    "temperature": float,
+    "max_output_tokens": int,
+    "top_k": int,
+    "top_p": float,
+    "stop_sequence": str,
+    "candidate_count": int,
+    "grounding_source": str,
+    "logprobs": float,
+    "presence_penalty": float,
+    "frequency_penalty": float,
+}
+
+
+def content_hash(row) -> str:
+    values = {"name": row.name, "model_id": row.model_id}
+    for column, python_type in PARAMETERS.items():
+        value = getattr(row, column)
+        values[column] = None if value is None else python_type(value)
+    return sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table("model_configs", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("config_hash", sa.String(length=64), nullable=True))
+
+    # collapse identical configs into the row with the lowest id
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.text(f"SELECT id, name, model_id, {', '.join(PARAMETERS)} FROM model_configs ORDER BY id")
+    ).all()
+    kept = {}
+    for row in rows:
+        config_hash = content_hash(row)
+        if config_hash not in kept:
+            kept[config_hash] = row.id
+            connection.execute(
+                sa.text("UPDATE model_configs SET config_hash = :hash WHERE id = :id"),
+                {"hash": config_hash, "id": row.id},
+            )
+            continue
+        for table in ("cover_letters", "generation_jobs"):
+            connection.execute(
+                sa.text(f"UPDATE {table} SET config_id = :kept WHERE config_id = :id"),
+                {"kept": kept[config_hash], "id": row.id},
+            )
+        connection.execute(sa.text("DELETE FROM model_configs WHERE id = :id"), {"id": row.id})
+    print(f"Collapsed {len(rows)} model configs into {len(kept)}")
+
+    with op.batch_alter_table("model_configs", schema=None) as batch_op:
+        batch_op.alter_column("config_hash", existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_index(batch_op.f("ix_model_configs_config_hash"), ["config_hash"], unique=True)
+
+
+def downgrade():
+    # the removed duplicates are not restored, the remaining rows stay valid
+    with op.batch_alter_table("model_configs", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_model_configs_config_hash"))
+        batch_op.drop_column("config_hash")
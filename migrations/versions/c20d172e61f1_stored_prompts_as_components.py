@@ -0,0 +1,218 @@
+"""stored prompts as components and compressed large text columns
+
+Revision ID: c20d172e61f1
+Revises: 2a4043c7c794
+Create Date: 2026-10-18 18:47:13.905218
+
+"""
+
+from hashlib import sha256
+import re
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c20d172e61f1"
+down_revision = "2a4043c7c794"
+branch_labels = None
+depends_on = None
+
+# (table, key column, text column) of the columns that are stored compressed
+COMPRESSED_COLUMNS = [
+    ("prompts", "id", "prompt"),
+    ("postings", "id", "text"),
+    ("cover_letters", "id", "response"),
+    ("resume_snapshots", "hash", "content"),
+]
+
+# version 1 of coverletter.prompts.PROMPT_TEMPLATES, the only one before this revision
+TEMPLATE = (
+    "Your task is to generate a cover letter for applicant {name} and company {company}"
+    "\n for the following application: \n{posting}"
+    "\n Based on the following CV: \n{resume}"
+    "\n It is crucial to not hallucinate skills or experiences that are not present in the CV! "
+    "Try to make the cover letter as relevant as possible. \n"
+)
+TEMPLATE_PATTERN = re.compile(
+    re.escape(TEMPLATE)
+    .replace(r"\{name\}", "(?P<name>.*?)")
+    .replace(r"\{company\}", "(?P<company>.*?)")
+    .replace(r"\{posting\}", "(?P<posting>.*)")
+    .replace(r"\{resume\}", "(?P<resume>.*)"),
+    re.DOTALL,
+)
+
+
+def compress(text: str) -> bytes:
+    # same format as coverletter.db_models.CompressedText
+    data = text.encode("utf-8")
+    compressed = zlib.compress(data)
+    if len(compressed) < len(data):
+        return b"\x01" + compressed
+    return b"\x00" + data
+
+
+def decompress(value: bytes) -> str:
+    value = bytes(value)
+    if value[:1] == b"\x01":
+        return zlib.decompress(value[1:]).decode("utf-8")
+    return value[1:].decode("utf-8")
+
+
+def read_column(connection, table: str, key: str, column: str) -> dict:
+    rows = connection.execute(sa.text(f"SELECT {key}, {column} FROM {table}")).all()
+    return {row[0]: row[1] for row in rows if row[1] is not None}
+
+
+def write_column(connection, table: str, key: str, column: str, values: dict) -> None:
+    for key_value, value in values.items():
+        connection.execute(
+            sa.text(f"UPDATE {table} SET {column} = :value WHERE {key} = :key"),
+            {"value": value, "key": key_value},
+        )
+
+
+def upgrade():
+    connection = op.get_bind()
+    texts = {
+        table: read_column(connection, table, key, column)
+        for table, key, column in COMPRESSED_COLUMNS
+    }
+    size_before = sum(
+        len(text.encode("utf-8")) for values in texts.values() for text in values.values()
+    )
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table("prompts", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("template_version", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("applicant", sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column("snapshot_hash", sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column("posting_text", sa.LargeBinary(), nullable=True))
+        batch_op.create_foreign_key(
+            "fk_prompts_snapshot_hash_resume_snapshots",
+            "resume_snapshots",
+            ["snapshot_hash"],
+            ["hash"],
+        )
+
+    for table, key, column in COMPRESSED_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(
+                column,
+                existing_type=sa.String(),
+                type_=sa.LargeBinary(),
+                postgresql_using=f"convert_to({column}, 'UTF8')",
+            )
+    with op.batch_alter_table("prompts", schema=None) as batch_op:
+        batch_op.alter_column("prompt", existing_type=sa.LargeBinary(), nullable=True)
+
+    # ### end Alembic commands ###
+
+    # split prompts into their components where rendering the components gives the same text
+    postings = connection.execute(sa.text("SELECT id, company FROM postings")).all()
+    companies = {row.id: row.company or "" for row in postings}
+    posting_ids = dict(connection.execute(sa.text("SELECT id, posting_id FROM prompts")).all())
+    snapshots = dict(texts["resume_snapshots"])
+    prompts = {}
+    converted = 0
+    for prompt_id, text in texts["prompts"].items():
+        posting_id = posting_ids[prompt_id]
+        match = TEMPLATE_PATTERN.fullmatch(text)
+        if match is None or match["company"] != companies.get(posting_id):
+            prompts[prompt_id] = compress(text)
+            continue
+        snapshot_hash = sha256(match["resume"].encode("utf-8")).hexdigest()
+        if snapshot_hash not in snapshots:
+            snapshots[snapshot_hash] = match["resume"]
+            connection.execute(
+                sa.text("INSERT INTO resume_snapshots (hash, content) VALUES (:hash, :content)"),
+                {"hash": snapshot_hash, "content": compress(match["resume"])},
+            )
+        posting = match["posting"]
+        connection.execute(
+            sa.text(
+                "UPDATE prompts SET prompt = NULL, template_version = 1, applicant = :name, "
+                "snapshot_hash = :hash, posting_text = :posting WHERE id = :id"
+            ),
+            {
+                "name": match["name"],
+                "hash": snapshot_hash,
+                "posting": (
+                    None if posting == texts["postings"].get(posting_id) else compress(posting)
+                ),
+                "id": prompt_id,
+            },
+        )
+        converted += 1
+
+    write_column(connection, "prompts", "id", "prompt", prompts)
+    for table, key, column in COMPRESSED_COLUMNS[1:]:
+        values = {key_value: compress(text) for key_value, text in texts[table].items()}
+        write_column(connection, table, key, column, values)
+
+    size_after = 0
+    for table, key, column in COMPRESSED_COLUMNS + [("prompts", "id", "posting_text")]:
+        size_after += sum(
+            len(value) for value in read_column(connection, table, key, column).values()
+        )
+    print(
+        f"Stored {converted} of {len(texts['prompts'])} prompts as components, "
+        f"text columns shrank from {size_before} to {size_after} bytes"
+    )
+
+
+def downgrade():
+    connection = op.get_bind()
+    texts = {
+        table: {
+            key_value: decompress(value)
+            for key_value, value in read_column(connection, table, key, column).items()
+        }
+        for table, key, column in COMPRESSED_COLUMNS
+    }
+
+    # render the prompts that are stored as components, their extracted snapshots are kept
+    rows = connection.execute(
+        sa.text(
+            "SELECT prompts.id, prompts.applicant, prompts.posting_text, prompts.posting_id, "
+            "prompts.snapshot_hash, postings.company FROM prompts "
+            "JOIN postings ON postings.id = prompts.posting_id WHERE prompts.prompt IS NULL"
+        )
+    ).all()
+    for row in rows:
+        posting = texts["postings"].get(row.posting_id, "")
+        if row.posting_text is not None:
+            posting = decompress(row.posting_text)
+        texts["prompts"][row.id] = TEMPLATE.format(
+            name=row.applicant,
+            company=row.company or "",
+            posting=posting,
+            resume=texts["resume_snapshots"][row.snapshot_hash],
+        )
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    for table, key, column in COMPRESSED_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            # the converted values are overwritten with the decompressed text below
+            batch_op.alter_column(
+                column,
+                existing_type=sa.LargeBinary(),
+                type_=sa.String(),
+                postgresql_using=f"encode({column}, 'base64')",
+            )
+
+    with op.batch_alter_table("prompts", schema=None) as batch_op:
+        batch_op.drop_constraint("fk_prompts_snapshot_hash_resume_snapshots", type_="foreignkey")
+        batch_op.drop_column("posting_text")
+        batch_op.drop_column("snapshot_hash")
+        batch_op.drop_column("applicant")
+        batch_op.drop_column("template_version")
+
+    # ### end Alembic commands ###
+
+    for table, key, column in COMPRESSED_COLUMNS:
+        write_column(connection, table, key, column, texts[table])
+    with op.batch_alter_table("prompts", schema=None) as batch_op:
+        batch_op.alter_column("prompt", existing_type=sa.String(), nullable=False)
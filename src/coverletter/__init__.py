@@ -29,9 +29,19 @@ except OSError:
 login = LoginManager(app)
 login.login_view = "login"
 
-db = SQLAlchemy(app=app)
+from coverletter.database import configure_sqlite, engine_options
 
-migrate = Migrate(app, db)
+db = SQLAlchemy(app=app, engine_options=engine_options(app.config))
+with app.app_context():
+    configure_sqlite(db.engine, app.config)
+
+
+def include_name(name: str | None, type_: str, parent_names: dict) -> bool:
+    # the full-text search tables are created and kept in sync by coverletter.search
+    return not (type_ == "table" and name.startswith("cover_letter_search"))
+
+
+migrate = Migrate(app, db, include_name=include_name)
 
 if not app.debug:
     if app.config["MAIL_SERVER"]:
@@ -0,0 +1,123 @@
+"""Buffered recording of user activity, so that page views do not write to the database."""
+
+import atexit
+import threading
+import time
+from datetime import datetime as DateTime, timedelta, timezone
+
+from sqlalchemy import case, or_, update
+
+from coverletter import app, db
+from coverletter.db_models import User
+
+
+class LastSeenBuffer:
+    """Collects `User.last_seen` timestamps in memory and writes them in batches.
+
+    A visit is only recorded if the user's last visit is older than `resolution` seconds. The
+    buffer remembers the visits it recorded after writing them, as the `last_seen` of a cached
+    user is not updated by a flush. Pending timestamps are written with one bulk UPDATE once
+    `flush_size` users are pending, and at the latest `flush_interval` seconds after the first of
+    them was recorded, by a timer if no visit comes in the meantime. The UPDATE never moves a
+    timestamp backwards, so several workers with their own buffers can flush in any order.
+    """
+
+    def __init__(
+        self,
+        resolution: float | None = None,
+        flush_interval: float | None = None,
+        flush_size: int | None = None,
+    ):
+        self.resolution = resolution
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.recorded = 0
+        self.flushes = 0
+        self.written = 0
+        self._pending: dict[int, DateTime] = {}
+        # the last visit recorded per user, kept while it is within the resolution
+        self._seen: dict[int, DateTime] = {}
+        self._last_flush = time.monotonic()
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def _setting(self, name: str) -> float:
+        value = getattr(self, name)
+        return app.config[f"LAST_SEEN_{name.upper()}"] if value is None else value
+
+    def record(self, user: User, now: DateTime | None = None) -> None:
+        """Note a visit of the user, flushing the buffer if it is due."""
+        if now is None:
+            now = DateTime.now(timezone.utc)
+        with self._lock:
+            last_seen = self._seen.get(user.id, user.last_seen)
+            if last_seen is not None:
+                if last_seen.tzinfo is None:
+                    last_seen = last_seen.replace(tzinfo=timezone.utc)
+                if now - last_seen < timedelta(seconds=self._setting("resolution")):
+                    return
+            self._pending[user.id] = self._seen[user.id] = now
+            self.recorded += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self._setting("flush_interval"), self._flush_later)
+                self._timer.daemon = True
+                self._timer.start()
+            due = len(self._pending) >= self._setting(
+                "flush_size"
+            ) or time.monotonic() - self._last_flush >= self._setting("flush_interval")
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write all pending timestamps with a single UPDATE, return the number of users."""
+        oldest = DateTime.now(timezone.utc) - timedelta(seconds=self._setting("resolution"))
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            self._seen = {user_id: seen for user_id, seen in self._seen.items() if seen > oldest}
+        if not pending:
+            return 0
+
+        last_seen = case(pending, value=User.id)
+        # a separate transaction, so the write does not commit the request's session
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(User)
+                .where(User.id.in_(pending))
+                .where(or_(User.last_seen.is_(None), User.last_seen < last_seen))
+                .values(last_seen=last_seen)
+            )
+        with self._lock:
+            self.flushes += 1
+            self.written += len(pending)
+        return len(pending)
+
+    def _flush_later(self) -> None:
+        with self._lock:
+            self._timer = None
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception:
+            app.logger.warning("Could not write the buffered last seen timestamps", exc_info=True)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self.recorded,
+                "flushes": self.flushes,
+                "written": self.written,
+            }
+
+
+last_seen_buffer = LastSeenBuffer()
+
+
+@atexit.register
+def flush_last_seen() -> None:
+    try:
+        with app.app_context():
+            last_seen_buffer.flush()
+    except Exception:
+        app.logger.warning("Could not write the buffered last seen timestamps", exc_info=True)
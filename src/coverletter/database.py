@@ -0,0 +1,51 @@
+"""Engine settings for SQLite files and database servers."""
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import make_url
+
+
+def normalize_database_url(url: str) -> str:
+    """Use the psycopg driver for PostgreSQL URLs that name none, e.g. `postgres://` of PaaS."""
+    for scheme in ("postgres://", "postgresql://"):
+        if url.startswith(scheme):
+            return "postgresql+psycopg://" + url[len(scheme) :]
+    return url
+
+
+def engine_options(config) -> dict:
+    """Connection pool settings for database servers, SQLite keeps the defaults."""
+    if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": config["DATABASE_POOL_SIZE"],
+        "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+        "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+        "pool_pre_ping": config["DATABASE_POOL_PRE_PING"],
+    }
+
+
+def configure_sqlite(engine: Engine, config) -> None:
+    """Apply the SQLite pragmas of the config to every new connection of the engine.
+
+    In WAL mode readers see the last committed state instead of waiting for a running write
+    transaction, and synchronous=NORMAL only syncs the log at checkpoints instead of on every
+    commit. Writers wait up to the busy timeout for each other instead of failing at once.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = {
+        "busy_timeout": config["SQLITE_BUSY_TIMEOUT"],
+        "synchronous": config["SQLITE_SYNCHRONOUS"],
+        "mmap_size": config["SQLITE_MMAP_SIZE"],
+    }
+    if config["SQLITE_WAL"]:
+        pragmas["journal_mode"] = "WAL"
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
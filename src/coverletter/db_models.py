@@ -1,15 +1,84 @@
 from datetime import datetime as DateTime, timezone
 
-from sqlalchemy import ForeignKey, String
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import ForeignKey, Index, LargeBinary, String, and_, event, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import (
+    Mapped,
+    make_transient_to_detached,
+    mapped_column,
+    relationship,
+    selectinload,
+)
+from sqlalchemy.types import TypeDecorator
+from flask import has_request_context, request
 from flask_login import UserMixin
 from beartype import beartype
 from beartype.vale import Is
 from typing import Annotated
-from hashlib import md5
+from hashlib import md5, sha256
+import json
+import zlib
+
+from coverletter import app, db, login
+from coverletter.cache import TTLCache
+from coverletter.passwords import hasher
+from coverletter.postings import normalize_field, normalize_text, normalize_url, posting_hash
+
+DIALECT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def insert_if_new(model: type[db.Model], key: str, values: dict) -> bool:
+    """Insert a row unless one with the same unique `key` exists, e.g. from a concurrent worker,
+    return whether it was inserted.
+
+    Unlike a savepoint around an ORM insert this stays in the caller's transaction, pysqlite
+    commits a savepoint that is taken before the first write of a transaction on release.
+    """
+    insert = DIALECT_INSERTS[db.session.get_bind().dialect.name]
+    # columns left out get their defaults
+    values = {column: value for column, value in values.items() if value is not None}
+    result = db.session.execute(
+        insert(model).values(values).on_conflict_do_nothing(index_elements=[key])
+    )
+    return result.rowcount == 1
+
+
+class CompressedText(TypeDecorator):
+    """Text stored zlib compressed, unless compression does not make it smaller.
+
+    The first byte of the stored value tells whether the rest is compressed.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    RAW = b"\x00"
+    ZLIB = b"\x01"
+
+    def process_bind_param(self, value: str | None, dialect) -> bytes | None:
+        if value is None:
+            return None
+        return self.compress(value)
+
+    def process_result_value(self, value: bytes | None, dialect) -> str | None:
+        if value is None:
+            return None
+        return self.decompress(value)
 
-from coverletter import db, login
+    @classmethod
+    def compress(cls, text: str) -> bytes:
+        data = text.encode("utf-8")
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return cls.ZLIB + compressed
+        return cls.RAW + data
+
+    @classmethod
+    def decompress(cls, value: bytes) -> str:
+        value = bytes(value)
+        if value[:1] == cls.ZLIB:
+            return zlib.decompress(value[1:]).decode("utf-8")
+        return value[1:].decode("utf-8")
 
 
 class User(UserMixin, db.Model):
@@ -26,10 +95,14 @@ class User(UserMixin, db.Model):
         return f"<User {self.name}>"
 
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        return hasher.check(self.password_hash, password)
+
+    def password_needs_rehash(self) -> bool:
+        """Whether the password hash was made with outdated parameters."""
+        return hasher.needs_rehash(self.password_hash)
 
     def avatar(self, size: int) -> str:
         digest = md5(self.email.lower().encode("utf-8")).hexdigest()
@@ -37,25 +110,40 @@ class User(UserMixin, db.Model):
 
     def previous_coverletters(self):
         # ORM query
-        return (
-            CoverLetter.query.join(Prompt)
-            .join(Resume)
-            .join(User)
-            .filter(User.id == self.id)
-            .order_by(CoverLetter.timestamp.desc())
+        return CoverLetter.query.filter_by(user_id=self.id).order_by(
+            CoverLetter.timestamp.desc(), CoverLetter.id.desc()
         )
         """SQLAlchemy Core query
         return (
             select(CoverLetter)
-            .join(Prompt)
-            .join(Resume)
-            .join(User)
-            .where(User.id == self.id)
-            .order_by(CoverLetter.timestamp.desc())
+            .where(CoverLetter.user_id == self.id)
+            .order_by(CoverLetter.timestamp.desc(), CoverLetter.id.desc())
         )
 
         """
 
+    def coverletters_page(
+        self, after: tuple[DateTime, int] | None = None, limit: int = 20
+    ) -> list["CoverLetter"]:
+        """The next `limit` cover letters, newest first, after the (timestamp, id) of the last
+        letter of the previous page.
+
+        Seeks on the (user_id, timestamp) index instead of skipping rows with an offset, so every
+        page takes the same time however deep into the history it is.
+        """
+        query = self.previous_coverletters()
+        if after is not None:
+            timestamp, cover_letter_id = after
+            query = query.filter(
+                or_(
+                    CoverLetter.timestamp < timestamp,
+                    and_(CoverLetter.timestamp == timestamp, CoverLetter.id < cover_letter_id),
+                )
+            )
+        # the history shows the company of each letter
+        query = query.options(selectinload(CoverLetter.prompt).selectinload(Prompt.posting))
+        return query.limit(limit).all()
+
 
 class Resume(db.Model):
     __tablename__ = "resumes"
@@ -63,27 +151,36 @@ class Resume(db.Model):
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     language: Mapped[str] = mapped_column(String(3))
     created: Mapped[DateTime] = mapped_column(default=lambda: DateTime.now(timezone.utc))
+    # incremented whenever the items change
+    version: Mapped[int] = mapped_column(default=1)
+    # rendered items of the current version, None until the next prompt needs them
+    snapshot_hash: Mapped[str | None] = mapped_column(ForeignKey("resume_snapshots.hash"))
     user: Mapped[User] = relationship(back_populates="resumes")
     resume_items: Mapped[list["ResumeItem"]] = relationship(back_populates="resume")
     prompts: Mapped[list["Prompt"]] = relationship(back_populates="resume")
+    snapshot: Mapped["ResumeSnapshot | None"] = relationship()
 
     def __repr__(self):
         return f"<Resume {self.id}, Amount of items: {len(self.resume_items)}>"
 
-    def get_items_per_category(self) -> dict[str, list["ResumeItem"]]:
+    def invalidate_snapshot(self) -> None:
+        """Mark the rendered snapshot as outdated after the items of the resume changed."""
+        self.version = (self.version or 1) + 1
+        self.snapshot = None
+
+    def get_items_per_category(self) -> dict[str, list[dict]]:
         """Helper function that provides a mapping of resume categories to
         items contained in said category sorted by begin date.
         """
-        categories = {item.category for item in self.resume_items}
-        resume_categories = {}
+        items_per_category: dict[str, list[ResumeItem]] = {}
+        for item in self.resume_items:
+            items_per_category.setdefault(item.category, []).append(item)
 
-        for category in categories:
-            resume_items = sorted(
-                [item for item in self.resume_items if item.category == category],
-                key=lambda x: x.begin_date,
-                reverse=True,
-            )
-            resume_items_preview = [
+        resume_categories = {}
+        for category, resume_items in items_per_category.items():
+            # newest first, items without a date last
+            resume_items.sort(key=lambda x: x.begin_date or DateTime.min, reverse=True)
+            resume_categories[category] = [
                 {
                     "title": resume_item.title,
                     "description": resume_item.description,
@@ -100,10 +197,29 @@ class Resume(db.Model):
                 }
                 for resume_item in resume_items
             ]
-            resume_categories[category] = resume_items_preview
         return resume_categories
 
 
+class ResumeSnapshot(db.Model):
+    """Rendered resume items, stored once per distinct content."""
+
+    __tablename__ = "resume_snapshots"
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    content: Mapped[str] = mapped_column(CompressedText)
+
+    def __repr__(self):
+        return f"<ResumeSnapshot {self.hash[:12]}>"
+
+    @classmethod
+    def get_or_create(cls, content: str) -> "ResumeSnapshot":
+        content_hash = sha256(content.encode("utf-8")).hexdigest()
+        snapshot = db.session.get(cls, content_hash)
+        if snapshot is None:
+            insert_if_new(cls, "hash", {"hash": content_hash, "content": content})
+            snapshot = db.session.get(cls, content_hash)
+        return snapshot
+
+
 class ResumeItem(db.Model):
     __tablename__ = "resume_items"
     resume_id: Mapped[int] = mapped_column(ForeignKey("resumes.id"), primary_key=True)
@@ -122,24 +238,68 @@ class ResumeItem(db.Model):
 
 
 class Prompt(db.Model):
+    """A prompt stored as references to its components and rendered again when it is read.
+
+    Prompts that cannot be rendered from components, e.g. of tests or older templates, store
+    their full text instead.
+    """
+
     __tablename__ = "prompts"
     id: Mapped[int] = mapped_column(primary_key=True)
     resume_id: Mapped[int] = mapped_column(ForeignKey("resumes.id"))
     posting_id: Mapped[int] = mapped_column(ForeignKey("postings.id"))
-    prompt: Mapped[str] = mapped_column()
+    # version of the template in coverletter.prompts.PROMPT_TEMPLATES
+    template_version: Mapped[int | None] = mapped_column()
+    applicant: Mapped[str | None] = mapped_column(String(64))
+    # rendered resume items as they are in the prompt, after trimming to the token budget
+    snapshot_hash: Mapped[str | None] = mapped_column(ForeignKey("resume_snapshots.hash"))
+    # posting text trimmed to the token budget, None if the posting was used in full
+    posting_text: Mapped[str | None] = mapped_column(CompressedText)
+    # full text of prompts that are not stored as components
+    text: Mapped[str | None] = mapped_column("prompt", CompressedText)
+    # approximate token counts of the whole prompt and of its trimmed sections
+    input_tokens: Mapped[int | None] = mapped_column()
+    posting_tokens: Mapped[int | None] = mapped_column()
+    resume_tokens: Mapped[int | None] = mapped_column()
     resume: Mapped[Resume] = relationship(back_populates="prompts")
     posting: Mapped["JobPosting"] = relationship(back_populates="prompts")
+    snapshot: Mapped[ResumeSnapshot | None] = relationship()
     cover_letters: Mapped[list["CoverLetter"]] = relationship(back_populates="prompt")
 
     def __repr__(self):
         return f"<Prompt {self.id} {self.prompt[:25]}>"
 
+    @property
+    def prompt(self) -> str:
+        if self.text is not None:
+            return self.text
+        rendered = self.__dict__.get("_rendered")
+        if rendered is None:
+            from coverletter.prompts import render_prompt
+
+            rendered = render_prompt(
+                self.template_version,
+                self.applicant,
+                self.posting.company,
+                self.posting.text if self.posting_text is None else self.posting_text,
+                self.snapshot.content,
+            )
+            self.__dict__["_rendered"] = rendered
+        return rendered
+
+    @prompt.setter
+    def prompt(self, text: str) -> None:
+        self.text = text
+
 
 class JobPosting(db.Model):
+    """A job posting, stored once per distinct normalized content."""
+
     __tablename__ = "postings"
     id: Mapped[int] = mapped_column(primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64), index=True, unique=True)
     url: Mapped[str | None] = mapped_column()
-    text: Mapped[str] = mapped_column(default="")
+    text: Mapped[str] = mapped_column(CompressedText, default="")
     date: Mapped[DateTime] = mapped_column(default=lambda: DateTime.today())
     language: Mapped[str | None] = mapped_column(String(3), default="eng")
     company: Mapped[str | None] = mapped_column()
@@ -149,13 +309,69 @@ class JobPosting(db.Model):
     def __repr__(self):
         return f"<JobPosting {self.url}>"
 
+    def compute_hash(self) -> str:
+        # a missing language is stored as the column default
+        return posting_hash(self.text, self.company, self.location, self.language or "eng")
+
+    @classmethod
+    def get_or_create(
+        cls,
+        text: str,
+        url: str | None = None,
+        company: str | None = None,
+        location: str | None = None,
+        language: str | None = None,
+        date: DateTime | None = None,
+    ) -> "JobPosting":
+        """Return the stored posting with this content, inserting it only if it is new.
+
+        Postings are normalized first, so copies that only differ in whitespace or in the
+        tracking parameters of their URL are the same posting. The URL is only information, the
+        text and details a user entered for a known URL are never replaced by those of another
+        user. Postings downloaded from the same URL are reused, the fetcher returns the same text.
+        """
+        url = normalize_url(url)
+        values = {
+            "text": normalize_text(text),
+            "url": url,
+            "company": normalize_field(company),
+            "location": normalize_field(location),
+            "language": language,
+            "date": date,
+        }
+        values["content_hash"] = posting_hash(
+            values["text"], values["company"], values["location"], language or "eng"
+        )
+        select = db.select(cls).filter_by(content_hash=values["content_hash"])
+        existing = db.session.scalar(select)
+        if existing is None:
+            # another worker may store the same posting concurrently, then that one is used
+            inserted = insert_if_new(cls, "content_hash", values)
+            posting = db.session.scalars(select).one()
+            if inserted:
+                # indexed by coverletter.similarity once committed, like postings that are added
+                db.session.info.setdefault("new_postings", []).append((posting.id, posting.text))
+            return posting
+        if existing.url is None and url is not None:
+            existing.url = url
+        return existing
+
+
+@event.listens_for(JobPosting, "before_insert")
+def set_posting_hash(mapper, connection, posting: JobPosting) -> None:
+    if posting.content_hash is None:
+        posting.content_hash = posting.compute_hash()
+
 
 class CoverLetter(db.Model):
     __tablename__ = "cover_letters"
+    __table_args__ = (Index("ix_cover_letters_user_id_timestamp", "user_id", "timestamp"),)
     id: Mapped[int] = mapped_column(primary_key=True)
+    # owner of the prompt's resume, stored to list the history without joins
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     prompt_id: Mapped[int] = mapped_column(ForeignKey("prompts.id"))
     config_id: Mapped[int] = mapped_column(ForeignKey("model_configs.id"))
-    response: Mapped[str] = mapped_column()
+    response: Mapped[str] = mapped_column(CompressedText)
     timestamp: Mapped[DateTime] = mapped_column(
         default=lambda: DateTime.now(timezone.utc), index=True
     )
@@ -166,10 +382,29 @@ class CoverLetter(db.Model):
         return f"<CoverLetter {self.id}>"
 
 
+@event.listens_for(CoverLetter, "before_insert")
+def set_cover_letter_user(mapper, connection, cover_letter: CoverLetter) -> None:
+    if cover_letter.user_id is None:
+        cover_letter.user_id = cover_letter.prompt.resume.user_id
+
+
 class ModelConfig(db.Model):
     """Configuration of the TextGenerationModel by Google Cloud."""
 
     __tablename__ = "model_configs"
+    GENERATION_PARAMETERS = (
+        "temperature",
+        "max_output_tokens",
+        "top_k",
+        "top_p",
+        "stop_sequence",
+        "candidate_count",
+        "grounding_source",
+        "logprobs",
+        "presence_penalty",
+        "frequency_penalty",
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     # common name or family fo the model
     name: Mapped[str] = mapped_column()
@@ -193,20 +428,147 @@ class ModelConfig(db.Model):
     presence_penalty: Mapped[float | None] = mapped_column()
     # Positive values penalize repetition of tokens
     frequency_penalty: Mapped[float | None] = mapped_column()
+    # budget of the prompt in tokens, PROMPT_MAX_INPUT_TOKENS if unset
+    max_input_tokens: Mapped[int | None] = mapped_column()
+    # hash over all of the above, so that every distinct configuration is stored once
+    config_hash: Mapped[str] = mapped_column(String(64), index=True, unique=True)
 
     cover_letters: Mapped[list["CoverLetter"]] = relationship(back_populates="config")
 
+    # maps config hashes to the ids of their rows
+    _registry = TTLCache(maxsize=256, ttl=24 * 3600)
+
     def __repr__(self):
         return f"<ModelConfig {self.name} {self.model_id} {self.id}>"
 
+    @property
+    def is_deterministic(self) -> bool:
+        """Whether identical prompts produce identical responses.
+
+        An unset temperature falls back to the model default, which is 0 for the PaLM text models.
+        """
+        return not self.temperature and (self.candidate_count or 1) == 1
+
+    def generation_parameters(self) -> dict:
+        """The generation parameters that are set on this config."""
+        parameters = {name: getattr(self, name) for name in self.GENERATION_PARAMETERS}
+        return {name: value for name, value in parameters.items() if value is not None}
+
+    @classmethod
+    def content_hash(cls, name: str, model_id: str, **parameters) -> str:
+        """Hash of all parameter columns, with values normalized to their column types."""
+        values = {"name": name, "model_id": model_id}
+        for column in cls.GENERATION_PARAMETERS:
+            value = parameters.get(column)
+            if value is not None:
+                value = cls.__table__.c[column].type.python_type(value)
+            values[column] = value
+        # hashed only when set, so that the hashes of configs stored before it stay valid
+        if parameters.get("max_input_tokens") is not None:
+            values["max_input_tokens"] = int(parameters["max_input_tokens"])
+        return sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_or_create(cls, name: str, model_id: str, **parameters) -> "ModelConfig":
+        """Return the stored config with these parameters, inserting it only if it is new."""
+        config_hash = cls.content_hash(name, model_id, **parameters)
+
+        config_id = cls._registry.get(config_hash)
+        if config_id is not None:
+            config = db.session.get(cls, config_id)
+            if config is not None and config.config_hash == config_hash:
+                return config
+
+        select = db.select(cls).filter_by(config_hash=config_hash)
+        config = db.session.scalar(select)
+        if config is None:
+            # another worker may insert the same config concurrently, then that one is used
+            insert_if_new(
+                cls,
+                "config_hash",
+                {"name": name, "model_id": model_id, "config_hash": config_hash, **parameters},
+            )
+            config = db.session.scalars(select).one()
+        cls._registry.set(config_hash, config.id)
+        return config
+
+
+@event.listens_for(ModelConfig, "before_insert")
+def set_config_hash(mapper, connection, config: ModelConfig) -> None:
+    config.config_hash = ModelConfig.content_hash(
+        config.name,
+        config.model_id,
+        max_input_tokens=config.max_input_tokens,
+        **config.generation_parameters(),
+    )
+
+
+class GenerationJob(db.Model):
+    """A queued request to generate a cover letter for a prompt in the background."""
+
+    __tablename__ = "generation_jobs"
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    prompt_id: Mapped[int] = mapped_column(ForeignKey("prompts.id"))
+    config_id: Mapped[int] = mapped_column(ForeignKey("model_configs.id"))
+    cover_letter_id: Mapped[int | None] = mapped_column(ForeignKey("cover_letters.id"))
+    status: Mapped[str] = mapped_column(String(16), default=QUEUED, index=True)
+    # reuse the response of an identical earlier prompt if the config is deterministic
+    use_cache: Mapped[bool] = mapped_column(default=True)
+    error: Mapped[str | None] = mapped_column()
+    created: Mapped[DateTime] = mapped_column(default=lambda: DateTime.now(timezone.utc))
+    started: Mapped[DateTime | None] = mapped_column()
+    finished: Mapped[DateTime | None] = mapped_column()
+    user: Mapped[User] = relationship()
+    prompt: Mapped[Prompt] = relationship()
+    config: Mapped[ModelConfig] = relationship()
+    cover_letter: Mapped[CoverLetter | None] = relationship()
+
+    def __repr__(self):
+        return f"<GenerationJob {self.id} {self.status}>"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
 
 IntString = Annotated[str, Is[lambda s: s.isdigit()]]
 
 
+# column values of recently loaded users, without their password hash
+user_cache = TTLCache(maxsize=app.config["USER_CACHE_SIZE"], ttl=app.config["USER_CACHE_TTL"])
+USER_CACHE_COLUMNS = ("id", "name", "email", "about_me", "last_seen")
+
+
 @beartype
 @login.user_loader
-def load_user(user_id: IntString) -> User:
-    return User.query.get(int(user_id))
+def load_user(user_id: IntString) -> User | None:
+    """Load the user of the session, from the cache for requests that only read.
+
+    Cached users are detached copies: they render and answer queries by id, but changes to
+    them are not saved. Requests that may change data load the user from the database.
+    """
+    user_id = int(user_id)
+    if has_request_context() and request.method not in ("GET", "HEAD", "OPTIONS"):
+        return db.session.get(User, user_id)
+
+    values = user_cache.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user_cache.set(
+                user_id, {column: getattr(user, column) for column in USER_CACHE_COLUMNS}
+            )
+        return user
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+"""Export of the cover letters of a user as a ZIP archive that is written while it is sent.
+
+Letters are read in batches from a server-side cursor and every document is rendered and
+compressed on its own, so memory stays flat however long the history is. The archive is written
+to a non-seekable stream, zipfile then stores the sizes of each member after its data.
+"""
+
+import re
+import zipfile
+from datetime import datetime as DateTime
+from io import BytesIO
+from typing import Iterable, Iterator, NamedTuple
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select
+
+from coverletter import db
+from coverletter.db_models import CoverLetter, JobPosting, Prompt
+
+EXPORT_FORMATS = ("md", "docx", "pdf")
+# rows fetched from the cursor at a time
+EXPORT_BATCH_SIZE = 100
+
+
+class ExportedLetter(NamedTuple):
+    id: int
+    timestamp: DateTime
+    response: str
+    company: str | None
+    location: str | None
+    url: str | None
+
+
+def exported_letters(
+    user_id: int,
+    since: DateTime | None = None,
+    until: DateTime | None = None,
+    company: str | None = None,
+) -> Iterator[ExportedLetter]:
+    """The user's letters, oldest first, streamed from the database in batches."""
+    query = (
+        select(
+            CoverLetter.id,
+            CoverLetter.timestamp,
+            CoverLetter.response,
+            JobPosting.company,
+            JobPosting.location,
+            JobPosting.url,
+        )
+        .join(CoverLetter.prompt)
+        .join(Prompt.posting)
+        .where(CoverLetter.user_id == user_id)
+        .order_by(CoverLetter.timestamp, CoverLetter.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if since is not None:
+        query = query.where(CoverLetter.timestamp >= since)
+    if until is not None:
+        query = query.where(CoverLetter.timestamp < until)
+    if company:
+        query = query.where(JobPosting.company.ilike(f"%{company}%"))
+    for row in db.session.execute(query):
+        yield ExportedLetter(*row)
+
+
+def file_name(letter: ExportedLetter, extension: str) -> str:
+    company = re.sub(r"[^\w]+", "-", letter.company or "").strip("-").lower() or "unknown"
+    return f"{letter.timestamp:%Y-%m-%d}_{company}_{letter.id}.{extension}"
+
+
+def title(letter: ExportedLetter) -> str:
+    return f"Cover letter for {letter.company}" if letter.company else "Cover letter"
+
+
+def details(letter: ExportedLetter) -> list[str]:
+    return [f"{letter.timestamp:%Y-%m-%d}"] + [
+        value for value in (letter.location, letter.url) if value
+    ]
+
+
+def render_markdown(letter: ExportedLetter) -> bytes:
+    return (
+        f"# {title(letter)}\n\n*{', '.join(details(letter))}*\n\n{letter.response.strip()}\n"
+    ).encode("utf-8")
+
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    "</Types>"
+)
+DOCX_RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships/officeDocument" Target="word/document.xml"/>'
+    "</Relationships>"
+)
+
+
+def docx_paragraph(text: str, bold: bool = False) -> str:
+    properties = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f'<w:p><w:r>{properties}<w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def render_docx(letter: ExportedLetter) -> bytes:
+    """A Word document with one paragraph per line, without a dependency on a docx library."""
+    paragraphs = [
+        docx_paragraph(title(letter), bold=True),
+        docx_paragraph(", ".join(details(letter))),
+    ]
+    paragraphs += [docx_paragraph(line) for line in letter.response.strip().splitlines()]
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{''.join(paragraphs)}</w:body></w:document>"
+    )
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        docx.writestr("_rels/.rels", DOCX_RELATIONSHIPS)
+        docx.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+# A4 in points, with lines of 11 point Helvetica
+PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT = 595, 842
+PDF_MARGIN = 72
+PDF_FONT_SIZE = 11
+PDF_LEADING = 15
+PDF_LINE_CHARACTERS = 80
+PDF_PAGE_LINES = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LEADING
+
+
+def wrap(text: str, width: int) -> list[str]:
+    lines = []
+    for paragraph in text.splitlines():
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return lines
+
+
+def pdf_string(text: str) -> bytes:
+    # the standard fonts use WinAnsiEncoding, other characters are replaced
+    encoded = text.encode("cp1252", errors="replace")
+    return b"(" + encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def render_pdf(letter: ExportedLetter) -> bytes:
+    """A PDF with the text of the letter on A4 pages, written without a PDF library."""
+    lines = [title(letter), ", ".join(details(letter)), ""]
+    lines += wrap(letter.response.strip(), PDF_LINE_CHARACTERS)
+    pages = [
+        lines[start : start + PDF_PAGE_LINES] for start in range(0, len(lines), PDF_PAGE_LINES)
+    ]
+
+    # objects 1 to 3 are the catalog, the page tree and the font, then a page and its content
+    page_ids = [4 + 2 * index for index in range(len(pages))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(pages)),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for page_id, page in zip(page_ids, pages):
+        content = b"BT /F1 %d Tf %d TL %d %d Td " % (
+            PDF_FONT_SIZE,
+            PDF_LEADING,
+            PDF_MARGIN,
+            PDF_PAGE_HEIGHT - PDF_MARGIN,
+        )
+        content += b" ".join(pdf_string(line) + b" Tj T*" for line in page) + b" ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, page_id + 1)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return bytes(output)
+
+
+RENDERERS = {"md": render_markdown, "docx": render_docx, "pdf": render_pdf}
+
+
+class ChunkStream:
+    """Write-only stream that hands out what was written since the last call of `take`."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def stream_zip(letters: Iterable[ExportedLetter], export_format: str = "md") -> Iterator[bytes]:
+    """The ZIP archive of the letters in the format, one chunk per document."""
+    render = RENDERERS[export_format]
+    stream = ChunkStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+        for letter in letters:
+            info = zipfile.ZipInfo(
+                file_name(letter, export_format), letter.timestamp.timetuple()[:6]
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, render(letter))
+            yield stream.take()
+    # the central directory is written when the archive is closed
+    yield stream.take()
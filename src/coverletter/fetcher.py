@@ -0,0 +1,255 @@
+"""Download of job postings from their URL and extraction of the posting text."""
+
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from hashlib import sha256
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from coverletter import app
+from coverletter.postings import normalize_text
+
+# elements that never belong to the text of a posting
+NOISE_TAGS = ["script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside"]
+# elements that usually hold the main content of a page, the first one found is used
+MAIN_SELECTORS = ["main", "article", "[role=main]", "#content", ".content"]
+# elements that end a paragraph or a line of text
+PARAGRAPH_TAGS = ["p", "div", "section", "table", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6"]
+LINE_TAGS = ["br", "li", "tr", "dt", "dd"]
+
+
+class FetchError(Exception):
+    """Raised when a posting cannot be downloaded or has no text."""
+
+
+def is_public_address(address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> bool:
+    """Whether the address is on the internet, not private, loopback, link-local or reserved."""
+    return address.is_global and not address.is_multicast
+
+
+def check_url(url: str) -> None:
+    """Raise a FetchError unless the URL is http or https and its host only resolves to public
+    addresses, so user supplied URLs cannot reach the server's own network."""
+    if not url.startswith(("http://", "https://")):
+        raise FetchError(f"Only http and https URLs can be fetched, not {url!r}.")
+    parts = urlsplit(url)
+    if not parts.hostname:
+        raise FetchError(f"The URL {url!r} has no host.")
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError, ValueError) as error:
+        raise FetchError(f"Could not resolve {parts.hostname}: {error}") from error
+    for *_, sockaddr in addresses:
+        # IPv6 addresses may carry a scope like fe80::1%eth0
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not is_public_address(address):
+            raise FetchError(f"{parts.hostname} is not a public address and cannot be fetched.")
+
+
+class PostingFetcher:
+    """Downloads pages over a pooled HTTP session and caches their text on disk.
+
+    Cached entries are used as they are for `max_age` seconds. After that they are revalidated
+    with the ETag and Last-Modified of the response, so an unchanged page costs a 304 without a
+    body. Responses larger than `max_bytes` are cut off and rejected while they are read. Only
+    public hosts are requested, redirects included.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | None = None,
+        timeout: float | None = None,
+        max_bytes: int | None = None,
+        max_age: float | None = None,
+        max_redirects: int | None = None,
+    ):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_redirects = max_redirects
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self._session: requests.Session | None = None
+        self._lock = threading.Lock()
+
+    def _setting(self, name: str):
+        value = getattr(self, name)
+        return app.config[f"FETCH_{name.upper()}"] if value is None else value
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=app.config["FETCH_POOL_SIZE"],
+                        pool_maxsize=app.config["FETCH_POOL_SIZE"],
+                        max_retries=Retry(
+                            total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]
+                        ),
+                    )
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers["User-Agent"] = app.config["FETCH_USER_AGENT"]
+                    self._session = session
+        return self._session
+
+    def fetch(self, url: str) -> str:
+        """The text of the posting at the URL, from the cache if it is still valid."""
+        if not url.startswith(("http://", "https://")):
+            raise FetchError(f"Only http and https URLs can be fetched, not {url!r}.")
+        path = self._cache_path(url)
+        entry = self._read_cache(path)
+        if entry is not None and time.time() - entry["fetched"] < self._setting("max_age"):
+            with self._lock:
+                self.hits += 1
+            return entry["text"]
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with self._get(url, headers) as response:
+                if response.status_code == 304 and entry is not None:
+                    entry["fetched"] = time.time()
+                    self._write_cache(path, entry)
+                    with self._lock:
+                        self.revalidated += 1
+                    return entry["text"]
+                response.raise_for_status()
+                content = self._read_body(response)
+                text = extract_text(content, response.headers.get("Content-Type", ""))
+        except requests.RequestException as error:
+            raise FetchError(f"Could not download {url}: {error}") from error
+
+        if not text:
+            raise FetchError(f"No text was found at {url}.")
+        self._write_cache(
+            path,
+            {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched": time.time(),
+                "text": text,
+            },
+        )
+        with self._lock:
+            self.downloads += 1
+        return text
+
+    def _get(self, url: str, headers: dict) -> requests.Response:
+        """The response of the URL after its redirects, every target is checked first."""
+        for _ in range(self._setting("max_redirects") + 1):
+            check_url(url)
+            response = self.session.get(
+                url,
+                headers=headers,
+                timeout=self._setting("timeout"),
+                stream=True,
+                allow_redirects=False,
+            )
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers["Location"])
+        raise FetchError(f"More than {self._setting('max_redirects')} redirects.")
+
+    def _read_body(self, response: requests.Response) -> bytes:
+        max_bytes = self._setting("max_bytes")
+        if int(response.headers.get("Content-Length") or 0) > max_bytes:
+            raise FetchError(f"The page is larger than {max_bytes} bytes.")
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            # the announced length may be missing or wrong
+            if size > max_bytes:
+                raise FetchError(f"The page is larger than {max_bytes} bytes.")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _cache_path(self, url: str) -> str:
+        return os.path.join(self._setting("cache_dir"), sha256(url.encode("utf-8")).hexdigest())
+
+    def _read_cache(self, path: str) -> dict | None:
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, path: str, entry: dict) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # written to a temporary file first, so readers never see a partial entry
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(temporary, path)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "downloads": self.downloads}
+
+
+def extract_text(content: bytes, content_type: str = "text/html") -> str:
+    """The main text of a page, without navigation, scripts and other page furniture."""
+    if content_type.startswith("text/plain"):
+        return normalize_text(content.decode("utf-8", errors="replace"))
+    soup = BeautifulSoup(content, "html.parser")
+
+    # job boards describe their postings for search engines, which is the cleanest source
+    for script in soup.find_all("script", type="application/ld+json"):
+        description = _structured_description(script.string or "")
+        if description:
+            return _block_text(BeautifulSoup(description, "html.parser"))
+
+    for tag in soup(NOISE_TAGS):
+        tag.decompose()
+    main = next(
+        (element for element in map(soup.select_one, MAIN_SELECTORS) if element is not None),
+        soup.body or soup,
+    )
+    return _block_text(main)
+
+
+def _block_text(element) -> str:
+    # inline elements like <b> stay within their line
+    for tag in element.find_all(PARAGRAPH_TAGS):
+        tag.insert_after("\n\n")
+    for tag in element.find_all(LINE_TAGS):
+        tag.insert_after("\n")
+    return normalize_text(element.get_text())
+
+
+def _structured_description(data: str) -> str | None:
+    try:
+        items = json.loads(data)
+    except ValueError:
+        return None
+    if isinstance(items, dict):
+        items = items.get("@graph", [items])
+    if not isinstance(items, list):
+        return None
+    for item in items:
+        if isinstance(item, dict) and item.get("@type") == "JobPosting":
+            return item.get("description")
+    return None
+
+
+posting_fetcher = PostingFetcher()
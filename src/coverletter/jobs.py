@@ -0,0 +1,211 @@
+"""Background execution of cover letter generation jobs.
+
+Jobs are persisted as `GenerationJob` rows, so the queue itself only holds job ids. Any job that
+is still queued when the process restarts is picked up again by `GenerationQueue.recover`.
+"""
+
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from datetime import datetime as DateTime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import or_, update
+
+from coverletter import app, db
+from coverletter.db_models import CoverLetter, GenerationJob
+
+
+class InlineExecutor(Executor):
+    """Executor that runs every submitted callable immediately in the calling thread."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        return future
+
+
+class GenerationQueue:
+    """Runs generation jobs on a bounded pool of workers.
+
+    The handler receives the claimed `GenerationJob` inside an application context and returns
+    the generated `CoverLetter`. Status bookkeeping and error capture are done by the queue.
+    """
+
+    def __init__(self, handler: Callable[[GenerationJob], CoverLetter]):
+        self.handler = handler
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        # timers of jobs that were submitted with a delay, with the futures of the jobs
+        self._timers: dict[threading.Timer, Future] = {}
+        # jobs that were submitted but have not finished yet
+        self.pending = 0
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self) -> None:
+        """Create the worker pool and requeue jobs left over from a previous run."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = self._create_executor()
+        self.recover()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            timers, self._timers = self._timers, {}
+            self.pending -= len(timers)
+        # delayed jobs stay queued in the database and are recovered on the next start
+        for timer, future in timers.items():
+            timer.cancel()
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def submit(self, job: GenerationJob, delay: float = 0) -> Future:
+        """Schedule a committed job for execution, after `delay` seconds if given.
+
+        Until then the job can be claimed by someone else, e.g. the stream endpoint, and the
+        worker skips it once the delay is over.
+        """
+        if self._executor is None:
+            self.start()
+        if delay <= 0:
+            return self._submit(job.id)
+
+        future = Future()
+        timer = threading.Timer(delay, self._submit_delayed, args=(job.id, future))
+        timer.daemon = True
+        with self._lock:
+            self.pending += 1
+            self._timers[timer] = future
+        timer.start()
+        return future
+
+    def run_batch(self, job_ids: list[int], parallelism: int) -> None:
+        """Run committed jobs concurrently, at most `parallelism` at a time, and wait for all.
+
+        Batches get their own pool so that they neither wait behind nor starve the jobs of
+        single letters.
+        """
+        if not job_ids:
+            return
+        if app.config["GENERATION_QUEUE_BACKEND"] == "inline":
+            executor = InlineExecutor()
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=max(1, min(parallelism, len(job_ids))), thread_name_prefix="batch"
+            )
+        with executor:
+            list(executor.map(self._run, job_ids))
+
+    def recover(self) -> int:
+        """Requeue pending jobs and jobs whose worker died while running them."""
+        cutoff = DateTime.now(timezone.utc) - timedelta(
+            seconds=app.config["GENERATION_JOB_TIMEOUT"]
+        )
+        with app.app_context():
+            db.session.execute(
+                update(GenerationJob)
+                .where(GenerationJob.status == GenerationJob.RUNNING)
+                .where(or_(GenerationJob.started.is_(None), GenerationJob.started < cutoff))
+                .values(status=GenerationJob.QUEUED, started=None)
+            )
+            db.session.commit()
+            job_ids = db.session.scalars(
+                db.select(GenerationJob.id)
+                .where(GenerationJob.status == GenerationJob.QUEUED)
+                .order_by(GenerationJob.id)
+            ).all()
+        for job_id in job_ids:
+            self._submit(job_id)
+        if job_ids:
+            app.logger.info("Requeued %d pending generation jobs", len(job_ids))
+        return len(job_ids)
+
+    def _submit(self, job_id: int) -> Future:
+        with self._lock:
+            self.pending += 1
+        future = self._executor.submit(self._run, job_id)
+        future.add_done_callback(self._done)
+        return future
+
+    def _submit_delayed(self, job_id: int, future: Future) -> None:
+        with self._lock:
+            # gone if the queue was shut down meanwhile, which already cancelled the job
+            if self._timers.pop(threading.current_thread(), None) is None:
+                return
+            executor = self._executor
+        inner = executor.submit(self._run, job_id)
+        inner.add_done_callback(self._done)
+        inner.add_done_callback(lambda done: _copy_result(done, future))
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    def _create_executor(self) -> Executor:
+        backend = app.config["GENERATION_QUEUE_BACKEND"]
+        if backend == "inline":
+            return InlineExecutor()
+        if backend == "thread":
+            return ThreadPoolExecutor(
+                max_workers=app.config["GENERATION_WORKERS"], thread_name_prefix="generation"
+            )
+        raise ValueError(f"Unknown generation queue backend: {backend}")
+
+    def claim(self, job_id: int) -> GenerationJob | None:
+        """Atomically move a job from queued to running, so it is executed only once."""
+        claimed = db.session.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == job_id, GenerationJob.status == GenerationJob.QUEUED)
+            .values(status=GenerationJob.RUNNING, started=DateTime.now(timezone.utc))
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return None
+        return db.session.get(GenerationJob, job_id)
+
+    def finish(
+        self,
+        job: GenerationJob,
+        cover_letter: CoverLetter | None = None,
+        error: Exception | None = None,
+    ) -> None:
+        """Record the outcome of a claimed job."""
+        if error is not None:
+            db.session.rollback()
+            job.status = GenerationJob.FAILED
+            job.error = str(error) or error.__class__.__name__
+        else:
+            job.cover_letter = cover_letter
+            job.status = GenerationJob.DONE
+        job.finished = DateTime.now(timezone.utc)
+        db.session.commit()
+
+    def _run(self, job_id: int) -> None:
+        with app.app_context():
+            job = self.claim(job_id)
+            if job is None:
+                return
+            try:
+                cover_letter = self.handler(job)
+            except Exception as error:
+                app.logger.exception("Generation job %d failed", job_id)
+                self.finish(job, error=error)
+            else:
+                self.finish(job, cover_letter)
+
+
+def _copy_result(source: Future, target: Future) -> None:
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
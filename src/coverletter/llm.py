@@ -0,0 +1,308 @@
+"""Clients for the text generation models used to write cover letters."""
+
+import hashlib
+import json
+from abc import ABC, abstractmethod
+import random
+import re
+import threading
+import time
+from typing import Any, Hashable, Iterator
+
+from coverletter import app
+from coverletter.cache import TTLCache
+from coverletter.db_models import ModelConfig
+
+
+class Provider(ABC):
+    """A backend that loads models and generates text with them.
+
+    `PARAMETERS` maps the generation parameters of a `ModelConfig` to the keyword arguments the
+    backend understands. Parameters that are not mapped are not supported and dropped.
+    """
+
+    name = ""
+    PARAMETERS: dict[str, str] = {}
+    # names of the exceptions that signal a temporary failure, e.g. an exhausted quota
+    RETRYABLE_ERRORS: tuple[str, ...] = ()
+
+    def is_retryable(self, error: Exception) -> bool:
+        return type(error).__name__ in self.RETRYABLE_ERRORS
+
+    def map_parameters(self, parameters: dict[str, Any]) -> dict[str, Any]:
+        return {
+            self.PARAMETERS[name]: value
+            for name, value in parameters.items()
+            if name in self.PARAMETERS
+        }
+
+    @abstractmethod
+    def load(self, model_id: str) -> Any:
+        """The model object that `predict` and `predict_streaming` are called with."""
+
+    @abstractmethod
+    def predict(self, model: Any, prompt: str, parameters: dict[str, Any]) -> str:
+        """The full text of the response to the prompt."""
+
+    @abstractmethod
+    def predict_streaming(
+        self, model: Any, prompt: str, parameters: dict[str, Any]
+    ) -> Iterator[str]:
+        """The text of the response in chunks as they are generated."""
+
+
+class VertexProvider(Provider):
+    """Text generation models of Google Cloud Vertex AI."""
+
+    name = "vertex"
+    PARAMETERS = {
+        "temperature": "temperature",
+        "max_output_tokens": "max_output_tokens",
+        "top_k": "top_k",
+        "top_p": "top_p",
+        "stop_sequence": "stop_sequences",
+        "candidate_count": "candidate_count",
+        "logprobs": "logprobs",
+        "presence_penalty": "presence_penalty",
+        "frequency_penalty": "frequency_penalty",
+    }
+    RETRYABLE_ERRORS = (
+        "ResourceExhausted",
+        "TooManyRequests",
+        "ServiceUnavailable",
+        "DeadlineExceeded",
+        "InternalServerError",
+    )
+
+    def map_parameters(self, parameters: dict[str, Any]) -> dict[str, Any]:
+        mapped = super().map_parameters(parameters)
+        if "stop_sequences" in mapped:
+            mapped["stop_sequences"] = [mapped["stop_sequences"]]
+        if "logprobs" in mapped:
+            mapped["logprobs"] = int(mapped["logprobs"])
+        return mapped
+
+    def load(self, model_id: str) -> Any:
+        from vertexai.language_models import TextGenerationModel
+
+        return TextGenerationModel.from_pretrained(model_id)
+
+    def predict(self, model: Any, prompt: str, parameters: dict[str, Any]) -> str:
+        return model.predict(prompt, **parameters).text
+
+    def predict_streaming(
+        self, model: Any, prompt: str, parameters: dict[str, Any]
+    ) -> Iterator[str]:
+        for response in model.predict_streaming(prompt, **parameters):
+            yield response.text
+
+
+class LocalProviderError(RuntimeError):
+    """Failure injected by the local provider, treated like an exhausted quota."""
+
+
+class LocalProvider(Provider):
+    """Deterministic offline backend for tests and load tests.
+
+    The response is derived from the words of the prompt, so identical prompts give identical
+    letters. Latency, per-token delay and the failure rate are read from the app config unless
+    passed explicitly.
+    """
+
+    name = "local"
+    PARAMETERS = {"max_output_tokens": "max_output_tokens"}
+    RETRYABLE_ERRORS = ("LocalProviderError",)
+
+    def __init__(
+        self,
+        latency: float | None = None,
+        token_delay: float | None = None,
+        failure_rate: float | None = None,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _setting(self, name: str) -> float:
+        value = getattr(self, name)
+        return app.config[f"LOCAL_LLM_{name.upper()}"] if value is None else value
+
+    def load(self, model_id: str) -> Any:
+        return model_id
+
+    def predict(self, model: Any, prompt: str, parameters: dict[str, Any]) -> str:
+        return "".join(self.predict_streaming(model, prompt, parameters))
+
+    def predict_streaming(
+        self, model: Any, prompt: str, parameters: dict[str, Any]
+    ) -> Iterator[str]:
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self._setting("failure_rate")
+        time.sleep(self._setting("latency"))
+        if failed:
+            raise LocalProviderError(f"Injected failure of {model}")
+
+        token_delay = self._setting("token_delay")
+        for index, token in enumerate(self.tokens(prompt, parameters)):
+            if token_delay:
+                time.sleep(token_delay)
+            yield token if index == 0 else " " + token
+
+    @staticmethod
+    def tokens(prompt: str, parameters: dict[str, Any]) -> list[str]:
+        words = re.findall(r"\w+", prompt) or ["letter"]
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        length = min(parameters.get("max_output_tokens", 256), 256)
+        return ["Dear", "hiring", "manager,"] + [rng.choice(words) for _ in range(length - 3)]
+
+
+PROVIDERS: dict[str, Provider] = {"vertex": VertexProvider(), "local": LocalProvider()}
+
+# providers of the model families stored in `ModelConfig.name`
+MODEL_FAMILIES = {"PaLM": "vertex", "Gemini": "vertex", "local": "local"}
+
+
+def get_provider(config: ModelConfig) -> Provider:
+    """Select the provider of a config, unless LLM_PROVIDER forces one for all configs."""
+    name = app.config["LLM_PROVIDER"]
+    if not name:
+        name = MODEL_FAMILIES.get(config.name)
+    if not name:
+        name = "local" if config.model_id.startswith("local") else "vertex"
+    return PROVIDERS[name]
+
+
+class ModelClient:
+    """A loaded model bound to its provider and the generation parameters it is called with."""
+
+    def __init__(self, provider: Provider, model: Any, parameters: dict[str, Any]):
+        self.provider = provider
+        self.model = model
+        self.parameters = provider.map_parameters(parameters)
+        self.last_used = time.monotonic()
+
+    def predict(self, prompt: str) -> str:
+        return self.provider.predict(self.model, prompt, self.parameters)
+
+    def predict_streaming(self, prompt: str) -> Iterator[str]:
+        """Yield the text of the response in chunks as they are generated."""
+        return self.provider.predict_streaming(self.model, prompt, self.parameters)
+
+    def is_retryable(self, error: Exception) -> bool:
+        return self.provider.is_retryable(error)
+
+
+class ModelClientPool:
+    """Thread-safe registry of model clients keyed by provider, model id and parameters.
+
+    Loading a model imports the SDK and authenticates against the API, so clients are created
+    once per process and reused. A model is loaded under a lock of its own key, so a slow load
+    only holds up lookups of the same client. Clients that were not used for `idle_timeout`
+    seconds are dropped on the next lookup.
+    """
+
+    def __init__(self, idle_timeout: float | None = None):
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clients: dict[Hashable, ModelClient] = {}
+        # locks of the keys whose model is being loaded
+        self._loading: dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(provider: Provider, model_id: str, parameters: dict[str, Any]) -> Hashable:
+        return provider.name, model_id, tuple(sorted(parameters.items()))
+
+    def get(self, provider: Provider, model_id: str, parameters: dict[str, Any]) -> ModelClient:
+        key = self.key(provider, model_id, parameters)
+        with self._lock:
+            self._evict_idle()
+            client = self._cached(key)
+            if client is not None:
+                return client
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                # loaded by another thread while this one waited
+                client = self._cached(key)
+                if client is not None:
+                    return client
+            try:
+                client = ModelClient(provider, provider.load(model_id), parameters)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                # registered in the same step, so no thread loads the model a second time
+                self._loading.pop(key, None)
+                self.misses += 1
+                self._clients[key] = client
+                client.last_used = time.monotonic()
+                return client
+
+    def _cached(self, key: Hashable) -> ModelClient | None:
+        client = self._clients.get(key)
+        if client is not None:
+            self.hits += 1
+            client.last_used = time.monotonic()
+        return client
+
+    def for_config(self, config: ModelConfig) -> ModelClient:
+        return self.get(get_provider(config), config.model_id, config.generation_parameters())
+
+    def warm_up(self, config: ModelConfig) -> None:
+        """Load a client ahead of the first request, without failing if the API is unavailable."""
+        try:
+            self.for_config(config)
+        except Exception:
+            app.logger.warning(
+                "Could not warm up model client for %s", config.model_id, exc_info=True
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict_idle(self) -> None:
+        idle_timeout = self.idle_timeout
+        if idle_timeout is None:
+            idle_timeout = app.config["MODEL_POOL_IDLE_TIMEOUT"]
+        cutoff = time.monotonic() - idle_timeout
+        for key in [key for key, client in self._clients.items() if client.last_used < cutoff]:
+            del self._clients[key]
+            self.evictions += 1
+
+
+class ResponseCache(TTLCache):
+    """Generated responses keyed by a hash of the final prompt and the effective parameters."""
+
+    @staticmethod
+    def key(prompt: str, model_id: str, parameters: dict[str, Any]) -> str:
+        payload = json.dumps([model_id, sorted(parameters.items()), prompt])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+model_pool = ModelClientPool()
+response_cache = ResponseCache(
+    maxsize=app.config["RESPONSE_CACHE_SIZE"], ttl=app.config["RESPONSE_CACHE_TTL"]
+)
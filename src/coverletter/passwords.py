@@ -0,0 +1,65 @@
+"""Password hashing on a bounded pool of threads.
+
+Key derivation is deliberately slow. Running it on a few dedicated threads caps how many CPU
+cores a burst of logins can occupy, while the request threads keep serving other requests.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from coverletter import app
+
+
+@lru_cache
+def full_method(method: str) -> str:
+    """The method with all parameters spelled out, as it is stored in front of the hash.
+
+    Werkzeug fills in default parameters, e.g. "scrypt" is stored as "scrypt:32768:8:1".
+    """
+    return generate_password_hash("", method, salt_length=1).split("$", 1)[0]
+
+
+class PasswordHasher:
+    """Hashes and checks passwords with the configured method on at most `workers` threads."""
+
+    def __init__(self, method: str | None = None, workers: int | None = None):
+        self._method = method
+        self._workers = workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def method(self) -> str:
+        return self._method or app.config["PASSWORD_HASH_METHOD"]
+
+    def _submit(self, function, *args):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._workers or app.config["PASSWORD_HASH_WORKERS"],
+                        thread_name_prefix="password",
+                    )
+        return self._executor.submit(function, *args).result()
+
+    def hash(self, password: str) -> str:
+        return self._submit(generate_password_hash, password, self.method)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        return self._submit(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether the hash was made with another method or other parameters than configured."""
+        return password_hash.split("$", 1)[0] != full_method(self.method)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+hasher = PasswordHasher()
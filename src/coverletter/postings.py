@@ -0,0 +1,53 @@
+"""Normalization of job postings, so that the same posting is stored only once."""
+
+import json
+import re
+from hashlib import sha256
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# query parameters that only track where a visitor came from
+TRACKING_PARAMETERS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "_hsenc"}
+TRACKING_PREFIXES = ("utm_",)
+
+
+def normalize_url(url: str | None) -> str | None:
+    """The URL without tracking parameters and fragment, with a lowercase scheme and host and
+    sorted query parameters."""
+    url = (url or "").strip()
+    if not url:
+        return None
+    parts = urlsplit(url)
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMETERS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    path = parts.path.rstrip("/") if parts.path != "/" else ""
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+
+def normalize_text(text: str | None) -> str:
+    """The text with single spaces within lines and at most one empty line between paragraphs."""
+    lines = [" ".join(line.split()) for line in (text or "").splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def normalize_field(value: str | None) -> str | None:
+    return (" ".join(value.split()) or None) if value else None
+
+
+def posting_hash(
+    text: str, company: str | None = None, location: str | None = None, language: str | None = None
+) -> str:
+    """Hash of everything of a posting that ends up in the prompt, after normalization.
+
+    The URL is not part of it, the same posting may be pasted without its URL or reached through
+    different links.
+    """
+    values = {
+        "text": normalize_text(text),
+        "company": normalize_field(company) or "",
+        "location": normalize_field(location) or "",
+        "language": (language or "").lower(),
+    }
+    return sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
@@ -0,0 +1,187 @@
+"""Assembly of generation prompts within a budget of input tokens."""
+
+import re
+from datetime import datetime as DateTime
+from typing import Callable, Iterable
+
+from coverletter.db_models import ResumeItem
+
+# templates are never changed in place, so that stored prompts can be rendered again
+PROMPT_TEMPLATES = {
+    1: (
+        "Your task is to generate a cover letter for applicant {name} and company {company}"
+        "\n for the following application: \n{posting}"
+        "\n Based on the following CV: \n{resume}"
+        "\n It is crucial to not hallucinate skills or experiences that are not present in the CV! "
+        "Try to make the cover letter as relevant as possible. \n"
+    ),
+}
+PROMPT_TEMPLATE_VERSION = 1
+
+# words and single punctuation marks, long words count as one token per four characters
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+CHARACTERS_PER_TOKEN = 4
+
+# paragraphs of postings that rarely say anything about the job itself
+BOILERPLATE_PATTERN = re.compile(
+    r"equal (employment )?opportunit|diversity|inclusi|discriminat|regardless of|"
+    r"privacy|data protection|gdpr|cookie|all rights reserved|disclaimer|"
+    r"follow us|about us|who we are|apply now|how to apply|application process|"
+    r"recruitment agenc|we look forward to|benefits|perks",
+    re.IGNORECASE,
+)
+
+RESUME_HEADER = (
+    "| Category | Title | Description | Begin Date | End Date | Grade | Location |\n"
+    "|----------|-------|-------------|------------|----------|-------|----------|\n"
+)
+
+
+def render_prompt(
+    template_version: int, name: str, company: str | None, posting: str, resume: str
+) -> str:
+    return PROMPT_TEMPLATES[template_version].format(
+        name=name, company=company or "", posting=posting, resume=resume
+    )
+
+
+def _word_tokens(word: str) -> int:
+    return -(-len(word) // CHARACTERS_PER_TOKEN)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate number of model tokens of a text, without calling the model API.
+
+    Subword tokenizers split rare and long words into pieces of a few characters, so every word
+    costs one token per started four characters and every punctuation mark one token.
+    """
+    return sum(_word_tokens(match.group()) for match in TOKEN_PATTERN.finditer(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text after its first `max_tokens` tokens."""
+    tokens = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        tokens += _word_tokens(match.group())
+        if tokens > max_tokens:
+            return text[: match.start()].rstrip()
+    return text
+
+
+def strip_boilerplate(text: str) -> str:
+    """Remove paragraphs about benefits, legal notices and the application process."""
+    paragraphs = re.split(r"\n\s*\n", text)
+    kept = [paragraph for paragraph in paragraphs if not BOILERPLATE_PATTERN.search(paragraph)]
+    return "\n\n".join(kept)
+
+
+def render_resume_row(item: ResumeItem) -> str:
+    begin_date = item.begin_date if item.begin_date else ""
+    end_date = item.end_date if item.end_date else ""
+    grade = item.grade if item.grade else ""
+    location = item.location if item.location else ""
+    return (
+        f"| {item.category} | {item.title} | {item.description} | {begin_date} "
+        f"| {end_date} | {grade} | {location} |\n"
+    )
+
+
+def render_resume_table(resume_items: Iterable[ResumeItem]) -> str:
+    """Markdown table of resume items, sorted by category and then by begin date."""
+    # items without a date come first within their category
+    resume_items = sorted(
+        resume_items, key=lambda item: (item.category, item.begin_date or DateTime.min)
+    )
+    return RESUME_HEADER + "".join(render_resume_row(item) for item in resume_items)
+
+
+class PromptBuilder:
+    """Builds the prompt of a cover letter and trims it to a budget of input tokens.
+
+    Sections are trimmed from the lowest value up until the prompt fits: first boilerplate
+    paragraphs of the posting, then resume items by age, oldest first, and finally the posting is
+    cut off. With a `relevance` score per item title the least relevant items go first and age
+    only breaks ties. Items without a date, e.g. skills, are never dropped. The rendered
+    `resume_table` is used as is while no resume item has to go, `resume_items` is only called to
+    load the items when they have to be trimmed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        company: str | None,
+        posting: str,
+        resume_table: str,
+        resume_items: Callable[[], Iterable[ResumeItem]] | None = None,
+        relevance: dict[str, float] | None = None,
+    ):
+        self.name = name
+        self.company = company or ""
+        self.posting = posting
+        self.resume_table = resume_table
+        self.resume_items = resume_items
+        self.relevance = relevance
+        # the sections as they are in the built prompt
+        self.posting_section = posting
+        self.resume_section = resume_table
+        self.input_tokens = 0
+        self.posting_tokens = 0
+        self.resume_tokens = 0
+        # names of the trimming steps that were applied
+        self.trimmed: list[str] = []
+
+    def render(self, posting: str, resume: str) -> str:
+        return render_prompt(PROMPT_TEMPLATE_VERSION, self.name, self.company, posting, resume)
+
+    def build(self, max_input_tokens: int | None = None) -> str:
+        posting, resume = self.posting, self.resume_table
+        self.trimmed = []
+        # tokens of the instructions around the sections
+        fixed_tokens = count_tokens(self.render("", ""))
+        posting_tokens, resume_tokens = count_tokens(posting), count_tokens(resume)
+
+        def excess() -> int:
+            if max_input_tokens is None:
+                return 0
+            return fixed_tokens + posting_tokens + resume_tokens - max_input_tokens
+
+        if excess() > 0:
+            stripped = strip_boilerplate(posting)
+            if stripped != posting:
+                posting, posting_tokens = stripped, count_tokens(stripped)
+                self.trimmed.append("boilerplate")
+
+        if excess() > 0 and self.resume_items is not None:
+            resume, resume_tokens = self._drop_items(excess())
+
+        if excess() > 0:
+            posting = truncate_tokens(posting, max(0, posting_tokens - excess()))
+            posting_tokens = count_tokens(posting)
+            self.trimmed.append("truncated")
+
+        self.posting_section, self.resume_section = posting, resume
+        self.posting_tokens = posting_tokens
+        self.resume_tokens = resume_tokens
+        self.input_tokens = fixed_tokens + posting_tokens + resume_tokens
+        return self.render(posting, resume)
+
+    def _drop_items(self, excess: int) -> tuple[str, int]:
+        items = list(self.resume_items())
+        rows = {id(item): count_tokens(render_resume_row(item)) for item in items}
+        relevance = self.relevance or {}
+        dated = sorted(
+            (item for item in items if item.end_date or item.begin_date),
+            key=lambda item: (relevance.get(item.title, 0.0), item.end_date or item.begin_date),
+        )
+        dropped = set()
+        for item in dated:
+            if excess <= 0:
+                break
+            dropped.add(id(item))
+            excess -= rows[id(item)]
+        if dropped:
+            self.trimmed.append("resume_items")
+        kept = [item for item in items if id(item) not in dropped]
+        return render_resume_table(kept), count_tokens(RESUME_HEADER) + sum(
+            rows[id(item)] for item in kept
+        )
@@ -0,0 +1,124 @@
+"""Relevance of resume items to a job posting, to keep only the strongest items in a prompt."""
+
+import re
+from collections import Counter
+from datetime import datetime as DateTime
+from typing import Iterable
+
+import numpy as np
+
+from coverletter import app
+from coverletter.cache import TTLCache
+from coverletter.db_models import Resume, ResumeItem
+
+WORD_PATTERN = re.compile(r"\w+")
+# words that say nothing about a skill or an experience, in the languages of the resumes
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or our the to we will with you "
+    "your der die das und oder ein eine für mit von zu im in ist sind wir sie ihr auf als bei".split()
+)
+
+# saturation of repeated terms and normalization by the length of an item
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        word
+        for word in WORD_PATTERN.findall(text.lower())
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+
+
+def item_text(item: ResumeItem) -> str:
+    # the title counts twice, it names the skill or role
+    return " ".join([item.title, item.title, item.description or "", item.location or ""])
+
+
+class ResumeIndex:
+    """BM25 weights of the terms of every item of one resume version.
+
+    The weights only depend on the items, so the matrix is built once per resume version and
+    scoring a posting is a single matrix-vector product over the terms the posting contains.
+    """
+
+    def __init__(self, items: Iterable[ResumeItem]):
+        items = list(items)
+        self.titles = [item.title for item in items]
+        self.categories = [item.category for item in items]
+        # rankings only matter for categories with more items than are kept
+        self.largest_category = max(Counter(self.categories).values(), default=0)
+        # newer items win ties, items without a date lose them
+        self.recency = np.array(
+            [(item.begin_date or DateTime.min).toordinal() for item in items], dtype=np.int64
+        )
+
+        documents = [tokenize(item_text(item)) for item in items]
+        self.vocabulary: dict[str, int] = {}
+        rows, columns = [], []
+        for row, terms in enumerate(documents):
+            for term in terms:
+                rows.append(row)
+                columns.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+        counts = np.zeros((len(items), len(self.vocabulary)), dtype=np.float32)
+        np.add.at(counts, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)), 1)
+
+        lengths = counts.sum(axis=1, keepdims=True)
+        average_length = float(lengths.mean()) if len(items) else 0.0
+        document_frequency = (counts > 0).sum(axis=0)
+        idf = np.log1p((len(items) - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(average_length, 1.0))
+        self.weights = (idf * counts * (BM25_K1 + 1) / (counts + norm)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def scores(self, posting: str) -> np.ndarray:
+        """BM25 score of every item for the terms of the posting."""
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        columns = [
+            self.vocabulary[term] for term in set(tokenize(posting)) if term in self.vocabulary
+        ]
+        query[columns] = 1
+        return self.weights @ query
+
+    def top_items(self, posting: str, per_category: int) -> dict[str, float]:
+        """Titles and scores of the `per_category` best items of every category."""
+        scores = self.scores(posting)
+        # best first, newer first among equal scores
+        order = np.lexsort((-self.recency, -scores))
+        kept: dict[str, float] = {}
+        taken: dict[str, int] = {}
+        for row in order:
+            category = self.categories[row]
+            if taken.get(category, 0) < per_category:
+                taken[category] = taken.get(category, 0) + 1
+                kept[self.titles[row]] = float(scores[row])
+        return kept
+
+
+resume_indexes = TTLCache(
+    maxsize=app.config["RESUME_INDEX_CACHE_SIZE"], ttl=app.config["RESUME_INDEX_CACHE_TTL"]
+)
+
+
+def resume_index(resume: Resume) -> ResumeIndex:
+    """The index of the current version of the resume, built from its items on a cache miss."""
+    key = (resume.id, resume.version)
+    index = resume_indexes.get(key)
+    if index is None:
+        index = ResumeIndex(resume.resume_items)
+        resume_indexes.set(key, index)
+    return index
+
+
+def rank_resume_items(resume: Resume, posting: str, per_category: int) -> dict[str, float] | None:
+    """Titles and scores of the items that are relevant enough for the prompt, or None when
+    every item is kept and the resume can be used as it is."""
+    if per_category <= 0:
+        return None
+    index = resume_index(resume)
+    if index.largest_category <= per_category:
+        return None
+    return index.top_items(posting, per_category)
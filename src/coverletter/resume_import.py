@@ -0,0 +1,262 @@
+"""Import of many resume items at once from a JSON Resume document or a CSV file.
+
+Every item is validated with the rules of the resume item form and the whole document is
+rejected if any item is invalid. The items are then written in one INSERT ... ON CONFLICT
+statement: an item whose title the resume already has replaces the stored item, and of items
+with the same title in one document the last one wins.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime as DateTime
+
+from coverletter import app, db
+from coverletter.db_models import DIALECT_INSERTS, Resume, ResumeItem
+
+RESUME_CATEGORIES = [
+    "education",
+    "work",
+    "project",
+    "skill",
+    "language",
+    "certification",
+    "volunteer",
+    "course",
+]
+# categories of items that happened at a place and in a period of time
+DATED_CATEGORIES = ("work", "project", "volunteer")
+IMPORT_FORMATS = ("json", "csv")
+ITEM_COLUMNS = ("title", "description", "category", "begin_date", "end_date", "grade", "location")
+REQUIRED_COLUMNS = ("title", "description", "category")
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m", "%Y")
+
+
+class ResumeImportError(Exception):
+    """Raised with all problems of a document, none of its items are imported then."""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def category_error(category, grade, location, begin_date, end_date) -> str | None:
+    """Why an item of the category is incomplete, None if it has everything the category needs."""
+    if category not in RESUME_CATEGORIES:
+        return "Please select a category."
+    if category == "education" and not grade:
+        return "Grade is required for education items."
+    if category in DATED_CATEGORIES and not location:
+        return "Location is required for work, project, and volunteer items."
+    if category in DATED_CATEGORIES and not begin_date:
+        return "Begin date is required for work, project, and volunteer items."
+    if category in DATED_CATEGORIES and not end_date:
+        return "End date is required for work, project, and volunteer items."
+    return None
+
+
+def format_of(filename: str | None) -> str | None:
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def parse_date(value) -> DateTime | None:
+    value = str(value or "").strip()
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return DateTime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"{value!r} is not a date like YYYY-MM-DD, YYYY-MM or YYYY.")
+
+
+def parse_grade(value) -> float | None:
+    value = str(value or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{value!r} is not a number.") from None
+
+
+def clean_item(raw: dict) -> tuple[dict | None, list[str]]:
+    """The item with parsed values, or None and the reasons why it is invalid."""
+    item = {column: str(raw.get(column) or "").strip() or None for column in ITEM_COLUMNS}
+    errors = [f"{column} is missing." for column in REQUIRED_COLUMNS if not item[column]]
+    if item["title"] and len(item["title"]) > ResumeItem.title.type.length:
+        errors.append(f"title is longer than {ResumeItem.title.type.length} characters.")
+    if item["category"] and item["category"] not in RESUME_CATEGORIES:
+        errors.append(f"Unknown category {item['category']!r}.")
+    for column, parse in [
+        ("begin_date", parse_date),
+        ("end_date", parse_date),
+        ("grade", parse_grade),
+    ]:
+        try:
+            item[column] = parse(item[column])
+        except ValueError as error:
+            errors.append(f"{column}: {error}")
+    if errors:
+        return None, errors
+
+    error = category_error(
+        item["category"], item["grade"], item["location"], item["begin_date"], item["end_date"]
+    )
+    if error:
+        errors.append(error)
+    if item["begin_date"] and item["end_date"] and item["begin_date"] > item["end_date"]:
+        errors.append("Begin date must be before end date.")
+    return (None if errors else item), errors
+
+
+def joined(*parts, separator: str = ", ") -> str:
+    return separator.join(str(part).strip() for part in parts if part and str(part).strip())
+
+
+def described(summary: str | None, highlights: list | None) -> str:
+    return joined(summary, *(f"- {highlight}" for highlight in highlights or []), separator="\n")
+
+
+# JSON Resume sections (https://jsonresume.org/schema) that map to a resume category, the
+# others like awards, publications or references have no place in a resume here
+JSON_RESUME_SECTIONS = {
+    "work": lambda entry: {
+        "title": joined(entry.get("position"), entry.get("name")),
+        "description": described(entry.get("summary"), entry.get("highlights")),
+        "category": "work",
+        "begin_date": entry.get("startDate"),
+        "end_date": entry.get("endDate"),
+        "location": entry.get("location"),
+    },
+    "volunteer": lambda entry: {
+        "title": joined(entry.get("position"), entry.get("organization")),
+        "description": described(entry.get("summary"), entry.get("highlights")),
+        "category": "volunteer",
+        "begin_date": entry.get("startDate"),
+        "end_date": entry.get("endDate"),
+        "location": entry.get("location"),
+    },
+    "education": lambda entry: {
+        "title": joined(
+            joined(entry.get("studyType"), entry.get("area"), separator=" "),
+            entry.get("institution"),
+        ),
+        "description": joined(*entry.get("courses") or [])
+        or joined(entry.get("studyType"), entry.get("area"), separator=" "),
+        "category": "education",
+        "begin_date": entry.get("startDate"),
+        "end_date": entry.get("endDate"),
+        "grade": entry.get("score"),
+        "location": entry.get("location"),
+    },
+    "projects": lambda entry: {
+        "title": entry.get("name"),
+        "description": described(entry.get("description"), entry.get("highlights")),
+        "category": "project",
+        "begin_date": entry.get("startDate"),
+        "end_date": entry.get("endDate"),
+        "location": entry.get("location") or entry.get("entity"),
+    },
+    "skills": lambda entry: {
+        "title": entry.get("name"),
+        "description": joined(*entry.get("keywords") or []) or entry.get("level"),
+        "category": "skill",
+    },
+    "languages": lambda entry: {
+        "title": entry.get("language"),
+        "description": entry.get("fluency"),
+        "category": "language",
+    },
+    "certificates": lambda entry: {
+        "title": entry.get("name"),
+        "description": joined(entry.get("issuer"), entry.get("url")) or entry.get("name"),
+        "category": "certification",
+        "begin_date": entry.get("date"),
+    },
+}
+
+
+def json_resume_items(data: bytes | str) -> list[tuple[str, dict]]:
+    """The raw items of a JSON Resume document with the place where each one was found."""
+    try:
+        document = json.loads(data)
+    except ValueError as error:
+        raise ResumeImportError([f"The document is not valid JSON: {error}"])
+    if not isinstance(document, dict):
+        raise ResumeImportError(["A JSON Resume document is an object with a list per section."])
+    items, errors = [], []
+    for section, convert in JSON_RESUME_SECTIONS.items():
+        entries = document.get(section) or []
+        if not isinstance(entries, list):
+            errors.append(f"{section}: expected a list.")
+            continue
+        for position, entry in enumerate(entries):
+            if isinstance(entry, dict):
+                items.append((f"{section}[{position}]", convert(entry)))
+            else:
+                errors.append(f"{section}[{position}]: expected an object.")
+    if errors:
+        raise ResumeImportError(errors)
+    return items
+
+
+def csv_items(data: bytes | str) -> list[tuple[str, dict]]:
+    """The raw items of a CSV file with a header row of resume item columns."""
+    if isinstance(data, bytes):
+        # spreadsheets put a byte order mark in front of UTF-8
+        data = data.decode("utf-8-sig", errors="replace")
+    reader = csv.DictReader(io.StringIO(data))
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ResumeImportError([f"The header has no column {column!r}." for column in missing])
+    return [(f"line {reader.line_num}", row) for row in reader]
+
+
+def parse_items(data: bytes | str, import_format: str) -> list[dict]:
+    """The validated items of a document, raises ResumeImportError with every invalid item."""
+    raw_items = json_resume_items(data) if import_format == "json" else csv_items(data)
+    if not raw_items:
+        raise ResumeImportError(["The document has no resume items."])
+    if len(raw_items) > app.config["RESUME_IMPORT_MAX_ITEMS"]:
+        raise ResumeImportError(
+            [f"At most {app.config['RESUME_IMPORT_MAX_ITEMS']} items can be imported at once."]
+        )
+    items, errors = [], []
+    for source, raw in raw_items:
+        item, item_errors = clean_item(raw)
+        errors += [f"{source}: {error}" for error in item_errors]
+        if item is not None:
+            items.append(item)
+    if errors:
+        raise ResumeImportError(errors)
+    return items
+
+
+def upsert_items(resume: Resume, items: list[dict]) -> int:
+    """Write the items into the resume in one statement and commit, returns the number of
+    distinct titles."""
+    # the last item of a title wins, a statement must not update the same row twice
+    rows = {item["title"]: item for item in items}
+    if not rows:
+        return 0
+    insert = DIALECT_INSERTS[db.session.get_bind().dialect.name]
+    # rows in primary key order, so concurrent imports lock them in the same order
+    statement = insert(ResumeItem).values(
+        [{**rows[title], "resume_id": resume.id} for title in sorted(rows)]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["resume_id", "title"],
+        set_={column: statement.excluded[column] for column in ITEM_COLUMNS if column != "title"},
+    )
+    db.session.execute(statement)
+    resume.invalidate_snapshot()
+    db.session.commit()
+    return len(rows)
+
+
+def import_items(resume: Resume, data: bytes | str, import_format: str) -> int:
+    """Validate a JSON Resume or CSV document and add or replace its items in the resume."""
+    return upsert_items(resume, parse_items(data, import_format))
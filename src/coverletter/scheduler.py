@@ -0,0 +1,200 @@
+"""Scheduling of model calls within the requests and tokens per minute quota of the API."""
+
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Hashable
+
+from coverletter import app
+from coverletter.prompts import count_tokens
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request would wait longer for quota than we are willing to queue it."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"The model quota is exhausted, retry after {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Bucket that refills `per_minute` units per minute up to its capacity of one minute."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available, 0 if they are available now."""
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def queue_wait(self, calls: int, amount: float = 1) -> float:
+        """Seconds until `calls` calls of `amount` units each are served, which may take longer
+        than one refill of the capacity. A single call never takes more than the capacity."""
+        return max(0.0, (calls * min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+def estimate_tokens(prompt: str, max_output_tokens: int | None) -> int:
+    """Rough number of quota tokens a generation consumes."""
+    return count_tokens(prompt) + (max_output_tokens or 0)
+
+
+class QuotaScheduler:
+    """Admission control, fair sharing and retries for calls against the model quota.
+
+    Every call takes one request and its estimated tokens from global per-minute buckets. Callers
+    that have to wait are queued per user and served round-robin, so one user's batch cannot
+    starve everyone else. Retryable errors are retried with exponential backoff and full jitter.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_wait: float,
+        max_queue_depth: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_wait = max_wait
+        self.max_queue_depth = max_queue_depth
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.admitted = 0
+        self.rejected = 0
+        self.retries = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self._queues: dict[Hashable, deque] = {}
+        self._turns: deque[Hashable] = deque()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config) -> "QuotaScheduler":
+        return cls(
+            requests_per_minute=config["SCHEDULER_REQUESTS_PER_MINUTE"],
+            tokens_per_minute=config["SCHEDULER_TOKENS_PER_MINUTE"],
+            max_wait=config["SCHEDULER_MAX_WAIT"],
+            max_queue_depth=config["SCHEDULER_MAX_QUEUE_DEPTH"],
+            max_retries=config["SCHEDULER_MAX_RETRIES"],
+            backoff_base=config["SCHEDULER_BACKOFF_BASE"],
+            backoff_max=config["SCHEDULER_BACKOFF_MAX"],
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def admit(self, tokens: int, backlog: int = 0) -> None:
+        """Reject a new call early if it would wait for quota longer than `max_wait` seconds.
+
+        `backlog` is the number of calls that were accepted but have not reached the scheduler
+        yet, e.g. jobs waiting for a worker. They are assumed to need as many tokens as this one.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            ahead = self.queue_depth + backlog
+            wait = max(
+                self.requests.queue_wait(ahead + 1), self.tokens.queue_wait(ahead + 1, tokens)
+            )
+            if ahead >= self.max_queue_depth or wait > self.max_wait:
+                self.rejected += 1
+                raise QuotaExceeded(retry_after=max(1, math.ceil(wait)))
+            self.admitted += 1
+
+    def acquire(self, user: Hashable, tokens: int) -> float:
+        """Block until it is the user's turn and the quota allows the call, return the wait."""
+        ticket = object()
+        started = time.monotonic()
+        with self._condition:
+            queue = self._queues.get(user)
+            if queue is None:
+                queue = self._queues[user] = deque()
+                self._turns.append(user)
+            queue.append(ticket)
+            try:
+                while True:
+                    if self._turns[0] == user and queue[0] is ticket:
+                        now = time.monotonic()
+                        self.requests.refill(now)
+                        self.tokens.refill(now)
+                        wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if wait == 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+            finally:
+                # hand the turn to the next user, this user goes to the back of the line
+                queue.remove(ticket)
+                self._turns.remove(user)
+                if queue:
+                    self._turns.append(user)
+                else:
+                    del self._queues[user]
+                self._condition.notify_all()
+
+            waited = time.monotonic() - started
+            self.calls += 1
+            self.total_wait += waited
+            self.max_observed_wait = max(self.max_observed_wait, waited)
+        return waited
+
+    def call(
+        self,
+        user: Hashable,
+        tokens: int,
+        function: Callable[[], Any],
+        is_retryable: Callable[[Exception], bool],
+    ) -> Any:
+        """Run `function` within the quota, retrying retryable errors with jittered backoff."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(user, tokens)
+            try:
+                return function()
+            except Exception as error:
+                if attempt == self.max_retries or not is_retryable(error):
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+                app.logger.warning(
+                    "Retrying model call in %.1fs after %s", delay, error.__class__.__name__
+                )
+                with self._condition:
+                    self.retries += 1
+                time.sleep(delay)
+
+    def stats(self) -> dict[str, int | float]:
+        with self._condition:
+            return {
+                "queue_depth": self.queue_depth,
+                "users_waiting": len(self._queues),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "retries": self.retries,
+                "calls": self.calls,
+                "average_wait": self.total_wait / self.calls if self.calls else 0.0,
+                "max_wait": self.max_observed_wait,
+            }
+
+
+scheduler = QuotaScheduler.from_config(app.config)
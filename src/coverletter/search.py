@@ -0,0 +1,133 @@
+"""Full-text search over the cover letters of a user and the postings they were written for.
+
+Every cover letter has one search document with the company, location and text of its posting
+and the generated response. SQLite stores the documents in an FTS5 table, PostgreSQL in a table
+with a weighted tsvector and a GIN index. The text columns are stored compressed, so documents
+are written by the application whenever a cover letter is flushed, not by database triggers.
+"""
+
+import re
+
+from sqlalchemy import Connection, event, text
+from sqlalchemy.orm import Session
+
+from coverletter import db
+from coverletter.db_models import CoverLetter
+
+SEARCH_TABLE = "cover_letter_search"
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "company, location, posting, response, user_id UNINDEXED, tokenize = 'porter unicode61')"
+]
+POSTGRES_DDL = [
+    f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+    "cover_letter_id INTEGER PRIMARY KEY REFERENCES cover_letters (id) ON DELETE CASCADE, "
+    "user_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_user_id ON {SEARCH_TABLE} (user_id)",
+]
+
+# relevance of a match in the company, location, posting and response, in this order
+WEIGHTS = (4.0, 2.0, 1.0, 1.0)
+
+
+def create_search_table(connection: Connection) -> None:
+    statements = POSTGRES_DDL if connection.dialect.name == "postgresql" else SQLITE_DDL
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def drop_search_table(connection: Connection) -> None:
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+
+@event.listens_for(db.metadata, "after_create")
+def create_search_table_with_metadata(target, connection: Connection, **kwargs) -> None:
+    create_search_table(connection)
+
+
+@event.listens_for(db.metadata, "before_drop")
+def drop_search_table_with_metadata(target, connection: Connection, **kwargs) -> None:
+    drop_search_table(connection)
+
+
+def search_document(cover_letter: CoverLetter) -> dict:
+    posting = cover_letter.prompt.posting
+    return {
+        "id": cover_letter.id,
+        "user_id": cover_letter.user_id,
+        "company": posting.company or "",
+        "location": posting.location or "",
+        "posting": posting.text or "",
+        "response": cover_letter.response or "",
+    }
+
+
+def index_documents(connection: Connection, documents: list[dict]) -> None:
+    if connection.dialect.name == "postgresql":
+        statement = (
+            f"INSERT INTO {SEARCH_TABLE} (cover_letter_id, user_id, document) VALUES (:id, "
+            ":user_id, setweight(to_tsvector('english', :company), 'A') "
+            "|| setweight(to_tsvector('english', :location), 'B') "
+            "|| setweight(to_tsvector('english', :posting), 'C') "
+            "|| setweight(to_tsvector('english', :response), 'D'))"
+        )
+    else:
+        statement = (
+            f"INSERT INTO {SEARCH_TABLE} (rowid, company, location, posting, response, user_id) "
+            "VALUES (:id, :company, :location, :posting, :response, :user_id)"
+        )
+    connection.execute(text(statement), documents)
+
+
+def remove_documents(connection: Connection, cover_letter_ids: list[int]) -> None:
+    key = "cover_letter_id" if connection.dialect.name == "postgresql" else "rowid"
+    connection.execute(
+        text(f"DELETE FROM {SEARCH_TABLE} WHERE {key} = :id"),
+        [{"id": cover_letter_id} for cover_letter_id in cover_letter_ids],
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def index_flushed_cover_letters(session: Session, flush_context) -> None:
+    """Write the search documents of new cover letters within the same transaction."""
+    documents = [search_document(obj) for obj in session.new if isinstance(obj, CoverLetter)]
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, CoverLetter)]
+    if documents:
+        index_documents(session.connection(), documents)
+    if deleted:
+        remove_documents(session.connection(), deleted)
+
+
+def search_cover_letters(
+    user_id: int, query: str, limit: int, offset: int = 0
+) -> list[tuple[int, float]]:
+    """Ids and relevance of the user's cover letters matching all words of the query, best
+    first."""
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return []
+
+    connection = db.session.connection()
+    parameters = {"user_id": user_id, "limit": limit, "offset": offset}
+    if connection.dialect.name == "postgresql":
+        weights = "{" + ", ".join(str(weight / 4) for weight in reversed(WEIGHTS)) + "}"
+        statement = (
+            f"SELECT cover_letter_id, ts_rank('{weights}', document, query) AS score "
+            f"FROM {SEARCH_TABLE}, plainto_tsquery('english', :query) AS query "
+            "WHERE user_id = :user_id AND document @@ query "
+            "ORDER BY score DESC, cover_letter_id DESC LIMIT :limit OFFSET :offset"
+        )
+        parameters["query"] = " ".join(terms)
+    else:
+        # bm25 is lower for better matches, the unindexed user id gets no weight
+        weights = ", ".join(str(weight) for weight in WEIGHTS + (0.0,))
+        statement = (
+            f"SELECT rowid, -bm25({SEARCH_TABLE}, {weights}) AS score FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH :query AND user_id = :user_id "
+            "ORDER BY score DESC, rowid DESC LIMIT :limit OFFSET :offset"
+        )
+        # quoted terms are matched literally, so user input cannot form FTS5 syntax
+        parameters["query"] = " ".join(f'"{term}"' for term in terms)
+    return [(row[0], row[1]) for row in connection.execute(text(statement), parameters)]
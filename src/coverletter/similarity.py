@@ -0,0 +1,236 @@
+"""Near-duplicate detection of job postings with MinHash signatures and locality-sensitive hashing.
+
+Every posting is reduced to a signature of `NUM_PERMUTATIONS` minimum hashes of its word
+shingles. Two signatures agree in a position with the probability of the Jaccard similarity of
+the shingle sets. The signatures are split into `BANDS` bands and postings that share a band are
+candidates, so a lookup only compares against a few postings instead of all of them.
+
+Signatures are appended to a file of fixed-size records as postings are committed, so the index
+survives restarts and every process picks up the records the others appended.
+"""
+
+import os
+import re
+import threading
+import zlib
+
+import click
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, selectinload
+
+from coverletter import app, db
+from coverletter.db_models import CoverLetter, JobPosting, Prompt
+
+NUM_PERMUTATIONS = 128
+BANDS = 32
+ROWS = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 3
+# universal hashing (a * x + b) mod p, with a Mersenne prime above every 32 bit hash
+PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+_generator = np.random.default_rng(1)
+PERMUTATION_A = _generator.integers(1, (1 << 61) - 1, NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _generator.integers(0, (1 << 61) - 1, NUM_PERMUTATIONS, dtype=np.uint64)
+
+RECORD = np.dtype([("posting_id", "<i8"), ("signature", "<u4", NUM_PERMUTATIONS)])
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text: str) -> set[bytes]:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words).encode("utf-8")} if words else set()
+    return {
+        " ".join(words[start : start + SHINGLE_SIZE]).encode("utf-8")
+        for start in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def signature(text: str) -> np.ndarray:
+    """The MinHash signature of the word shingles of a text."""
+    hashes = np.fromiter((zlib.crc32(shingle) for shingle in shingles(text)), dtype=np.uint64)
+    if not len(hashes):
+        return np.full(NUM_PERMUTATIONS, MAX_HASH, dtype=np.uint32)
+    # wraps around on overflow like the reference implementations, which keeps it a hash family
+    permuted = (np.outer(hashes, PERMUTATION_A) + PERMUTATION_B) % PRIME & MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+class SimilarityIndex:
+    """LSH index of the MinHash signatures of all postings, backed by an append-only file.
+
+    Without an explicit path, the index of an in-memory database is not written to disk, it
+    would outlive its postings.
+    """
+
+    def __init__(self, path: str | None = None):
+        self._path = path
+        self._lock = threading.Lock()
+        self.clear()
+
+    @property
+    def path(self) -> str | None:
+        if self._path is not None:
+            return self._path
+        url = db.engine.url
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            return None
+        return app.config["SIMILARITY_INDEX_PATH"]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def clear(self) -> None:
+        """Forget the loaded signatures, the file is read again on the next refresh."""
+        with self._lock:
+            self._ids: list[int] = []
+            self._rows: dict[int, int] = {}
+            self._signatures = np.zeros((64, NUM_PERMUTATIONS), dtype=np.uint32)
+            self._buckets: list[dict[bytes, set[int]]] = [{} for _ in range(BANDS)]
+            self._offset = 0
+
+    def add(self, postings: list[tuple[int, str]]) -> None:
+        """Append the signatures of (posting id, text) pairs to the file and the index."""
+        if not postings:
+            return
+        records = np.zeros(len(postings), dtype=RECORD)
+        for record, (posting_id, text) in zip(records, postings):
+            record["posting_id"] = posting_id
+            record["signature"] = signature(text)
+        path = self.path
+        if path is None:
+            with self._lock:
+                for record in records:
+                    self._insert(int(record["posting_id"]), record["signature"])
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # whole records are appended, other processes read them on their next refresh
+        with open(path, "ab") as file:
+            file.write(records.tobytes())
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Load the records that were appended to the file since the last refresh."""
+        path = self.path
+        if path is None:
+            return
+        with self._lock:
+            try:
+                with open(path, "rb") as file:
+                    file.seek(self._offset)
+                    data = file.read()
+            except FileNotFoundError:
+                return
+            # a record that is still being written is read on the next refresh
+            complete = len(data) - len(data) % RECORD.itemsize
+            self._offset += complete
+            for record in np.frombuffer(data[:complete], dtype=RECORD):
+                self._insert(int(record["posting_id"]), record["signature"])
+
+    def _insert(self, posting_id: int, posting_signature: np.ndarray) -> None:
+        row = self._rows.get(posting_id)
+        if row is None:
+            row = self._rows[posting_id] = len(self._ids)
+            self._ids.append(posting_id)
+            if row == len(self._signatures):
+                # grown by doubling, so loading n records copies O(n) signatures
+                self._signatures = np.concatenate(
+                    [self._signatures, np.zeros_like(self._signatures)]
+                )
+        else:
+            # a posting whose id was used again, its old buckets may no longer apply
+            for band, buckets in enumerate(self._buckets):
+                key = self._signatures[row, band * ROWS : (band + 1) * ROWS].tobytes()
+                buckets.get(key, set()).discard(posting_id)
+        self._signatures[row] = posting_signature
+        for band, buckets in enumerate(self._buckets):
+            key = posting_signature[band * ROWS : (band + 1) * ROWS].tobytes()
+            buckets.setdefault(key, set()).add(posting_id)
+
+    def query(self, text: str, threshold: float) -> list[tuple[int, float]]:
+        """Ids and estimated Jaccard similarity of the postings similar to the text, best first."""
+        self.refresh()
+        query = signature(text)
+        with self._lock:
+            candidates = set()
+            for band, buckets in enumerate(self._buckets):
+                key = query[band * ROWS : (band + 1) * ROWS].tobytes()
+                candidates |= buckets.get(key, set())
+            if not candidates:
+                return []
+            ids = sorted(candidates)
+            rows = [self._rows[posting_id] for posting_id in ids]
+            similarities = (self._signatures[rows] == query).mean(axis=1)
+        matches = [
+            (posting_id, float(similarity))
+            for posting_id, similarity in zip(ids, similarities)
+            if similarity >= threshold
+        ]
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    def rebuild(self) -> int:
+        """Write the index again from all stored postings, e.g. after the file was lost."""
+        path = self.path
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        self.clear()
+        count = 0
+        query = select(JobPosting.id, JobPosting.text).execution_options(yield_per=500)
+        for partition in db.session.execute(query).partitions():
+            self.add([(posting_id, text) for posting_id, text in partition])
+            count += len(partition)
+        return count
+
+
+similarity_index = SimilarityIndex()
+
+
+@event.listens_for(Session, "after_flush")
+def collect_new_postings(session: Session, flush_context) -> None:
+    new = [obj for obj in session.new if isinstance(obj, JobPosting)]
+    if new:
+        session.info.setdefault("new_postings", []).extend((obj.id, obj.text) for obj in new)
+
+
+@event.listens_for(Session, "after_commit")
+def index_new_postings(session: Session) -> None:
+    # only committed postings are indexed, rolled back ids may be used again
+    similarity_index.add(session.info.pop("new_postings", []))
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_new_postings(session: Session) -> None:
+    session.info.pop("new_postings", None)
+
+
+def similar_coverletters(
+    user_id: int, text: str, limit: int | None = None, threshold: float | None = None
+) -> list[tuple[CoverLetter, float]]:
+    """The user's cover letters for postings similar to the text, most similar first."""
+    if limit is None:
+        limit = app.config["SIMILARITY_MAX_RESULTS"]
+    if threshold is None:
+        threshold = app.config["SIMILARITY_THRESHOLD"]
+    similarities = dict(similarity_index.query(text, threshold))
+    if not similarities:
+        return []
+    coverletters = db.session.scalars(
+        select(CoverLetter)
+        .join(CoverLetter.prompt)
+        .where(CoverLetter.user_id == user_id, Prompt.posting_id.in_(similarities))
+        .options(selectinload(CoverLetter.prompt).selectinload(Prompt.posting))
+        .order_by(CoverLetter.timestamp.desc(), CoverLetter.id.desc())
+    ).all()
+    # the newest letter per posting
+    newest = {}
+    for coverletter in coverletters:
+        newest.setdefault(coverletter.prompt.posting_id, coverletter)
+    ranked = sorted(newest.items(), key=lambda item: similarities[item[0]], reverse=True)
+    return [(coverletter, similarities[posting_id]) for posting_id, coverletter in ranked[:limit]]
+
+
+@app.cli.command("index-postings")
+def index_postings_command():
+    """Build the similarity index of job postings from the database."""
+    click.echo(f"Indexed {similarity_index.rebuild()} job postings")
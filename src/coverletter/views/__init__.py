@@ -3,3 +3,4 @@ from coverletter.views.profile import *
 from coverletter.views.routes import *
 from coverletter.views.errors import *
 from coverletter.views.resume import *
+from coverletter.views.applications import *
@@ -1,9 +1,37 @@
-from flask import redirect, render_template, session
+from flask import (
+    Response,
+    abort,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+    url_for,
+)
 from flask_login import current_user, login_required
 from flask_wtf import FlaskForm
-from wtforms import DateField, IntegerField, SelectField, StringField, SubmitField, TextAreaField
+from wtforms import (
+    BooleanField,
+    DateField,
+    IntegerField,
+    SelectField,
+    StringField,
+    SubmitField,
+    TextAreaField,
+)
 from wtforms.validators import InputRequired, Length, Optional, ValidationError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as DateTime, timedelta
+from typing import Iterator
+import base64
+import json
+import math
 import os
+import time
+
+import click
+from sqlalchemy.orm import selectinload
 
 from coverletter import app, db
 from coverletter.db_models import (
@@ -11,29 +39,214 @@ from coverletter.db_models import (
     Resume,
     Prompt,
     CoverLetter,
+    GenerationJob,
     JobPosting,
     ModelConfig,
-    ResumeItem,
+    ResumeSnapshot,
 )
+from coverletter.export import EXPORT_FORMATS, exported_letters, stream_zip
+from coverletter.fetcher import FetchError, posting_fetcher
+from coverletter.jobs import GenerationQueue
+from coverletter.llm import model_pool, response_cache
+from coverletter.prompts import PROMPT_TEMPLATE_VERSION, PromptBuilder, render_resume_table
+from coverletter.ranking import rank_resume_items
+from coverletter.scheduler import QuotaExceeded, estimate_tokens, scheduler
+from coverletter.search import search_cover_letters
+from coverletter.similarity import similar_coverletters
+
+DEFAULT_MODEL_CONFIG = {"model_id": "text-bison@002", "name": "PaLM", "max_output_tokens": 1024}
+# seconds between checks of a job that a worker runs while its stream is open
+STREAM_POLL_INTERVAL = 0.5
+
+
+@app.route("/coverletters")
+@login_required
+def coverletters():
+    """Page through the history of cover letters, newest first, as JSON or as a page.
+
+    `cursor` is the opaque `next_cursor` of the previous page.
+    """
+    limit = request.args.get("limit", app.config["COVERLETTER_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, app.config["COVERLETTER_MAX_PAGE_SIZE"]))
+    cursor = request.args.get("cursor")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400)
+
+    # one more than requested tells whether there is a next page
+    page = current_user.coverletters_page(after, limit + 1)
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(
+            coverletters=[
+                {
+                    "id": coverletter.id,
+                    "timestamp": coverletter.timestamp.isoformat(),
+                    "company": coverletter.prompt.posting.company,
+                    "response": coverletter.response,
+                }
+                for coverletter in page
+            ],
+            next_cursor=next_cursor,
+        )
+    return render_template(
+        "applications/coverletters.html",
+        title="Cover Letters",
+        coverletters=page,
+        next_cursor=next_cursor,
+        limit=limit,
+    )
+
+
+@app.route("/search")
+@login_required
+def search():
+    """Full-text search over the user's cover letters and their postings, best match first."""
+    query = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    limit = request.args.get("limit", app.config["COVERLETTER_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, app.config["COVERLETTER_MAX_PAGE_SIZE"]))
+
+    # one more than requested tells whether there is a next page
+    matches = search_cover_letters(current_user.id, query, limit + 1, (page - 1) * limit)
+    next_page = page + 1 if len(matches) > limit else None
+    scores = dict(matches[:limit])
+    found = {
+        coverletter.id: coverletter
+        for coverletter in CoverLetter.query.filter(CoverLetter.id.in_(scores))
+        .options(selectinload(CoverLetter.prompt).selectinload(Prompt.posting))
+        .all()
+    }
+    results = [found[coverletter_id] for coverletter_id in scores if coverletter_id in found]
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(
+            results=[
+                {
+                    "id": coverletter.id,
+                    "timestamp": coverletter.timestamp.isoformat(),
+                    "company": coverletter.prompt.posting.company,
+                    "location": coverletter.prompt.posting.location,
+                    "response": coverletter.response,
+                    "score": scores[coverletter.id],
+                }
+                for coverletter in results
+            ],
+            next_page=next_page,
+        )
+    return render_template(
+        "applications/search.html",
+        title="Search",
+        query=query,
+        results=results,
+        next_page=next_page,
+        limit=limit,
+    )
+
+
+@app.route("/export")
+@login_required
+def export():
+    """Download the user's letters as a ZIP of Markdown, Word or PDF documents.
+
+    Takes an optional `since` and `until` date (YYYY-MM-DD, both inclusive) and a part of the
+    company name. The archive is sent while it is written.
+    """
+    export_format = request.args.get("format", "md")
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    try:
+        since, until = export_range(request.args.get("since"), request.args.get("until"))
+    except ValueError:
+        abort(400)
+    letters = exported_letters(current_user.id, since, until, request.args.get("company"))
+    return Response(
+        stream_with_context(stream_zip(letters, export_format)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=coverletters-{export_format}.zip"},
+    )
 
 
-# @app.route("/coverletters")
-# @login_required
-# def coverletters():
-#     """Function that creates an log of previously created coverletters."""
-#     coverletters = current_user.previous_coverletters()
-#     return render_template("coverletters.html", coverletters=coverletters)
+@app.cli.command("export-letters")
+@click.argument("email")
+@click.argument("output", type=click.File("wb"))
+@click.option("--format", "export_format", type=click.Choice(EXPORT_FORMATS), default="md")
+@click.option("--since", help="First day of letters to export, YYYY-MM-DD.")
+@click.option("--until", help="Last day of letters to export, YYYY-MM-DD.")
+@click.option("--company", help="Only letters for companies whose name contains this.")
+def export_letters_command(
+    email: str,
+    output,
+    export_format: str,
+    since: str | None,
+    until: str | None,
+    company: str | None,
+):
+    """Write the letters of a user to a ZIP archive."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user with email {email}.")
+    try:
+        first, last = export_range(since, until)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for chunk in stream_zip(exported_letters(user.id, first, last, company), export_format):
+        output.write(chunk)
+
+
+def export_range(since: str | None, until: str | None) -> tuple[DateTime | None, DateTime | None]:
+    """Start and exclusive end of the days from `since` to `until`."""
+    first = DateTime.fromisoformat(since) if since else None
+    last = DateTime.fromisoformat(until) + timedelta(days=1) if until else None
+    return first, last
+
+
+def encode_cursor(coverletter: CoverLetter) -> str:
+    payload = json.dumps([coverletter.timestamp.isoformat(), coverletter.id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[DateTime, int]:
+    try:
+        timestamp, coverletter_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return DateTime.fromisoformat(timestamp), int(coverletter_id)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"Invalid cursor {cursor!r}") from error
 
 
 class CreateCoverLetterForm(FlaskForm):
     company = TextAreaField("Company Name")
     posting_url = TextAreaField("Job Posting URL", validators=[Optional()])
-    posting_text = TextAreaField("Job Posting Text", validators=[InputRequired()])
+    posting_text = TextAreaField("Job Posting Text")
     posting_date = DateField("Job Posting Date", validators=[Optional()])
     language = SelectField("Language", choices=["EN", "DE", "Other"], validators=[InputRequired()])
     location = location = StringField("Location", validators=[Optional()])
+    regenerate = BooleanField("Write a new letter even if an identical one exists")
+    stream = BooleanField("Show the letter while it is being written")
     submit = SubmitField("Create Coverletter")
 
+    def validate_posting_url(self, posting_url):
+        if posting_url.data and not posting_url.data.strip().startswith(("http://", "https://")):
+            raise ValidationError("Enter a URL that starts with http:// or https://.")
+
+    def validate_posting_text(self, posting_text):
+        if not posting_text.data.strip() and not (self.posting_url.data or "").strip():
+            raise ValidationError("Paste the text of the posting or enter its URL.")
+
+    def fetch_posting_text(self) -> bool:
+        """Download the text of a valid form that has only a URL, False if that failed."""
+        if self.posting_text.data.strip():
+            return True
+        try:
+            self.posting_text.data = posting_fetcher.fetch(self.posting_url.data.strip())
+        except FetchError as error:
+            self.posting_url.errors.append(str(error))
+            return False
+        return True
+
     def validate_language(self, language):
         if not Resume.query.filter_by(
             user=current_user, language=language.data.lower()
@@ -44,16 +257,17 @@ class CreateCoverLetterForm(FlaskForm):
             )
 
 
-@app.route("create")
+@app.route("/create", methods=["GET", "POST"])
 @login_required
 def create():
     form = CreateCoverLetterForm()
 
-    if form.validate_on_submit():
+    # the text is downloaded only once the form is valid and if none was pasted
+    if form.validate_on_submit() and form.fetch_posting_text():
         resume = Resume.query.filter_by(
             user=current_user, language=form.language.data.lower()
         ).one()
-        job_posting = JobPosting(
+        job_posting = JobPosting.get_or_create(
             company=form.company.data,
             url=form.posting_url.data,
             text=form.posting_text.data,
@@ -61,93 +275,449 @@ def create():
             language=form.language.data.lower(),
             location=form.location.data,
         )
-        db.session.add(job_posting)
 
-        prompt = compose_prompt(job_posting, resume, current_user)
+        model_config = ModelConfig.get_or_create(**DEFAULT_MODEL_CONFIG)
+        prompt = compose_prompt(job_posting, resume, current_user, model_config)
         db.session.add(prompt)
 
-        model_config = ModelConfig(model_id="text-bison@002", name="PaLM", max_output_tokens=1024)
-        db.session.add(model_config)
+        scheduler.admit(
+            estimate_tokens(prompt.prompt, model_config.max_output_tokens),
+            backlog=generation_queue.pending,
+        )
 
-        coverletter = request_coverletter_with_sdk(prompt, model_config)
-        db.session.add(coverletter)
+        job = GenerationJob(
+            user=current_user,
+            prompt=prompt,
+            config=model_config,
+            use_cache=not form.regenerate.data,
+        )
+        db.session.add(job)
         db.session.commit()
 
-        return redirect("coverletters")
+        if form.stream.data:
+            # the stream endpoint claims the job once the page opens it, a worker runs it if the
+            # stream is not opened in time
+            generation_queue.submit(job, delay=app.config["GENERATION_STREAM_CLAIM_TIMEOUT"])
+            return redirect(url_for("job_status", job_id=job.id, stream=1))
+
+        generation_queue.submit(job)
+
+        return redirect(url_for("job_status", job_id=job.id))
 
     return render_template("applications/create_letter.html", form=form)
 
 
-def compose_prompt(job_posting: JobPosting, resume: Resume, user: User) -> Prompt:
-    prompt = (
-        "Your task is to generate a cover letter for applicant "
-        + user.name
-        + " and company "
-        + (job_posting.company if job_posting.company else "")
+@app.route("/batch", methods=["POST"])
+@login_required
+def batch():
+    """Create cover letters for many postings against one resume.
+
+    Expects a JSON body `{"language": "en", "postings": [{"text": ..., "url": ..., "company": ...,
+    "location": ..., "date": "YYYY-MM-DD"}], "parallelism": 4}` and answers with one result per
+    posting once all of them are finished. Postings without text are downloaded from their URL.
+    """
+    data = request.get_json(silent=True) or {}
+    postings = data.get("postings")
+    if not isinstance(postings, list) or not postings:
+        return jsonify(error="Expected a non-empty list of postings."), 400
+    if len(postings) > app.config["BATCH_MAX_SIZE"]:
+        return jsonify(error=f"At most {app.config['BATCH_MAX_SIZE']} postings per batch."), 400
+    parallelism = data.get("parallelism")
+    if parallelism is not None and (
+        isinstance(parallelism, bool) or not isinstance(parallelism, int)
+    ):
+        return jsonify(error="The parallelism must be an integer."), 400
+
+    resume = Resume.query.filter_by(
+        user=current_user, language=str(data.get("language", "")).lower()
+    ).one_or_none()
+    if resume is None:
+        return jsonify(error="No resume was added for this language!"), 400
+
+    results = create_batch(resume, postings, parallelism)
+    return jsonify(results=results)
+
+
+@app.cli.command("batch-create")
+@click.argument("email")
+@click.argument("postings_file", type=click.File())
+@click.option("--language", default="en", help="Language of the resume to use.")
+@click.option("--parallelism", type=int, help="Maximum number of concurrent generations.")
+def batch_create_command(email: str, postings_file, language: str, parallelism: int | None):
+    """Create cover letters for a JSON list of postings and print the results as JSON."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user with email {email}.")
+    resume = Resume.query.filter_by(user=user, language=language.lower()).one_or_none()
+    if resume is None:
+        raise click.ClickException(f"{email} has no resume in language {language}.")
+    try:
+        results = create_batch(resume, json.load(postings_file), parallelism)
+    except QuotaExceeded as error:
+        db.session.rollback()
+        raise click.ClickException(str(error))
+    click.echo(json.dumps(results, indent=2))
+
+
+def create_batch(resume: Resume, postings: list[dict], parallelism: int | None = None) -> list:
+    """Build all prompts in one transaction and generate the letters concurrently.
+
+    Invalid postings are reported in their result instead of failing the whole batch.
+    """
+    if parallelism is None:
+        parallelism = app.config["BATCH_PARALLELISM"]
+    parallelism = max(1, min(int(parallelism), app.config["BATCH_PARALLELISM"]))
+    # downloaded before anything is written, the transaction below would hold the write lock
+    fetched = fetch_batch_texts(postings)
+    model_config = ModelConfig.get_or_create(**DEFAULT_MODEL_CONFIG)
+
+    results = [{"index": index} for index in range(len(postings))]
+    jobs = {}
+    for result, posting in zip(results, postings):
+        try:
+            job_posting = batch_posting(posting, resume.language, fetched.get(result["index"]))
+        except (TypeError, ValueError, FetchError) as error:
+            result.update(status="invalid", error=str(error))
+            continue
+        prompt = compose_prompt(job_posting, resume, resume.user, model_config)
+        job = GenerationJob(user=resume.user, prompt=prompt, config=model_config)
+        # added right away, the postings of the next items are looked up with a flush
+        db.session.add(job)
+        jobs[result["index"]] = job
+
+    if jobs:
+        # admit the whole batch before it is stored, with the average of its prompts per call
+        tokens = sum(
+            estimate_tokens(job.prompt.prompt, model_config.max_output_tokens)
+            for job in jobs.values()
+        )
+        scheduler.admit(
+            math.ceil(tokens / len(jobs)), backlog=generation_queue.pending + len(jobs) - 1
+        )
+    db.session.commit()
+
+    generation_queue.run_batch([job.id for job in jobs.values()], parallelism)
+
+    db.session.expire_all()
+    for index, job in jobs.items():
+        results[index].update(
+            job_id=job.id,
+            status=job.status,
+            cover_letter_id=job.cover_letter_id,
+            error=job.error,
+        )
+    return results
+
+
+def fetch_batch_texts(postings: list) -> dict[int, str | FetchError]:
+    """The downloaded texts of the postings that only have a URL, by their index, or the error
+    of the download. Every URL is downloaded once, all of them concurrently."""
+    urls = {
+        index: str(posting["url"]).strip()
+        for index, posting in enumerate(postings)
+        if isinstance(posting, dict)
+        and not str(posting.get("text") or "").strip()
+        and posting.get("url")
+    }
+    if not urls:
+        return {}
+
+    def fetch(url: str) -> str | FetchError:
+        with app.app_context():
+            try:
+                return posting_fetcher.fetch(url)
+            except FetchError as error:
+                return error
+
+    distinct = sorted(set(urls.values()))
+    with ThreadPoolExecutor(
+        max_workers=min(len(distinct), app.config["FETCH_POOL_SIZE"]), thread_name_prefix="fetch"
+    ) as executor:
+        texts = dict(zip(distinct, executor.map(fetch, distinct)))
+    return {index: texts[url] for index, url in urls.items()}
+
+
+def batch_posting(
+    posting: dict, language: str, fetched: str | FetchError | None = None
+) -> JobPosting:
+    if not isinstance(posting, dict):
+        raise TypeError("Expected an object with the posting.")
+    text = str(posting.get("text") or "")
+    if isinstance(fetched, FetchError):
+        raise fetched
+    if not text.strip() and fetched:
+        text = fetched
+    if not text.strip():
+        raise ValueError("The posting text is required.")
+    date = posting.get("date")
+    return JobPosting.get_or_create(
+        company=posting.get("company"),
+        url=posting.get("url"),
+        text=text,
+        date=DateTime.fromisoformat(date) if date else None,
+        language=language,
+        location=posting.get("location"),
     )
 
-    prompt += "\n for the following application: \n" + job_posting.text
 
-    prompt += "\n Based on the following CV: \n" + create_resume_table(resume)
-    prompt += "\n It is crucial to not hallucinate skills or experiences that are not present in the CV! Try to make the cover letter as relevant as possible. \n"
+@app.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id: int):
+    """Report the state of a generation job, as JSON for pollers or as a self-refreshing page."""
+    job = get_own_job(job_id)
+    # letters the user already wrote for near-duplicates of the posting, to reuse instead, only
+    # looked up once the job is finished and not for every poll or refresh while it runs
+    similar = []
+    if job.is_finished:
+        similar = [
+            (coverletter, similarity)
+            for coverletter, similarity in similar_coverletters(
+                current_user.id, job.prompt.posting.text
+            )
+            if coverletter.id != job.cover_letter_id
+        ]
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(
+            id=job.id,
+            status=job.status,
+            error=job.error,
+            cover_letter_id=job.cover_letter_id,
+            response=job.cover_letter.response if job.cover_letter else None,
+            similar=[similar_result(*match) for match in similar],
+        )
+    return render_template(
+        "applications/job_status.html",
+        title="Cover Letter",
+        job=job,
+        similar=similar,
+        stream=request.args.get("stream") == "1",
+    )
+
 
-    return Prompt(
-        resume=resume,
-        posting=job_posting,
-        prompt=prompt,
+@app.route("/similar", methods=["POST"])
+@login_required
+def similar():
+    """Find the user's letters for postings similar to `{"text": ...}`, before writing one."""
+    data = request.get_json(silent=True) or {}
+    text = str(data.get("text") or "")
+    if not text.strip():
+        return jsonify(error="The posting text is required."), 400
+    return jsonify(
+        similar=[similar_result(*match) for match in similar_coverletters(current_user.id, text)]
     )
 
 
-def create_resume_table(resume: Resume):
-    resume_items: list[ResumeItem] = resume.resume_items
+def similar_result(coverletter: CoverLetter, similarity: float) -> dict:
+    return {
+        "cover_letter_id": coverletter.id,
+        "posting_id": coverletter.prompt.posting_id,
+        "company": coverletter.prompt.posting.company,
+        "similarity": round(similarity, 3),
+        "response": coverletter.response,
+    }
 
-    resume_items.sort(key=lambda item: item.begin_date)
-    resume_items.sort(key=lambda item: item.category)
 
-    # Group resume items by category
-    grouped_resume_items = {}
-    for item in resume_items:
-        category = item.category
-        if category not in grouped_resume_items:
-            grouped_resume_items[category] = []
-        grouped_resume_items[category].append(item)
+@app.route("/jobs/<int:job_id>/stream")
+@login_required
+def stream_job(job_id: int):
+    """Run a queued job and push the generated text to the browser as server-sent events."""
+    job = get_own_job(job_id)
+
+    def events() -> Iterator[str]:
+        if generation_queue.claim(job.id) is None:
+            # the job already ran or is running on a worker, whose result is sent once it is done
+            deadline = time.monotonic() + app.config["GENERATION_JOB_TIMEOUT"]
+            while job.status == GenerationJob.RUNNING and time.monotonic() < deadline:
+                time.sleep(STREAM_POLL_INTERVAL)
+                db.session.refresh(job)
+            if job.status == GenerationJob.DONE:
+                yield server_sent_event({"text": job.cover_letter.response})
+                yield server_sent_event({"cover_letter_id": job.cover_letter_id}, "done")
+            else:
+                yield server_sent_event({"status": job.status, "error": job.error}, "status")
+            return
+
+        chunks = []
+        try:
+            for chunk in stream_coverletter_with_sdk(job.prompt, job.config, job.use_cache):
+                chunks.append(chunk)
+                yield server_sent_event({"text": chunk})
+        except GeneratorExit:
+            # the browser went away, finish the letter in the background instead
+            job.status = GenerationJob.QUEUED
+            job.started = None
+            db.session.commit()
+            generation_queue.submit(job)
+            raise
+        except Exception as error:
+            app.logger.exception("Streaming generation job %d failed", job.id)
+            generation_queue.finish(job, error=error)
+            yield server_sent_event({"error": job.error}, "error")
+            return
+
+        coverletter = CoverLetter(prompt=job.prompt, config=job.config, response="".join(chunks))
+        db.session.add(coverletter)
+        generation_queue.finish(job, coverletter)
+        yield server_sent_event({"cover_letter_id": coverletter.id}, "done")
 
-    # Create a markdown table from the grouped and sorted resume items
-    table = "| Category | Title | Description | Begin Date | End Date | Grade | Location |\n"
-    table += "|----------|-------|-------------|------------|----------|-------|----------|\n"
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    for category, items in grouped_resume_items.items():
-        for item in items:
-            title = item.title
-            description = item.description
-            begin_date = item.begin_date if item.begin_date else ""
-            end_date = item.end_date if item.end_date else ""
-            grade = item.grade if item.grade else ""
-            location = item.location if item.location else ""
 
-            table += f"| {category} | {title} | {description} | {begin_date} | {end_date} | {grade} | {location} |\n"
+def get_own_job(job_id: int) -> GenerationJob:
+    job = db.session.get(GenerationJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return job
+
+
+def server_sent_event(data: dict, event: str | None = None) -> str:
+    message = f"data: {json.dumps(data)}\n\n"
+    if event is not None:
+        message = f"event: {event}\n" + message
+    return message
+
+
+def compose_prompt(
+    job_posting: JobPosting, resume: Resume, user: User, config: ModelConfig | None = None
+) -> Prompt:
+    """Build the prompt within the input budget of the config and record its token counts.
+
+    Categories with more items than RESUME_TOP_K_PER_CATEGORY only keep the items that are most
+    relevant to the posting, and the least relevant items are the first to go over budget.
+    """
+    max_input_tokens = config.max_input_tokens if config is not None else None
+    if max_input_tokens is None:
+        max_input_tokens = app.config["PROMPT_MAX_INPUT_TOKENS"]
+
+    snapshot = get_resume_snapshot(resume)
+    resume_table, resume_items = snapshot.content, lambda: resume.resume_items
+    relevance = rank_resume_items(resume, job_posting.text, app.config["RESUME_TOP_K_PER_CATEGORY"])
+    if relevance is not None:
+        # only the most relevant items of large categories go into the prompt
+        ranked = [item for item in resume.resume_items if item.title in relevance]
+        resume_table, resume_items = render_resume_table(ranked), lambda: ranked
+    builder = PromptBuilder(
+        name=user.name,
+        company=job_posting.company,
+        posting=job_posting.text,
+        resume_table=resume_table,
+        resume_items=resume_items,
+        relevance=relevance,
+    )
+    builder.build(max_input_tokens)
+    if builder.trimmed:
+        app.logger.info(
+            "Trimmed prompt to %d tokens: %s", builder.input_tokens, ", ".join(builder.trimmed)
+        )
+    if builder.resume_section != snapshot.content:
+        snapshot = ResumeSnapshot.get_or_create(builder.resume_section)
+
+    # stored as components, the prompt text is rendered again from them when it is read
+    return Prompt(
+        resume=resume,
+        posting=job_posting,
+        template_version=PROMPT_TEMPLATE_VERSION,
+        applicant=user.name,
+        snapshot=snapshot,
+        posting_text=(
+            builder.posting_section if builder.posting_section != job_posting.text else None
+        ),
+        input_tokens=builder.input_tokens,
+        posting_tokens=builder.posting_tokens,
+        resume_tokens=builder.resume_tokens,
+    )
 
-    return table
 
+def get_resume_snapshot(resume: Resume) -> ResumeSnapshot:
+    """The rendered resume table, rendered again only after the resume changed."""
+    if resume.snapshot is None:
+        resume.snapshot = ResumeSnapshot.get_or_create(create_resume_table(resume))
+    return resume.snapshot
 
-def request_coverletter_with_sdk(prompt: Prompt, config: ModelConfig | None = None) -> CoverLetter:
-    if config is None:
-        config = ModelConfig(model_id="text-bison@002", max_output_tokens=1024)
 
-    from vertexai.language_models import TextGenerationModel
+def create_resume_table(resume: Resume) -> str:
+    return render_resume_table(resume.resume_items)
 
-    model = TextGenerationModel.from_pretrained(config.model_id)
 
-    response = model.predict(prompt, **config.__dict__)
+def request_coverletter_with_sdk(
+    prompt: Prompt, config: ModelConfig | None = None, use_cache: bool = True
+) -> CoverLetter:
+    if config is None:
+        config = ModelConfig.get_or_create(**DEFAULT_MODEL_CONFIG)
+
+    parameters = config.generation_parameters()
+    use_cache = use_cache and app.config["RESPONSE_CACHE_ENABLED"] and config.is_deterministic
+    cache_key = response_cache.key(prompt.prompt, config.model_id, parameters)
+
+    response = response_cache.get(cache_key) if use_cache else None
+    if response is None:
+        client = model_pool.for_config(config)
+        response = scheduler.call(
+            prompt.resume.user_id,
+            estimate_tokens(prompt.prompt, config.max_output_tokens),
+            lambda: client.predict(prompt.prompt),
+            client.is_retryable,
+        )
+        if use_cache:
+            response_cache.set(cache_key, response)
+    else:
+        app.logger.info("Reused cached response for prompt %s", cache_key[:12])
 
     coverletter = CoverLetter(
         prompt=prompt,
         config=config,
-        response=response.text,
+        response=response,
     )
     return coverletter
 
 
+def stream_coverletter_with_sdk(
+    prompt: Prompt, config: ModelConfig, use_cache: bool = True
+) -> Iterator[str]:
+    """Like `request_coverletter_with_sdk`, but yields the response text as it is generated."""
+    parameters = config.generation_parameters()
+    use_cache = use_cache and app.config["RESPONSE_CACHE_ENABLED"] and config.is_deterministic
+    cache_key = response_cache.key(prompt.prompt, config.model_id, parameters)
+
+    response = response_cache.get(cache_key) if use_cache else None
+    if response is not None:
+        yield response
+        return
+
+    scheduler.acquire(
+        prompt.resume.user_id, estimate_tokens(prompt.prompt, config.max_output_tokens)
+    )
+    chunks = []
+    for chunk in model_pool.for_config(config).predict_streaming(prompt.prompt):
+        chunks.append(chunk)
+        yield chunk
+    if use_cache:
+        response_cache.set(cache_key, "".join(chunks))
+
+
+def generate_coverletter(job: GenerationJob) -> CoverLetter:
+    """Job handler that requests the cover letter for a queued prompt."""
+    coverletter = request_coverletter_with_sdk(job.prompt, job.config, job.use_cache)
+    db.session.add(coverletter)
+    return coverletter
+
+
+generation_queue = GenerationQueue(generate_coverletter)
+
+
+@app.before_request
+def start_generation():
+    if not generation_queue.started:
+        if app.config["MODEL_POOL_WARMUP"]:
+            model_pool.warm_up(ModelConfig(**DEFAULT_MODEL_CONFIG))
+        generation_queue.start()
+
+
 # def request_coverletter_with_rest(prompt: str, parameters: dict | None = None) -> str:
 #     if parameters is None:
 #         parameters = {"max_output_tokens": 1024}
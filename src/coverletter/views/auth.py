@@ -3,7 +3,7 @@ from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import DataRequired, ValidationError, Email, EqualTo
 from coverletter.db_models import User
 from coverletter import app, db
-from coverletter.db_models import User
+from coverletter.db_models import User, user_cache
 from flask_login import current_user, login_user, logout_user
 from flask import flash, redirect, render_template, url_for, request
 import sqlalchemy as sa
@@ -43,6 +43,10 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash("Invalid username or password")
             return redirect(url_for("login"))
+        if user.password_needs_rehash():
+            # upgrade the hash to the configured cost while the password is at hand
+            user.set_password(form.password.data)
+            db.session.commit()
         if not login_user(user, remember=form.remember_me.data):
             flash("Login failed.")
             return redirect(url_for("logout"))
@@ -79,6 +83,8 @@ def register():
 
 @app.route("/logout")
 def logout():
+    if current_user.is_authenticated:
+        user_cache.pop(current_user.id)
     logout_user()
     return redirect(url_for("index"))
 
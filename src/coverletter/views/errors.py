@@ -1,5 +1,6 @@
-from flask import render_template
+from flask import jsonify, render_template, request
 from coverletter import app, db
+from coverletter.scheduler import QuotaExceeded
 
 
 @app.route("/test")
@@ -16,3 +17,12 @@ def not_found_error(error):
 def internal_error(error):
     db.session.rollback()
     return render_template("errors/500.html"), 500
+
+
+@app.errorhandler(QuotaExceeded)
+def quota_exceeded_error(error: QuotaExceeded):
+    db.session.rollback()
+    headers = {"Retry-After": str(int(error.retry_after))}
+    if request.is_json or request.accept_mimetypes.best == "application/json":
+        return jsonify(error=str(error), retry_after=error.retry_after), 429, headers
+    return render_template("errors/429.html", retry_after=int(error.retry_after)), 429, headers
@@ -1,13 +1,13 @@
-from datetime import datetime, timezone
-
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
 from flask_wtf import FlaskForm
+from sqlalchemy.orm import selectinload
 from wtforms import SubmitField, TextAreaField
 from wtforms.validators import InputRequired, Length
 
 from coverletter import app, db
-from coverletter.db_models import User
+from coverletter.activity import last_seen_buffer
+from coverletter.db_models import Resume, User, user_cache
 
 
 class EditProfileForm(FlaskForm):
@@ -24,6 +24,7 @@ def edit_profile():
         current_user.name = form.name.data
         current_user.about_me = form.about_me.data
         db.session.commit()
+        user_cache.pop(current_user.id)
         flash("Your changes have been saved.")
         return redirect(url_for("edit_profile"))
     elif request.method == "GET":
@@ -35,7 +36,12 @@ def edit_profile():
 @app.route("/user/<email>")
 @login_required
 def user(email: str):
-    user: User = User.query.filter_by(email=email).first_or_404()
+    # resumes and their items are loaded with one query each, however many there are
+    user: User = (
+        User.query.options(selectinload(User.resumes).selectinload(Resume.resume_items))
+        .filter_by(email=email)
+        .first_or_404()
+    )
     resume_preview = {}
     for resume in user.resumes:
         resume_categories = resume.get_items_per_category()
@@ -46,5 +52,4 @@ def user(email: str):
 @app.before_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        last_seen_buffer.record(current_user)
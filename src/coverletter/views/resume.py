@@ -1,11 +1,24 @@
-from flask import flash, redirect, render_template, session, url_for
+import click
+from flask import flash, jsonify, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_required
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from wtforms import DateField, IntegerField, SelectField, StringField, SubmitField, TextAreaField
 from wtforms.validators import InputRequired, Length, Optional, ValidationError
 
 from coverletter import app, db
 from coverletter.db_models import Resume, ResumeItem, User
+from coverletter.resume_import import (
+    IMPORT_FORMATS,
+    RESUME_CATEGORIES,
+    ResumeImportError,
+    category_error,
+    format_of,
+    import_items,
+)
+
+# content types of documents that API clients post to the import endpoint
+IMPORT_MIMETYPES = {"application/json": "json", "text/csv": "csv"}
 
 
 class ResumeItemForm(FlaskForm):
@@ -13,17 +26,7 @@ class ResumeItemForm(FlaskForm):
     description = TextAreaField("Description", validators=[InputRequired()])
     category = SelectField(
         "Category",
-        choices=[
-            "-",  # Placeholder
-            "education",
-            "work",
-            "project",
-            "skill",
-            "language",
-            "certification",
-            "volunteer",
-            "course",
-        ],
+        choices=["-", *RESUME_CATEGORIES],  # "-" is a placeholder
         validators=[InputRequired()],
     )
     begin_date = DateField("Begin Date", validators=[Optional()])
@@ -33,16 +36,15 @@ class ResumeItemForm(FlaskForm):
     submit = SubmitField("Add Item")
 
     def validate_category(self, category):
-        if category.data == "-":
-            raise ValidationError("Please select a category.")
-        if category.data == "education" and not self.grade.data:
-            raise ValidationError("Grade is required for education items.")
-        if category.data in ["work", "project", "volunteer"] and not self.location.data:
-            raise ValidationError("Location is required for work, project, and volunteer items.")
-        if category.data in ["work", "project", "volunteer"] and not self.begin_date.data:
-            raise ValidationError("Begin date is required for work, project, and volunteer items.")
-        if category.data in ["work", "project", "volunteer"] and not self.end_date.data:
-            raise ValidationError("End date is required for work, project, and volunteer items.")
+        error = category_error(
+            category.data,
+            self.grade.data,
+            self.location.data,
+            self.begin_date.data,
+            self.end_date.data,
+        )
+        if error:
+            raise ValidationError(error)
 
     def validate_begin_date(self, begin_date):
         if self.end_date.data and begin_date.data > self.end_date.data:
@@ -53,6 +55,14 @@ class ResumeItemForm(FlaskForm):
             raise ValidationError("End date must be after begin date.")
 
 
+class ImportResumeItemsForm(FlaskForm):
+    file = FileField(
+        "JSON Resume or CSV file",
+        validators=[FileRequired(), FileAllowed(IMPORT_FORMATS, "Upload a .json or .csv file.")],
+    )
+    submit = SubmitField("Import Items")
+
+
 class CreateResumeForm(FlaskForm):
     language = SelectField(
         "Language",
@@ -103,8 +113,68 @@ def add_resume_item(resume_id: str):
             resume=resume,
         )
         db.session.add(resume_item)
+        resume.invalidate_snapshot()
         db.session.commit()
         session["resume_id"] = resume.id
         return redirect(url_for("user", email=current_user.email))
 
     return render_template("resume/add_resume_item.html", form=form)
+
+
+@app.route("/import_resume_items/<resume_id>", methods=["GET", "POST"])
+@login_required
+def import_resume_items(resume_id: str):
+    """Add or replace many items of a resume at once from a JSON Resume or CSV file.
+
+    API clients post the document itself as application/json or text/csv and get the number of
+    imported items or all validation errors as JSON.
+    """
+    resume = Resume.query.filter_by(id=resume_id, user=current_user).first_or_404()
+    if request.method == "POST" and request.mimetype in IMPORT_MIMETYPES:
+        try:
+            count = import_items(resume, request.get_data(), IMPORT_MIMETYPES[request.mimetype])
+        except ResumeImportError as error:
+            return jsonify(errors=error.errors), 400
+        return jsonify(imported=count)
+
+    form = ImportResumeItemsForm()
+    if form.validate_on_submit():
+        file = form.file.data
+        try:
+            count = import_items(resume, file.read(), format_of(file.filename))
+        except ResumeImportError as error:
+            form.file.errors = list(form.file.errors) + error.errors
+        else:
+            flash(f"Imported {count} resume items.")
+            session["resume_id"] = resume.id
+            return redirect(url_for("user", email=current_user.email))
+
+    return render_template("resume/import_resume_items.html", form=form)
+
+
+@app.cli.command("import-resume")
+@click.argument("email")
+@click.argument("items_file", type=click.File("rb"))
+@click.option("--language", default="en", help="Language of the resume to import into.")
+@click.option(
+    "--format",
+    "import_format",
+    type=click.Choice(IMPORT_FORMATS),
+    help="Format of the file, taken from its extension by default.",
+)
+def import_resume_command(email: str, items_file, language: str, import_format: str | None):
+    """Add or replace the items of a resume from a JSON Resume or CSV file."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user with email {email}.")
+    resume = Resume.query.filter_by(user=user, language=language.lower()).one_or_none()
+    if resume is None:
+        raise click.ClickException(f"{email} has no resume in language {language}.")
+    import_format = import_format or format_of(items_file.name)
+    if import_format is None:
+        raise click.ClickException("Pass --format, the file extension is not .json or .csv.")
+    try:
+        count = import_items(resume, items_file.read(), import_format)
+    except ResumeImportError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Imported {count} items into the {language} resume of {email}")
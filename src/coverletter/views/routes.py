@@ -4,8 +4,13 @@ https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-v-user-logins
 """
 
 from coverletter import app
+from coverletter.activity import last_seen_buffer
+from coverletter.db_models import user_cache
+from coverletter.fetcher import posting_fetcher
+from coverletter.llm import model_pool, response_cache
+from coverletter.scheduler import scheduler
 from flask_login import login_required
-from flask import render_template
+from flask import jsonify, render_template
 
 
 @app.route("/")
@@ -13,3 +18,17 @@ from flask import render_template
 @login_required
 def index():
     return render_template("home/index.html", title="Home")
+
+
+@app.route("/metrics")
+@login_required
+def metrics():
+    """Counters of the process-wide caches and pools, for monitoring."""
+    return jsonify(
+        fetcher=posting_fetcher.stats(),
+        last_seen=last_seen_buffer.stats(),
+        model_pool=model_pool.stats(),
+        response_cache=response_cache.stats(),
+        scheduler=scheduler.stats(),
+        user_cache=user_cache.stats(),
+    )
@@ -0,0 +1,536 @@
+from unittest import TestCase, mock
+import json
+import math
+import os
+import threading
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+from datetime import datetime, timezone, timedelta
+from coverletter import app, db
+from coverletter.db_models import (
+    User,
+    Resume,
+    ResumeItem,
+    Prompt,
+    CoverLetter,
+    JobPosting,
+    ModelConfig,
+    GenerationJob,
+    user_cache,
+)
+from coverletter.fetcher import FetchError
+from coverletter.llm import PROVIDERS, model_pool, response_cache
+from coverletter.prompts import count_tokens
+from coverletter.ranking import resume_indexes
+from coverletter.scheduler import TokenBucket, estimate_tokens, scheduler
+from coverletter.views import applications
+from coverletter.views.applications import (
+    DEFAULT_MODEL_CONFIG,
+    create_resume_table,
+    generation_queue,
+    request_coverletter_with_sdk,
+)
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+app.config["LLM_PROVIDER"] = "local"
+
+
+def fake_coverletter(
+    prompt: Prompt, config: ModelConfig | None = None, use_cache: bool = True
+) -> CoverLetter:
+    return CoverLetter(prompt=prompt, config=config, response=f"Dear {prompt.posting.company}")
+
+
+class GenerationCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(name="john", email="john@example.com")
+        self.resume = Resume(language="en", user=self.user)
+        self.resume.resume_items.append(
+            ResumeItem(
+                title="Data Engineer",
+                description="Built pipelines",
+                category="work",
+                begin_date=datetime(2020, 1, 1),
+                end_date=datetime(2022, 1, 1),
+                location="Berlin",
+            )
+        )
+        db.session.add_all([self.user, self.resume])
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+        user_cache.clear()
+        response_cache.clear()
+        resume_indexes.clear()
+        self.provider = PROVIDERS["local"]
+        self.provider.calls = 0
+        # every test gets a scheduler with full buckets that retries without waiting
+        for name, value in [
+            ("backoff_base", 0),
+            ("requests", TokenBucket(per_minute=10**6)),
+            ("tokens", TokenBucket(per_minute=10**9)),
+        ]:
+            patcher = mock.patch.object(scheduler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        generation_queue.shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post_create(self, **data):
+        form = {"company": "ACME", "posting_text": "We need a data engineer", "language": "EN"}
+        form.update(data)
+        response = self.client.post("/create", data=form)
+        db.session.expire_all()
+        return response
+
+    @mock.patch("coverletter.views.applications.request_coverletter_with_sdk", fake_coverletter)
+    def test_create_enqueues_job(self):
+        response = self.post_create()
+        job = db.session.scalars(db.select(GenerationJob)).one()
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith(f"/jobs/{job.id}"))
+        self.assertEqual(job.status, GenerationJob.DONE)
+        self.assertEqual(job.cover_letter.response, "Dear ACME")
+        self.assertEqual(self.user.previous_coverletters().all(), [job.cover_letter])
+
+        status = self.client.get(f"/jobs/{job.id}", headers={"Accept": "application/json"})
+        self.assertEqual(status.json["status"], "done")
+        self.assertEqual(status.json["response"], "Dear ACME")
+
+    @mock.patch("coverletter.views.applications.request_coverletter_with_sdk")
+    def test_failed_job_records_error(self, request_coverletter):
+        request_coverletter.side_effect = RuntimeError("quota exceeded")
+        self.post_create()
+        job = db.session.scalars(db.select(GenerationJob)).one()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertEqual(job.error, "quota exceeded")
+        self.assertEqual(CoverLetter.query.count(), 0)
+
+    def test_identical_prompts_reuse_cached_response(self):
+        self.post_create()
+        self.post_create()
+        self.post_create(regenerate="y")
+        letters = [job.cover_letter.response for job in GenerationJob.query.order_by("id")]
+        self.assertEqual(len(set(letters)), 1)
+        self.assertTrue(letters[0].startswith("Dear hiring manager,"))
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(response_cache.stats()["hits"], 1)
+
+    def test_random_configs_are_not_cached(self):
+        config = ModelConfig(name="local", model_id="local", temperature=0.7)
+        prompt = Prompt(prompt="prompt", resume=self.resume, posting=JobPosting(text="text"))
+        request_coverletter_with_sdk(prompt, config)
+        request_coverletter_with_sdk(prompt, config)
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(len(response_cache), 0)
+
+    def test_stream_pushes_chunks_and_persists_letter(self):
+        response = self.post_create(stream="y")
+        job = db.session.scalars(db.select(GenerationJob)).one()
+        self.assertTrue(response.location.endswith(f"/jobs/{job.id}?stream=1"))
+        self.assertEqual(job.status, GenerationJob.QUEUED)
+
+        stream = self.client.get(f"/jobs/{job.id}/stream")
+        events = stream.get_data(as_text=True)
+        self.assertEqual(stream.mimetype, "text/event-stream")
+        self.assertTrue(events.startswith('data: {"text": "Dear"}\n\ndata: {"text": " hiring"}'))
+        self.assertTrue(events.endswith(f'event: done\ndata: {{"cover_letter_id": {job.id}}}\n\n'))
+
+        db.session.expire_all()
+        self.assertEqual(job.status, GenerationJob.DONE)
+        self.assertEqual(len(job.cover_letter.response.split()), 256)
+
+        # a second stream replays the stored letter instead of generating again
+        replay = self.client.get(f"/jobs/{job.id}/stream").get_data(as_text=True)
+        self.assertIn(json.dumps({"text": job.cover_letter.response}), replay)
+        self.assertEqual(self.provider.calls, 1)
+
+    def test_streamed_job_runs_without_its_stream(self):
+        futures = []
+        submit = generation_queue.submit
+
+        def keep_future(job, delay=0):
+            futures.append(submit(job, delay))
+            return futures[-1]
+
+        with mock.patch.object(generation_queue, "submit", keep_future), mock.patch.dict(
+            app.config, {"GENERATION_STREAM_CLAIM_TIMEOUT": 0.01}
+        ):
+            self.post_create(stream="y")
+        futures[0].result(timeout=5)
+        job = db.session.scalars(db.select(GenerationJob)).one()
+        db.session.expire_all()
+        self.assertEqual(job.status, GenerationJob.DONE)
+        self.assertEqual(generation_queue.pending, 0)
+
+    def test_stream_follows_job_of_a_worker(self):
+        self.post_create(stream="y")
+        job = db.session.scalars(db.select(GenerationJob)).one()
+        generation_queue.claim(job.id)
+
+        def finish_on_worker(seconds):
+            generation_queue.finish(job, fake_coverletter(job.prompt, job.config))
+
+        with mock.patch("coverletter.views.applications.time.sleep", finish_on_worker):
+            events = self.client.get(f"/jobs/{job.id}/stream").get_data(as_text=True)
+        self.assertEqual(
+            events,
+            'data: {"text": "Dear ACME"}\n\n'
+            f'event: done\ndata: {{"cover_letter_id": {job.cover_letter_id}}}\n\n',
+        )
+
+    def test_stream_reports_failures(self):
+        self.post_create(stream="y")
+        job = db.session.scalars(db.select(GenerationJob)).one()
+        with mock.patch.object(self.provider, "failure_rate", 1):
+            events = self.client.get(f"/jobs/{job.id}/stream").get_data(as_text=True)
+        self.assertEqual(
+            events, 'event: error\ndata: {"error": "Injected failure of text-bison@002"}\n\n'
+        )
+        db.session.expire_all()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+
+    def test_batch_generates_every_posting(self):
+        postings = [
+            {"text": "We need a data engineer", "company": "ACME", "date": "2024-03-01"},
+            {"text": "  ", "company": "Initech"},
+            {"text": "We need an analyst", "company": "Globex", "url": "https://globex.com/1"},
+        ]
+        response = self.client.post("/batch", json={"language": "en", "postings": postings})
+        results = response.json["results"]
+        self.assertEqual([result["status"] for result in results], ["done", "invalid", "done"])
+        self.assertEqual(results[1]["error"], "The posting text is required.")
+        self.assertEqual(JobPosting.query.count(), 2)
+        self.assertEqual(CoverLetter.query.count(), 2)
+        self.assertEqual(ModelConfig.query.count(), 1)
+
+    def test_resubmitted_postings_are_reused(self):
+        self.post_create(posting_url="https://acme.com/jobs/1?utm_campaign=spring")
+        self.post_create(posting_text="We need a  data engineer\n", posting_url="")
+        postings = [{"text": "We need a data engineer", "company": "ACME"}] * 2
+        self.client.post("/batch", json={"language": "en", "postings": postings})
+        posting = JobPosting.query.one()
+        self.assertEqual(posting.url, "https://acme.com/jobs/1")
+        self.assertEqual(len(posting.prompts), 4)
+        self.assertEqual(CoverLetter.query.count(), 4)
+
+    def test_postings_are_reused_by_content_not_by_url(self):
+        self.post_create(posting_url="https://ACME.com/jobs/1/?utm_source=board")
+        postings = [
+            {"text": "Data engineer wanted", "company": "Initech", "url": "https://acme.com/jobs/1"}
+        ]
+        self.client.post("/batch", json={"language": "en", "postings": postings})
+        first, second = JobPosting.query.order_by(JobPosting.id)
+        self.assertEqual([first.url, second.url], ["https://acme.com/jobs/1"] * 2)
+        self.assertEqual((second.text, second.company), ("Data engineer wanted", "Initech"))
+        self.assertIn("Data engineer wanted", second.prompts[0].prompt)
+        self.assertNotIn("Data engineer wanted", first.prompts[0].prompt)
+
+        # a downloaded posting is the same content every time
+        with mock.patch.object(
+            applications.posting_fetcher, "fetch", return_value="Data engineer wanted"
+        ):
+            self.post_create(
+                company="Initech", posting_text="", posting_url="https://acme.com/jobs/1"
+            )
+        self.assertEqual(JobPosting.query.count(), 2)
+        self.assertEqual(len(second.prompts), 2)
+
+    def test_posting_text_is_fetched_from_url(self):
+        with mock.patch.object(
+            applications.posting_fetcher, "fetch", return_value="We need a data engineer"
+        ) as fetch:
+            self.post_create(posting_text="", posting_url="https://acme.com/jobs/1")
+            response = self.post_create(posting_text="", posting_url="")
+        fetch.assert_called_once_with("https://acme.com/jobs/1")
+        self.assertIn(b"Paste the text of the posting or enter its URL.", response.data)
+        self.assertEqual(JobPosting.query.one().text, "We need a data engineer")
+        self.assertEqual(CoverLetter.query.count(), 1)
+
+    def test_posting_is_fetched_only_from_a_valid_form(self):
+        with mock.patch.object(
+            applications.posting_fetcher, "fetch", side_effect=FetchError("Could not download")
+        ) as fetch:
+            response = self.post_create(posting_text="", posting_url="file:///etc/passwd")
+            self.assertIn(b"Enter a URL that starts with http:// or https://.", response.data)
+            response = self.post_create(
+                posting_text="", posting_url="https://acme.com/jobs/1", language="DE"
+            )
+            self.assertIn(b"No resume was added for this language!", response.data)
+            fetch.assert_not_called()
+            response = self.post_create(posting_text="", posting_url="https://acme.com/jobs/1")
+        fetch.assert_called_once_with("https://acme.com/jobs/1")
+        self.assertIn(b"Could not download", response.data)
+        self.assertEqual(JobPosting.query.count(), 0)
+
+    def test_batch_downloads_postings_concurrently_before_writing(self):
+        events = []
+        both_started = threading.Barrier(2, timeout=5)
+        get_or_create = JobPosting.get_or_create
+
+        def fetch(url):
+            both_started.wait()
+            events.append(f"fetch {url}")
+            if url.endswith("/2"):
+                raise FetchError("Could not download")
+            return f"We need an engineer, see {url}"
+
+        def create_posting(**kwargs):
+            events.append("write")
+            return get_or_create(**kwargs)
+
+        postings = [
+            {"url": "https://acme.com/jobs/1"},
+            {"url": "https://acme.com/jobs/2"},
+            {"url": "https://acme.com/jobs/1", "company": "ACME"},
+        ]
+        with mock.patch.object(applications.posting_fetcher, "fetch", fetch), mock.patch.object(
+            JobPosting, "get_or_create", create_posting
+        ):
+            response = self.client.post("/batch", json={"language": "en", "postings": postings})
+        results = response.json["results"]
+        self.assertEqual([result["status"] for result in results], ["done", "invalid", "done"])
+        self.assertEqual(results[1]["error"], "Could not download")
+        self.assertEqual(
+            sorted(events[:2]), ["fetch https://acme.com/jobs/1", "fetch https://acme.com/jobs/2"]
+        )
+        self.assertEqual(events[2:], ["write", "write"])
+
+    def test_batch_reports_failed_generations(self):
+        postings = [{"text": "We need a data engineer"}, {"text": "We need an analyst"}]
+        with mock.patch.object(self.provider, "failure_rate", 1):
+            response = self.client.post("/batch", json={"language": "en", "postings": postings})
+        self.assertEqual(
+            [result["error"] for result in response.json["results"]],
+            ["Injected failure of text-bison@002"] * 2,
+        )
+
+    def test_batch_rejects_invalid_parallelism(self):
+        for parallelism in ["x", [], 1.5, True]:
+            response = self.client.post(
+                "/batch",
+                json={"language": "en", "postings": [{"text": "x"}], "parallelism": parallelism},
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json["error"], "The parallelism must be an integer.")
+        self.assertEqual(GenerationJob.query.count(), 0)
+
+    def test_batch_requires_resume(self):
+        response = self.client.post("/batch", json={"language": "de", "postings": [{"text": "x"}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_cli(self):
+        runner = app.test_cli_runner()
+        with runner.isolated_filesystem():
+            with open("postings.json", "w") as file:
+                json.dump([{"text": "We need a data engineer", "company": "ACME"}], file)
+            result = runner.invoke(args=["batch-create", "john@example.com", "postings.json"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(json.loads(result.output)[0]["status"], "done")
+
+    def test_batch_is_admitted_with_the_tokens_of_its_prompts(self):
+        postings = [{"text": "We need a data engineer"}, {"text": "We need an analyst " * 200}]
+        with mock.patch.object(scheduler, "admit") as admit:
+            self.client.post("/batch", json={"language": "en", "postings": postings})
+        tokens = sum(
+            estimate_tokens(prompt.prompt, DEFAULT_MODEL_CONFIG["max_output_tokens"])
+            for prompt in Prompt.query
+        )
+        admit.assert_called_once_with(math.ceil(tokens / 2), backlog=1)
+
+    def test_batch_cli_reports_exhausted_quota(self):
+        runner = app.test_cli_runner()
+        with runner.isolated_filesystem():
+            with open("postings.json", "w") as file:
+                json.dump([{"text": "We need a data engineer", "company": "ACME"}], file)
+            with mock.patch.object(scheduler, "max_queue_depth", 0):
+                result = runner.invoke(args=["batch-create", "john@example.com", "postings.json"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("retry after 1 seconds", result.output)
+        self.assertEqual(GenerationJob.query.count(), 0)
+
+    def test_rejected_batch_stores_nothing(self):
+        postings = [{"text": "We need a data engineer"}, {"text": "We need an analyst"}]
+        with mock.patch.object(scheduler, "max_queue_depth", 0):
+            response = self.client.post("/batch", json={"language": "en", "postings": postings})
+        self.assertEqual(response.status_code, 429)
+        db.session.expire_all()
+        self.assertEqual(JobPosting.query.count(), 0)
+        self.assertEqual(ModelConfig.query.count(), 0)
+        self.assertIsNone(self.resume.snapshot)
+
+    def test_create_is_rejected_when_quota_is_exhausted(self):
+        requests = TokenBucket(per_minute=60)
+        requests.level = 0
+        with mock.patch.object(scheduler, "max_wait", 0), mock.patch.object(
+            scheduler, "requests", requests
+        ):
+            response = self.post_create()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(GenerationJob.query.count(), 0)
+        self.assertEqual(JobPosting.query.count(), 0)
+
+    def test_resume_is_rendered_once_for_many_letters(self):
+        postings = [{"text": f"Posting number {index}"} for index in range(50)]
+        with mock.patch.object(
+            applications, "create_resume_table", wraps=create_resume_table
+        ) as render:
+            self.client.post("/batch", json={"language": "en", "postings": postings})
+            self.post_create()
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(CoverLetter.query.count(), 51)
+
+    def test_new_resume_item_invalidates_snapshot(self):
+        self.post_create()
+        self.assertIsNotNone(self.resume.snapshot)
+        self.client.post(
+            f"/add_resume_item/{self.resume.id}",
+            data={"title": "Python", "description": "10 years", "category": "skill"},
+        )
+        db.session.expire_all()
+        self.assertEqual(self.resume.version, 2)
+        self.assertIsNone(self.resume.snapshot)
+
+        self.post_create(company="Initech")
+        prompt = Prompt.query.order_by(Prompt.id.desc()).first()
+        self.assertIn("| skill | Python | 10 years |", prompt.prompt)
+        self.assertIn("| skill | Python | 10 years |", self.resume.snapshot.content)
+
+    def test_resume_table_keeps_item_order(self):
+        skill = ResumeItem(title="SQL", description="Queries", category="skill")
+        self.resume.resume_items.insert(0, skill)
+        table = create_resume_table(self.resume)
+        self.assertEqual(self.resume.resume_items[0], skill)
+        self.assertEqual(
+            table.splitlines()[2:],
+            [
+                "| skill | SQL | Queries |  |  |  |  |",
+                "| work | Data Engineer | Built pipelines | 2020-01-01 00:00:00 "
+                "| 2022-01-01 00:00:00 |  | Berlin |",
+            ],
+        )
+
+    def test_prompt_is_trimmed_to_config_budget(self):
+        self.post_create(posting_text="Data engineer wanted. " * 100)
+        prompt = Prompt.query.one()
+        self.assertEqual(prompt.input_tokens, count_tokens(prompt.prompt))
+        self.assertIn("Data Engineer", prompt.prompt)
+
+        with mock.patch.dict(applications.DEFAULT_MODEL_CONFIG, max_input_tokens=300):
+            self.post_create(posting_text="Data engineer wanted. " * 100)
+        prompt = Prompt.query.order_by(Prompt.id.desc()).first()
+        self.assertLessEqual(prompt.input_tokens, 300)
+        self.assertEqual(prompt.input_tokens, count_tokens(prompt.prompt))
+        self.assertNotIn("Data Engineer", prompt.prompt)
+        # the trimmed sections are stored as components of their own
+        self.assertIsNone(prompt.text)
+        self.assertIsNotNone(prompt.posting_text)
+        self.assertNotEqual(prompt.snapshot, self.resume.snapshot)
+
+    def test_prompt_keeps_most_relevant_items(self):
+        for title in ["Spark", "Photoshop", "Knitting"]:
+            self.resume.resume_items.append(
+                ResumeItem(title=title, description=f"{title} expert", category="skill")
+            )
+        self.resume.invalidate_snapshot()
+        db.session.commit()
+        with mock.patch.dict(app.config, RESUME_TOP_K_PER_CATEGORY=1):
+            self.post_create(posting_text="We need a data engineer who knows Spark")
+        prompt = Prompt.query.one()
+        self.assertIn("Spark", prompt.prompt)
+        self.assertIn("Data Engineer", prompt.prompt)
+        self.assertNotIn("Photoshop", prompt.prompt)
+        self.assertNotEqual(prompt.snapshot, self.resume.snapshot)
+
+    def test_history_is_paginated_by_cursor(self):
+        config = ModelConfig(name="PaLM", model_id="text-bison@002")
+        posting = JobPosting(text="text", company="ACME")
+        prompt = Prompt(prompt="prompt", resume=self.resume, posting=posting)
+        now = datetime(2024, 1, 1)
+        # two letters share a timestamp, the id breaks the tie
+        timestamps = [now, now, now - timedelta(days=1), now - timedelta(days=2), now]
+        letters = [
+            CoverLetter(prompt=prompt, config=config, response=f"letter {index}", timestamp=time)
+            for index, time in enumerate(timestamps)
+        ]
+        other = User(name="jane", email="jane@example.com")
+        other_prompt = Prompt(
+            prompt="prompt", resume=Resume(language="en", user=other), posting=posting
+        )
+        db.session.add_all(letters + [CoverLetter(prompt=other_prompt, config=config, response="")])
+        db.session.commit()
+        self.assertEqual({letter.user_id for letter in letters}, {self.user.id})
+
+        pages, cursor = [], None
+        while True:
+            query = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+            page = self.client.get(
+                "/coverletters", query_string=query, headers={"Accept": "application/json"}
+            ).json
+            pages.append([letter["response"] for letter in page["coverletters"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, [["letter 4", "letter 1"], ["letter 0", "letter 2"], ["letter 3"]])
+
+        html = self.client.get("/coverletters", query_string={"limit": 1}).get_data(as_text=True)
+        self.assertIn("letter 4", html)
+        self.assertIn("Older coverletters", html)
+        self.assertEqual(self.client.get("/coverletters?cursor=broken").status_code, 400)
+
+    def test_job_status_of_other_user_is_hidden(self):
+        other = User(name="jane", email="jane@example.com")
+        posting = JobPosting(text="text")
+        job = GenerationJob(
+            user=other,
+            prompt=Prompt(prompt="prompt", resume=self.resume, posting=posting),
+            config=ModelConfig(name="PaLM", model_id="text-bison@002"),
+        )
+        db.session.add(job)
+        db.session.commit()
+        self.assertEqual(self.client.get(f"/jobs/{job.id}").status_code, 404)
+
+    @mock.patch("coverletter.views.applications.request_coverletter_with_sdk", fake_coverletter)
+    def test_recover_requeues_pending_jobs(self):
+        posting = JobPosting(text="text", company="Initech")
+        prompt = Prompt(prompt="prompt", resume=self.resume, posting=posting)
+        config = ModelConfig(name="PaLM", model_id="text-bison@002")
+        queued = GenerationJob(user=self.user, prompt=prompt, config=config)
+        stale = GenerationJob(
+            user=self.user,
+            prompt=prompt,
+            config=config,
+            status=GenerationJob.RUNNING,
+            started=datetime.now(timezone.utc) - timedelta(hours=1),
+        )
+        running = GenerationJob(
+            user=self.user,
+            prompt=prompt,
+            config=config,
+            status=GenerationJob.RUNNING,
+            started=datetime.now(timezone.utc),
+        )
+        db.session.add_all([queued, stale, running])
+        db.session.commit()
+
+        generation_queue.start()
+        db.session.expire_all()
+        self.assertEqual(queued.status, GenerationJob.DONE)
+        self.assertEqual(stale.status, GenerationJob.DONE)
+        self.assertEqual(running.status, GenerationJob.RUNNING)
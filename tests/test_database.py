@@ -0,0 +1,99 @@
+from unittest import TestCase
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import sqlite3
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from coverletter import app
+from coverletter.database import configure_sqlite, engine_options, normalize_database_url
+
+
+class DatabaseConfigCase(TestCase):
+    def test_normalize_database_url(self):
+        self.assertEqual(
+            normalize_database_url("postgres://user:pw@db/coverletter"),
+            "postgresql+psycopg://user:pw@db/coverletter",
+        )
+        self.assertEqual(
+            normalize_database_url("postgresql+psycopg2://db/coverletter"),
+            "postgresql+psycopg2://db/coverletter",
+        )
+        self.assertEqual(normalize_database_url("sqlite:///x.db"), "sqlite:///x.db")
+
+    def test_pool_options_apply_to_servers_only(self):
+        config = dict(app.config, SQLALCHEMY_DATABASE_URI="postgresql+psycopg://db/coverletter")
+        options = engine_options(config)
+        self.assertEqual(options["pool_size"], app.config["DATABASE_POOL_SIZE"])
+        self.assertTrue(options["pool_pre_ping"])
+        config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///x.db"
+        self.assertEqual(engine_options(config), {})
+
+
+class SQLiteConcurrencyCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def engine(self, name: str, **settings):
+        engine = create_engine(f"sqlite+pysqlite:///{os.path.join(self.directory.name, name)}")
+        configure_sqlite(engine, dict(app.config, **settings))
+        connection = engine.raw_connection()
+        connection.execute("CREATE TABLE letters (id INTEGER PRIMARY KEY, response TEXT)")
+        connection.execute("INSERT INTO letters (response) VALUES ('Dear hiring manager')")
+        connection.commit()
+        connection.close()
+        return engine
+
+    def read_during_write(self, engine) -> float:
+        """Seconds a reader takes while another connection holds a write transaction."""
+        writing, done = threading.Event(), threading.Event()
+
+        def write():
+            connection = engine.raw_connection()
+            connection.execute("BEGIN EXCLUSIVE")
+            connection.execute("INSERT INTO letters (response) VALUES ('Dear team')")
+            writing.set()
+            done.wait(5)
+            connection.commit()
+            connection.close()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writing.wait(5)
+        started = time.perf_counter()
+        try:
+            connection = engine.raw_connection()
+            count = connection.execute("SELECT count(*) FROM letters").fetchone()[0]
+            connection.close()
+            self.assertEqual(count, 1)
+            return time.perf_counter() - started
+        finally:
+            done.set()
+            writer.join()
+
+    def test_pragmas_are_applied(self):
+        connection = self.engine("coverletter.db").raw_connection()
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 1)
+        self.assertEqual(
+            connection.execute("PRAGMA busy_timeout").fetchone()[0],
+            app.config["SQLITE_BUSY_TIMEOUT"],
+        )
+        connection.close()
+
+    def test_readers_do_not_wait_for_writers(self):
+        self.assertLess(self.read_during_write(self.engine("coverletter.db")), 0.1)
+
+        # without WAL the same read waits for the writer until the busy timeout gives up
+        engine = self.engine("rollback.db", SQLITE_WAL=False, SQLITE_BUSY_TIMEOUT=200)
+        with self.assertRaises(sqlite3.OperationalError):
+            self.read_during_write(engine)
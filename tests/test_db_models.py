@@ -6,7 +6,16 @@ os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
 
 from datetime import datetime, timezone, timedelta
 from coverletter import app, db
-from coverletter.db_models import User, Resume, Prompt, CoverLetter, JobPosting, ModelConfig
+from coverletter.db_models import (
+    CompressedText,
+    CoverLetter,
+    JobPosting,
+    ModelConfig,
+    Prompt,
+    Resume,
+    ResumeSnapshot,
+    User,
+)
 
 # configure the app for testing
 app.config["TESTING"] = True
@@ -58,3 +67,76 @@ class UserModelCase(TestCase):
         db.session.add(cl)
         db.session.commit()
         self.assertEqual(u.previous_coverletters().all(), [cl])
+
+    def test_model_configs_are_deduplicated(self):
+        config = ModelConfig.get_or_create(name="PaLM", model_id="text-bison@002", temperature=0)
+        db.session.commit()
+        self.assertIs(
+            ModelConfig.get_or_create(name="PaLM", model_id="text-bison@002", temperature=0.0),
+            config,
+        )
+        other = ModelConfig.get_or_create(name="PaLM", model_id="text-bison@002", temperature=0.5)
+        db.session.commit()
+        self.assertNotEqual(other.id, config.id)
+        self.assertEqual(ModelConfig.query.count(), 2)
+
+    def test_job_postings_are_deduplicated(self):
+        posting = JobPosting.get_or_create(
+            text="We need a\tdata engineer.\n\n\n\nBerlin ",
+            url="HTTPS://Example.com/jobs/1/?utm_source=mail&gclid=abc&ref=b&a=1#apply",
+            company=" ACME ",
+            language="en",
+        )
+        db.session.commit()
+        self.assertEqual(posting.text, "We need a data engineer.\n\nBerlin")
+        self.assertEqual(posting.url, "https://example.com/jobs/1?a=1&ref=b")
+        self.assertEqual(posting.company, "ACME")
+
+        copy = JobPosting.get_or_create(
+            text="We need a data engineer.\n\nBerlin", company="ACME", language="en"
+        )
+        self.assertIs(copy, posting)
+        other = JobPosting.get_or_create(text="We need a data engineer.", company="ACME")
+        db.session.commit()
+        self.assertNotEqual(other.id, posting.id)
+        self.assertEqual(JobPosting.query.count(), 2)
+
+    def test_large_text_is_stored_compressed(self):
+        response = "Dear hiring manager, " * 200
+        cl = CoverLetter(
+            response=response,
+            prompt=Prompt(
+                prompt="prompt",
+                resume=Resume(language="en", user=User(name="john", email="john@example.com")),
+                posting=JobPosting(),
+            ),
+            config=ModelConfig(name="config", model_id="model_id"),
+        )
+        db.session.add(cl)
+        db.session.commit()
+        stored = db.session.execute(db.text("SELECT response FROM cover_letters")).scalar()
+        self.assertLess(len(stored), len(response) / 10)
+        db.session.expire_all()
+        self.assertEqual(cl.response, response)
+        self.assertEqual(CompressedText.decompress(CompressedText.compress("short")), "short")
+
+    def test_prompt_is_rendered_from_components(self):
+        u = User(name="john", email="john@example.com")
+        posting = JobPosting(text="We need a data engineer", company="ACME")
+        p = Prompt(
+            resume=Resume(language="en", user=u),
+            posting=posting,
+            template_version=1,
+            applicant="john",
+            snapshot=ResumeSnapshot.get_or_create("| work | Data Engineer |\n"),
+        )
+        db.session.add(p)
+        db.session.commit()
+        db.session.expire_all()
+        self.assertIsNone(p.text)
+        self.assertTrue(
+            p.prompt.startswith("Your task is to generate a cover letter for applicant")
+        )
+        self.assertIn("john and company ACME", p.prompt)
+        self.assertIn("We need a data engineer", p.prompt)
+        self.assertIn("| work | Data Engineer |", p.prompt)
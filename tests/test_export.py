@@ -0,0 +1,123 @@
+from unittest import TestCase
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import tempfile
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+from coverletter import app, db
+from coverletter.db_models import (
+    CoverLetter,
+    JobPosting,
+    ModelConfig,
+    Prompt,
+    Resume,
+    User,
+    user_cache,
+)
+from coverletter.export import ExportedLetter, render_docx, render_pdf, stream_zip
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+
+LETTER = ExportedLetter(
+    id=7,
+    timestamp=datetime(2024, 3, 1, 12, 0),
+    response="Dear hiring team (ACME),\n\nI build pipelines & love it.",
+    company="ACME",
+    location="Berlin",
+    url="https://acme.com/jobs/1",
+)
+
+
+class ExportCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user_cache.clear()
+        self.user = User(name="john", email="john@example.com")
+        self.other = User(name="jane", email="jane@example.com")
+        self.config = ModelConfig(name="PaLM", model_id="text-bison@002")
+        db.session.add_all([self.user, self.other, self.config])
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_letter(self, user: User, company: str, timestamp: datetime) -> CoverLetter:
+        posting = JobPosting.get_or_create(text=f"Posting of {company}", company=company)
+        prompt = Prompt(posting=posting, resume=Resume(language="en", user=user), prompt="p")
+        coverletter = CoverLetter(
+            prompt=prompt, config=self.config, response=f"Dear {company}", timestamp=timestamp
+        )
+        db.session.add(coverletter)
+        db.session.commit()
+        return coverletter
+
+    def test_archive_is_streamed_per_document(self):
+        chunks = list(stream_zip([LETTER, LETTER._replace(id=8, company=None)], "md"))
+        self.assertEqual(len(chunks), 3)
+        archive = zipfile.ZipFile(BytesIO(b"".join(chunks)))
+        self.assertEqual(archive.namelist(), ["2024-03-01_acme_7.md", "2024-03-01_unknown_8.md"])
+        markdown = archive.read("2024-03-01_acme_7.md").decode("utf-8")
+        self.assertTrue(markdown.startswith("# Cover letter for ACME\n\n*2024-03-01, Berlin"))
+        self.assertIn("I build pipelines & love it.", markdown)
+
+    def test_documents_are_valid(self):
+        docx = zipfile.ZipFile(BytesIO(render_docx(LETTER)))
+        document = docx.read("word/document.xml").decode("utf-8")
+        self.assertIn("pipelines &amp; love it.", document)
+        self.assertIn("[Content_Types].xml", docx.namelist())
+
+        pdf = render_pdf(LETTER._replace(response="word " * 5000))
+        self.assertTrue(pdf.startswith(b"%PDF-1.4") and pdf.endswith(b"%%EOF\n"))
+        self.assertIn(b"/Count 7", pdf)
+        self.assertIn(b"(Dear hiring team \\(ACME\\),)", render_pdf(LETTER))
+        # the cross reference table points at the objects
+        xref = int(pdf.rsplit(b"startxref\n", 1)[1].split(b"\n")[0])
+        self.assertTrue(pdf[xref:].startswith(b"xref"))
+        first = int(pdf[xref:].split(b"\n")[3].split()[0])
+        self.assertTrue(pdf[first:].startswith(b"1 0 obj"))
+
+    def test_export_endpoint_filters_letters(self):
+        self.add_letter(self.user, "ACME", datetime(2024, 1, 10))
+        self.add_letter(self.user, "Initech", datetime(2024, 2, 10))
+        self.add_letter(self.user, "ACME Labs", datetime(2024, 3, 10))
+        self.add_letter(self.other, "ACME", datetime(2024, 2, 10))
+
+        response = self.client.get("/export?format=docx&since=2024-02-01&company=acme")
+        self.assertEqual(response.mimetype, "application/zip")
+        names = zipfile.ZipFile(BytesIO(response.data)).namelist()
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].startswith("2024-03-10_acme-labs_"))
+
+        response = self.client.get("/export?until=2024-02-10")
+        self.assertEqual(len(zipfile.ZipFile(BytesIO(response.data)).namelist()), 2)
+        self.assertEqual(self.client.get("/export?format=rtf").status_code, 400)
+        self.assertEqual(self.client.get("/export?since=yesterday").status_code, 400)
+
+    def test_export_cli(self):
+        self.add_letter(self.user, "ACME", datetime(2024, 1, 10))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "letters.zip")
+            result = app.test_cli_runner().invoke(
+                args=["export-letters", "john@example.com", path, "--format", "pdf"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            names = zipfile.ZipFile(path).namelist()
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith(".pdf"))
@@ -0,0 +1,173 @@
+from unittest import TestCase, mock
+import ipaddress
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from coverletter import app
+from coverletter.fetcher import FetchError, PostingFetcher, extract_text, is_public_address
+
+POSTING = b"""<html><head><title>Jobs</title><style>p {}</style></head><body>
+<nav>Home | Jobs | About us</nav>
+<main><h1>Data Engineer</h1><p>We need a <b>data</b> engineer in Berlin.</p>
+<ul><li>Python</li><li>SQL</li></ul><script>track()</script></main>
+<footer>Imprint</footer></body></html>"""
+
+
+class PostingHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/large":
+            # no Content-Length, the size is only known while reading
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(b"<p>" + b"x" * 4096 + b"</p>")
+            return
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        if self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", self.path.split("?to=", 1)[-1])
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(POSTING)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(POSTING)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FetcherCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PostingHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        PostingHandler.requests = []
+        # the test server is the only host on the loopback address that may be fetched
+        patcher = mock.patch(
+            "coverletter.fetcher.is_public_address",
+            lambda address: address == ipaddress.ip_address("127.0.0.1")
+            or is_public_address(address),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        self.app_context.pop()
+
+    def test_main_text_is_extracted(self):
+        fetcher = PostingFetcher(cache_dir=self.cache_dir.name)
+        self.assertEqual(
+            fetcher.fetch(f"{self.base_url}/job"),
+            "Data Engineer\n\nWe need a data engineer in Berlin.\n\nPython\nSQL",
+        )
+
+    def test_cached_pages_are_reused_and_revalidated(self):
+        fetcher = PostingFetcher(cache_dir=self.cache_dir.name, max_age=3600)
+        text = fetcher.fetch(f"{self.base_url}/job")
+        self.assertEqual(fetcher.fetch(f"{self.base_url}/job"), text)
+        self.assertEqual(PostingHandler.requests, [("/job", None)])
+
+        # a new fetcher with an expired cache revalidates the stored entry
+        expired = PostingFetcher(cache_dir=self.cache_dir.name, max_age=0)
+        self.assertEqual(expired.fetch(f"{self.base_url}/job"), text)
+        self.assertEqual(PostingHandler.requests[-1], ("/job", '"v1"'))
+        self.assertEqual(fetcher.stats(), {"hits": 1, "revalidated": 0, "downloads": 1})
+        self.assertEqual(expired.stats(), {"hits": 0, "revalidated": 1, "downloads": 0})
+
+    def test_large_and_failed_responses_are_rejected(self):
+        fetcher = PostingFetcher(cache_dir=self.cache_dir.name, max_bytes=1024)
+        with self.assertRaisesRegex(FetchError, "larger than 1024 bytes"):
+            fetcher.fetch(f"{self.base_url}/large")
+        with self.assertRaisesRegex(FetchError, "larger than 100 bytes"):
+            PostingFetcher(cache_dir=self.cache_dir.name, max_bytes=100).fetch(
+                f"{self.base_url}/job"
+            )
+        with self.assertRaisesRegex(FetchError, "404"):
+            PostingFetcher(cache_dir=self.cache_dir.name).fetch(f"{self.base_url}/missing")
+        with self.assertRaises(FetchError):
+            fetcher.fetch("file:///etc/passwd")
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_private_addresses_are_rejected(self):
+        for address in [
+            "127.0.0.1",
+            "10.0.0.1",
+            "172.16.0.1",
+            "192.168.1.1",
+            "169.254.169.254",
+            "100.64.0.1",
+            "0.0.0.0",
+            "224.0.0.1",
+            "::1",
+            "fe80::1",
+            "fc00::1",
+            "::ffff:127.0.0.1",
+        ]:
+            self.assertFalse(is_public_address(ipaddress.ip_address(address)), address)
+        self.assertTrue(is_public_address(ipaddress.ip_address("93.184.216.34")))
+        self.assertTrue(is_public_address(ipaddress.ip_address("2606:4700::6810:84e5")))
+
+        fetcher = PostingFetcher(cache_dir=self.cache_dir.name)
+        with mock.patch("coverletter.fetcher.is_public_address", is_public_address):
+            with self.assertRaisesRegex(FetchError, "not a public address"):
+                fetcher.fetch(f"{self.base_url}/job")
+        with self.assertRaisesRegex(FetchError, "not a public address"):
+            fetcher.fetch("http://169.254.169.254/latest/meta-data/")
+        with self.assertRaisesRegex(FetchError, "not a public address"):
+            fetcher.fetch("http://[::1]/")
+        self.assertEqual(PostingHandler.requests, [])
+
+    def test_every_redirect_is_checked(self):
+        fetcher = PostingFetcher(cache_dir=self.cache_dir.name, max_redirects=2)
+        self.assertIn("Data Engineer", fetcher.fetch(f"{self.base_url}/redirect?to=/job"))
+        with self.assertRaisesRegex(FetchError, "not a public address"):
+            fetcher.fetch(f"{self.base_url}/redirect?to=http://169.254.169.254/latest/meta-data/")
+        with self.assertRaisesRegex(FetchError, "Only http and https"):
+            fetcher.fetch(f"{self.base_url}/redirect?to=file:///etc/passwd")
+        with self.assertRaisesRegex(FetchError, "More than 2 redirects"):
+            fetcher.fetch(
+                f"{self.base_url}/redirect?to=/redirect?to=/redirect?to=/redirect?to=/job"
+            )
+        self.assertEqual(
+            [path for path, _ in PostingHandler.requests if not path.startswith("/redirect")],
+            ["/job"],
+        )
+
+    def test_structured_posting_description_is_preferred(self):
+        page = b"""<html><head><script type="application/ld+json">
+            {"@context": "https://schema.org", "@type": "JobPosting",
+             "description": "<p>Build <i>pipelines</i></p><p>Remote</p>"}
+            </script></head><body><main>Cookie banner</main></body></html>"""
+        self.assertEqual(extract_text(page), "Build pipelines\n\nRemote")
+        self.assertEqual(extract_text(b"  plain\n\n\n text ", "text/plain"), "plain\n\ntext")
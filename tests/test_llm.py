@@ -0,0 +1,190 @@
+from unittest import TestCase, mock
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import threading
+import time
+from types import SimpleNamespace
+
+from coverletter import app
+from coverletter.cache import TTLCache
+from coverletter.db_models import ModelConfig
+from coverletter.llm import (
+    LocalProvider,
+    LocalProviderError,
+    ModelClientPool,
+    Provider,
+    ResponseCache,
+    VertexProvider,
+    get_provider,
+)
+
+# configure the app for testing
+app.config["TESTING"] = True
+
+
+class FakeProvider(Provider):
+    name = "fake"
+    PARAMETERS = {"max_output_tokens": "max_tokens", "top_k": "top_k"}
+
+    def __init__(self):
+        self.loaded = []
+
+    def load(self, model_id):
+        self.loaded.append(model_id)
+        time.sleep(0.01)
+        return model_id
+
+    def predict(self, model, prompt, parameters):
+        return f"{model}: {prompt} {parameters}"
+
+    def predict_streaming(self, model, prompt, parameters):
+        yield self.predict(model, prompt, parameters)
+
+
+class ModelClientPoolCase(TestCase):
+    def setUp(self):
+        self.provider = FakeProvider()
+        self.pool = ModelClientPool(idle_timeout=60)
+
+    def test_clients_are_reused(self):
+        client = self.pool.get(self.provider, "text-bison@002", {"max_output_tokens": 1024})
+        self.assertIs(
+            self.pool.get(self.provider, "text-bison@002", {"max_output_tokens": 1024}), client
+        )
+        self.assertIsNot(
+            self.pool.get(self.provider, "text-bison@002", {"max_output_tokens": 256}), client
+        )
+        self.assertEqual(client.predict("hi"), "text-bison@002: hi {'max_tokens': 1024}")
+        self.assertEqual(self.pool.stats(), {"size": 2, "hits": 1, "misses": 2, "evictions": 0})
+
+    def test_concurrent_lookups_load_once(self):
+        threads = [
+            threading.Thread(
+                target=self.pool.get, args=(self.provider, "text-bison@002", {"top_k": 40})
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.provider.loaded, ["text-bison@002"])
+        self.assertEqual(self.pool.stats()["hits"], 7)
+
+    def test_slow_load_does_not_block_other_clients(self):
+        cached = self.pool.get(self.provider, "text-bison@001", {})
+        loading, release = threading.Event(), threading.Event()
+
+        def load(model_id):
+            loading.set()
+            release.wait(5)
+            return model_id
+
+        with mock.patch.object(self.provider, "load", load):
+            thread = threading.Thread(target=self.pool.get, args=(self.provider, "gemini", {}))
+            thread.start()
+            loading.wait(5)
+            try:
+                self.assertIs(self.pool.get(self.provider, "text-bison@001", {}), cached)
+            finally:
+                release.set()
+                thread.join()
+        self.assertEqual(self.pool.stats(), {"size": 2, "hits": 1, "misses": 2, "evictions": 0})
+
+    def test_idle_clients_are_evicted(self):
+        self.pool.get(self.provider, "text-bison@002", {})
+        self.pool.idle_timeout = 0
+        self.pool.get(self.provider, "text-bison@001", {})
+        self.assertEqual(self.pool.stats()["evictions"], 1)
+        self.assertEqual(self.pool.stats()["size"], 1)
+
+    @mock.patch.dict(app.config, {"LLM_PROVIDER": ""})
+    def test_failed_warm_up_is_logged(self):
+        config = ModelConfig(name="PaLM", model_id="text-bison@002")
+        with self.assertLogs(app.logger, "WARNING"):
+            self.pool.warm_up(config)
+        self.assertEqual(self.pool.stats()["size"], 0)
+
+
+class ProviderCase(TestCase):
+    def test_incomplete_provider_cannot_be_created(self):
+        class IncompleteProvider(Provider):
+            def load(self, model_id):
+                return model_id
+
+        with self.assertRaises(TypeError):
+            IncompleteProvider()
+
+    @mock.patch.dict(app.config, {"LLM_PROVIDER": ""})
+    def test_provider_is_selected_by_config(self):
+        self.assertIsInstance(get_provider(ModelConfig(name="PaLM", model_id="x")), VertexProvider)
+        self.assertIsInstance(
+            get_provider(ModelConfig(name="?", model_id="local-1")), LocalProvider
+        )
+        app.config["LLM_PROVIDER"] = "local"
+        self.assertIsInstance(get_provider(ModelConfig(name="PaLM", model_id="x")), LocalProvider)
+
+    def test_vertex_parameters_are_mapped(self):
+        config = ModelConfig(
+            name="PaLM",
+            model_id="text-bison@002",
+            temperature=0.2,
+            stop_sequence="###",
+            logprobs=2.0,
+            grounding_source="web",
+        )
+        self.assertEqual(
+            VertexProvider().map_parameters(config.generation_parameters()),
+            {"temperature": 0.2, "stop_sequences": ["###"], "logprobs": 2},
+        )
+
+    def test_local_provider_is_deterministic(self):
+        provider = LocalProvider(latency=0, token_delay=0, failure_rate=0)
+        parameters = {"max_output_tokens": 16}
+        letter = provider.predict("local", "a prompt about data engineering", parameters)
+        self.assertEqual(len(letter.split()), 16)
+        self.assertEqual(
+            "".join(
+                provider.predict_streaming("local", "a prompt about data engineering", parameters)
+            ),
+            letter,
+        )
+        self.assertEqual(provider.calls, 2)
+
+    def test_local_provider_injects_failures(self):
+        provider = LocalProvider(latency=0, token_delay=0, failure_rate=1)
+        with self.assertRaises(LocalProviderError):
+            provider.predict("local", "prompt", {})
+
+
+class TTLCacheCase(TestCase):
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_response_key_depends_on_parameters(self):
+        key = ResponseCache.key("prompt", "text-bison@002", {"max_output_tokens": 1024})
+        self.assertEqual(
+            key, ResponseCache.key("prompt", "text-bison@002", {"max_output_tokens": 1024})
+        )
+        self.assertNotEqual(
+            key, ResponseCache.key("prompt", "text-bison@002", {"max_output_tokens": 256})
+        )
+        self.assertNotEqual(
+            key, ResponseCache.key("prompt", "text-bison@001", {"max_output_tokens": 1024})
+        )
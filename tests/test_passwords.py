@@ -0,0 +1,91 @@
+from unittest import TestCase, mock
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from coverletter import app, db
+from coverletter.db_models import User
+from coverletter.passwords import PasswordHasher, full_method
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+
+
+class PasswordHasherCase(TestCase):
+    def test_hash_uses_configured_method(self):
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=1)
+        password_hash = hasher.hash("secret")
+        self.assertTrue(password_hash.startswith("pbkdf2:sha256:1000$"))
+        self.assertTrue(hasher.check(password_hash, "secret"))
+        self.assertFalse(hasher.check(password_hash, "wrong"))
+        hasher.shutdown()
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher(method="pbkdf2:sha256:2000")
+        self.assertFalse(hasher.needs_rehash(generate_password_hash("x", "pbkdf2:sha256:2000")))
+        self.assertTrue(hasher.needs_rehash(generate_password_hash("x", "pbkdf2:sha256:1000")))
+        self.assertTrue(hasher.needs_rehash(generate_password_hash("x", "scrypt")))
+        self.assertEqual(full_method("scrypt"), "scrypt:32768:8:1")
+
+    def test_hashing_is_bounded_by_workers(self):
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=2)
+        running, peak = 0, 0
+        lock = threading.Lock()
+
+        def slow_check(password_hash: str, password: str) -> bool:
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return True
+
+        with mock.patch("coverletter.passwords.check_password_hash", slow_check):
+            with ThreadPoolExecutor(max_workers=8) as requests:
+                results = list(requests.map(lambda _: hasher.check("hash", "x"), range(8)))
+        hasher.shutdown()
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(peak, 2)
+
+
+class LoginRehashCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_login_rehashes_outdated_hash(self):
+        user = User(name="john", email="john@example.com")
+        user.password_hash = generate_password_hash("secret", "pbkdf2:sha256:1000")
+        db.session.add(user)
+        db.session.commit()
+
+        with mock.patch.dict(app.config, PASSWORD_HASH_METHOD="pbkdf2:sha256:2000"):
+            response = self.client.post(
+                "/login", data={"email": "john@example.com", "password": "secret"}
+            )
+            self.client.get("/logout")
+            db.session.expire_all()
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(user.password_hash.startswith("pbkdf2:sha256:2000$"))
+            self.assertFalse(user.password_needs_rehash())
+            self.assertTrue(user.check_password("secret"))
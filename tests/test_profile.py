@@ -0,0 +1,228 @@
+from unittest import TestCase, mock
+import os
+import time
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.exc import DetachedInstanceError
+from coverletter import app, db
+from coverletter.activity import LastSeenBuffer, last_seen_buffer
+from coverletter.db_models import User, Resume, ResumeItem, load_user, user_cache
+from coverletter.views.applications import generation_queue
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+
+
+class ProfileCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(name="john", email="john@example.com")
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+        user_cache.clear()
+        # the first request also starts the generation queue
+        self.client.get("/index")
+
+    def tearDown(self):
+        generation_queue.shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_resume(self, language: str, items: int) -> Resume:
+        resume = Resume(language=language, user=self.user)
+        for index in range(items):
+            resume.resume_items.append(
+                ResumeItem(
+                    title=f"Item {index}",
+                    description="Description",
+                    category=["work", "education", "skill"][index % 3],
+                    begin_date=datetime(2000 + index, 1, 1) if index % 3 != 2 else None,
+                )
+            )
+        db.session.add(resume)
+        db.session.commit()
+        return resume
+
+    def count_statements(self, url: str) -> int:
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        db.session.expire_all()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(response.status_code, 200)
+        return len(statements)
+
+    def test_profile_queries_do_not_grow_with_resumes(self):
+        self.add_resume("en", items=2)
+        small = self.count_statements("/user/john@example.com")
+        for language in ("de", "fr", "es"):
+            self.add_resume(language, items=30)
+        large = self.count_statements("/user/john@example.com")
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 5)
+
+    def test_items_are_grouped_per_category(self):
+        resume = self.add_resume("en", items=6)
+        categories = resume.get_items_per_category()
+        self.assertEqual(list(categories), ["work", "education", "skill"])
+        self.assertEqual([item["title"] for item in categories["work"]], ["Item 3", "Item 0"])
+        self.assertEqual(categories["work"][0]["begin_date"], "01/03")
+        self.assertEqual([item["title"] for item in categories["skill"]], ["Item 2", "Item 5"])
+
+    def test_read_only_requests_use_cached_user(self):
+        user_cache.clear()
+        with app.test_request_context("/index"):
+            self.assertTrue(inspect(load_user(str(self.user.id))).persistent)
+            statements = []
+
+            def count(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                cached = load_user(str(self.user.id))
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(statements, [])
+        self.assertTrue(inspect(cached).detached)
+        self.assertEqual((cached.id, cached.name), (self.user.id, "john"))
+        # the password hash is not cached
+        with self.assertRaises(DetachedInstanceError):
+            cached.password_hash
+        self.assertEqual(user_cache.stats()["hits"], 1)
+
+        with app.test_request_context("/edit_profile", method="POST"):
+            self.assertIs(load_user(str(self.user.id)), self.user)
+
+    def test_profile_edit_and_logout_invalidate_cached_user(self):
+        self.client.get("/index")
+        self.client.post("/edit_profile", data={"name": "johnny", "about_me": "Hi"})
+        self.assertIsNone(user_cache.get(self.user.id))
+        self.assertIn("Hi, johnny!", self.client.get("/index").get_data(as_text=True))
+
+        self.client.get("/logout")
+        self.assertIsNone(user_cache.get(self.user.id))
+
+
+class LastSeenCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.users = [
+            User(name=name, email=f"{name}@example.com", last_seen=self.old)
+            for name in ("john", "jane", "jim")
+        ]
+        db.session.add_all(self.users)
+        db.session.commit()
+        user_cache.clear()
+        self.buffer = LastSeenBuffer(resolution=300, flush_interval=3600, flush_size=10)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def stored_last_seen(self, user: User) -> datetime:
+        db.session.expire_all()
+        return user.last_seen.replace(tzinfo=timezone.utc)
+
+    def test_visits_are_written_in_one_update(self):
+        now = self.old + timedelta(days=1)
+        for user in self.users:
+            self.buffer.record(user, now)
+        self.assertEqual(self.stored_last_seen(self.users[0]), self.old)
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            self.assertEqual(self.buffer.flush(), 3)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([self.stored_last_seen(user) for user in self.users], [now] * 3)
+
+    def test_visits_within_resolution_are_not_recorded(self):
+        now = self.old + timedelta(days=1)
+        self.buffer.record(self.users[0], now)
+        self.buffer.record(self.users[0], now + timedelta(minutes=1))
+        self.buffer.record(self.users[1], self.old + timedelta(minutes=1))
+        self.assertEqual(self.buffer.stats()["pending"], 1)
+        self.assertEqual(self.buffer.stats()["recorded"], 1)
+
+    def test_flush_when_buffer_is_full(self):
+        self.buffer.flush_size = 2
+        now = self.old + timedelta(days=1)
+        self.buffer.record(self.users[0], now)
+        self.assertEqual(self.stored_last_seen(self.users[0]), self.old)
+        self.buffer.record(self.users[1], now)
+        self.assertEqual(self.stored_last_seen(self.users[0]), now)
+        self.assertEqual(self.buffer.stats()["pending"], 0)
+
+    def test_flush_never_moves_last_seen_backwards(self):
+        newer = self.old + timedelta(days=2)
+        other = LastSeenBuffer(resolution=300, flush_interval=3600, flush_size=10)
+        other.record(self.users[0], newer)
+        other.flush()
+        # this worker loaded the user before the other one flushed
+        self.buffer.record(User(id=self.users[0].id, last_seen=self.old), newer - timedelta(days=1))
+        self.buffer.flush()
+        self.assertEqual(self.stored_last_seen(self.users[0]), newer)
+
+    def test_requests_do_not_commit_last_seen(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(self.users[0].id)
+        with mock.patch.dict(app.config, LAST_SEEN_FLUSH_INTERVAL=3600, LAST_SEEN_FLUSH_SIZE=10):
+            client.get("/index")
+            client.get("/index")
+        self.assertEqual(self.stored_last_seen(self.users[0]), self.old)
+        self.assertEqual(last_seen_buffer.flush(), 1)
+        self.assertGreater(self.stored_last_seen(self.users[0]), self.old)
+
+    def test_cached_user_is_not_recorded_again_after_a_flush(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(self.users[0].id)
+        # every visit is written at once, the cached user keeps its old last_seen
+        self.buffer.flush_size = 1
+        with mock.patch("coverletter.views.profile.last_seen_buffer", self.buffer):
+            client.get("/index")
+            client.get("/index")
+        self.assertEqual(self.buffer.stats()["recorded"], 1)
+        self.assertGreater(self.stored_last_seen(self.users[0]), self.old)
+
+    def test_pending_visits_are_written_without_another_visit(self):
+        buffer = LastSeenBuffer(resolution=300, flush_interval=0.05, flush_size=10)
+        now = self.old + timedelta(days=1)
+        buffer.record(self.users[0], now)
+        deadline = time.monotonic() + 5
+        while buffer.stats()["flushes"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(buffer.stats()["pending"], 0)
+        self.assertEqual(self.stored_last_seen(self.users[0]), now)
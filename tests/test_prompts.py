@@ -0,0 +1,102 @@
+from unittest import TestCase
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+from datetime import datetime
+
+from coverletter.db_models import ResumeItem
+from coverletter.prompts import (
+    PromptBuilder,
+    count_tokens,
+    render_resume_table,
+    strip_boilerplate,
+    truncate_tokens,
+)
+
+POSTING = (
+    "We are looking for a data engineer to build our pipelines.\n\n"
+    "We offer great benefits, free snacks and a gym membership.\n\n"
+    "We are an equal opportunity employer and value diversity."
+)
+
+
+def resume_items() -> list[ResumeItem]:
+    return [
+        ResumeItem(title="Python", description="Ten years", category="skill"),
+        ResumeItem(
+            title="Intern",
+            description="Made coffee for the whole department " * 5,
+            category="work",
+            begin_date=datetime(2010, 1, 1),
+            end_date=datetime(2011, 1, 1),
+        ),
+        ResumeItem(
+            title="Data Engineer",
+            description="Built pipelines",
+            category="work",
+            begin_date=datetime(2020, 1, 1),
+        ),
+    ]
+
+
+class TokenCountTest(TestCase):
+    def test_count_tokens(self):
+        self.assertEqual(count_tokens(""), 0)
+        self.assertEqual(count_tokens("Dear hiring manager,"), 6)
+        # long words are split into pieces of four characters
+        self.assertEqual(count_tokens("internationalization"), 5)
+
+    def test_truncate_tokens(self):
+        self.assertEqual(truncate_tokens("one two three four", 2), "one two")
+        self.assertEqual(truncate_tokens("one two", 10), "one two")
+
+    def test_strip_boilerplate(self):
+        self.assertEqual(
+            strip_boilerplate(POSTING), "We are looking for a data engineer to build our pipelines."
+        )
+
+
+class PromptBuilderTest(TestCase):
+    def builder(self, posting: str = POSTING) -> PromptBuilder:
+        items = resume_items()
+        return PromptBuilder("john", "ACME", posting, render_resume_table(items), lambda: items)
+
+    def test_prompt_within_budget_is_not_trimmed(self):
+        builder = self.builder()
+        prompt = builder.build(max_input_tokens=10_000)
+        self.assertEqual(builder.trimmed, [])
+        self.assertIn(POSTING, prompt)
+        self.assertIn("Made coffee", prompt)
+        self.assertEqual(builder.input_tokens, count_tokens(prompt))
+        self.assertEqual(builder.posting_tokens, count_tokens(POSTING))
+
+    def test_boilerplate_is_trimmed_first(self):
+        builder = self.builder()
+        untrimmed = builder.build()
+        prompt = builder.build(max_input_tokens=count_tokens(untrimmed) - 1)
+        self.assertEqual(builder.trimmed, ["boilerplate"])
+        self.assertNotIn("benefits", prompt)
+        self.assertIn("Made coffee", prompt)
+
+    def test_old_resume_items_are_trimmed_before_the_posting(self):
+        builder = self.builder()
+        budget = count_tokens(builder.build()) - 60
+        prompt = builder.build(max_input_tokens=budget)
+        self.assertEqual(builder.trimmed, ["boilerplate", "resume_items"])
+        self.assertNotIn("Made coffee", prompt)
+        self.assertIn("| skill | Python |", prompt)
+        self.assertIn("| work | Data Engineer |", prompt)
+        self.assertIn("data engineer to build our pipelines", prompt)
+        self.assertLessEqual(builder.input_tokens, budget)
+        self.assertEqual(builder.input_tokens, count_tokens(prompt))
+
+    def test_posting_is_truncated_last(self):
+        posting = "requirement " * 5000
+        builder = self.builder(posting)
+        prompt = builder.build(max_input_tokens=1000)
+        self.assertEqual(builder.trimmed, ["resume_items", "truncated"])
+        self.assertEqual(builder.input_tokens, 1000)
+        self.assertEqual(count_tokens(prompt), 1000)
+        self.assertIn("| skill | Python |", prompt)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+from datetime import datetime
+
+from coverletter import app
+from coverletter.db_models import Resume, ResumeItem
+from coverletter.prompts import PromptBuilder, render_resume_table
+from coverletter.ranking import ResumeIndex, rank_resume_items, resume_indexes
+
+POSTING = "We are looking for a data engineer in Berlin to build Spark pipelines with Python."
+
+
+def resume_items() -> list[ResumeItem]:
+    return [
+        ResumeItem(title="Python", description="Ten years of Python", category="skill"),
+        ResumeItem(title="Spark", description="Batch and streaming pipelines", category="skill"),
+        ResumeItem(title="Photoshop", description="Retouching photos", category="skill"),
+        ResumeItem(title="Excel", description="Pivot tables", category="skill"),
+        ResumeItem(
+            title="Data Engineer",
+            description="Built pipelines in Berlin",
+            category="work",
+            begin_date=datetime(2020, 1, 1),
+        ),
+        ResumeItem(
+            title="Barista",
+            description="Made coffee",
+            category="work",
+            begin_date=datetime(2012, 1, 1),
+        ),
+    ]
+
+
+class RankingCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        resume_indexes.clear()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_matching_items_score_higher(self):
+        index = ResumeIndex(resume_items())
+        scores = dict(zip(index.titles, index.scores(POSTING)))
+        self.assertGreater(scores["Spark"], scores["Photoshop"])
+        self.assertGreater(scores["Python"], scores["Excel"])
+        self.assertGreater(scores["Data Engineer"], scores["Barista"])
+        self.assertEqual(scores["Photoshop"], 0)
+
+    def test_top_items_are_kept_per_category(self):
+        kept = ResumeIndex(resume_items()).top_items(POSTING, per_category=2)
+        self.assertCountEqual(kept, ["Python", "Spark", "Data Engineer", "Barista"])
+        # without any matching term the newest items are kept
+        kept = ResumeIndex(resume_items()).top_items("Gardener", per_category=1)
+        self.assertIn("Data Engineer", kept)
+
+    def test_index_is_cached_per_resume_version(self):
+        resume = Resume(id=1, version=1, resume_items=resume_items())
+        self.assertEqual(len(rank_resume_items(resume, POSTING, per_category=2)), 4)
+        self.assertIsNone(rank_resume_items(resume, POSTING, per_category=4))
+        self.assertIsNone(rank_resume_items(resume, POSTING, per_category=0))
+        self.assertEqual(resume_indexes.stats()["misses"], 1)
+
+        resume.resume_items.append(
+            ResumeItem(title="SQL", description="Postgres", category="skill")
+        )
+        resume.version = 2
+        self.assertNotIn("SQL", rank_resume_items(resume, POSTING, per_category=2))
+        self.assertEqual(resume_indexes.stats()["misses"], 2)
+
+    def test_least_relevant_items_are_trimmed_first(self):
+        items = resume_items()
+        relevance = ResumeIndex(items).top_items(POSTING, per_category=10)
+        builder = PromptBuilder(
+            "john", "ACME", POSTING, render_resume_table(items), lambda: items, relevance
+        )
+        full = builder.build()
+        builder.build(builder.input_tokens - 5)
+        self.assertEqual(builder.trimmed, ["resume_items"])
+        self.assertNotIn("Barista", builder.resume_section)
+        self.assertIn("Barista", full)
+        self.assertIn("Data Engineer", builder.resume_section)
@@ -0,0 +1,188 @@
+from unittest import TestCase
+from io import BytesIO
+import json
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+from datetime import datetime
+from sqlalchemy import event
+from coverletter import app, db
+from coverletter.db_models import User, Resume, ResumeItem, user_cache
+from coverletter.resume_import import ResumeImportError, parse_items
+from coverletter.views.applications import generation_queue
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+
+JSON_RESUME = {
+    "basics": {"name": "John"},
+    "work": [
+        {
+            "name": "ACME",
+            "position": "Data Engineer",
+            "location": "Berlin",
+            "startDate": "2020-01",
+            "endDate": "2022-06-30",
+            "summary": "Built pipelines",
+            "highlights": ["Cut costs by half"],
+        }
+    ],
+    "education": [
+        {
+            "institution": "TU Berlin",
+            "area": "Computer Science",
+            "studyType": "MSc",
+            "startDate": "2016",
+            "endDate": "2019",
+            "score": "1.3",
+        }
+    ],
+    "skills": [{"name": "Python", "keywords": ["pandas", "Flask"]}],
+    "awards": [{"title": "Best Paper"}],
+}
+
+CSV_ITEMS = (
+    "title,description,category,begin_date,end_date,grade,location\n"
+    "Python,pandas and Flask,skill,,,,\n"
+    "Data Engineer,Built pipelines,work,2020-01-01,2022-01-01,,Berlin\n"
+)
+
+
+class ResumeImportCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(name="john", email="john@example.com")
+        self.resume = Resume(language="en", user=self.user)
+        self.resume.resume_items.append(
+            ResumeItem(title="Python", description="Scripts", category="skill")
+        )
+        db.session.add_all([self.user, self.resume])
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+        user_cache.clear()
+
+    def tearDown(self):
+        generation_queue.shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def items(self) -> dict[str, ResumeItem]:
+        db.session.expire_all()
+        return {item.title: item for item in self.resume.resume_items}
+
+    def test_json_resume_is_upserted_in_one_statement(self):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            response = self.client.post(f"/import_resume_items/{self.resume.id}", json=JSON_RESUME)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+        self.assertEqual(response.json, {"imported": 3})
+        inserts = [statement for statement in statements if statement.startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn("ON CONFLICT", inserts[0])
+
+        items = self.items()
+        self.assertEqual(len(items), 3)
+        work = items["Data Engineer, ACME"]
+        self.assertEqual(work.category, "work")
+        self.assertEqual(work.description, "Built pipelines\n- Cut costs by half")
+        self.assertEqual(work.begin_date, datetime(2020, 1, 1))
+        self.assertEqual(work.end_date, datetime(2022, 6, 30))
+        self.assertEqual(items["MSc Computer Science, TU Berlin"].grade, 1.3)
+        # the existing item with the same title was replaced
+        self.assertEqual(items["Python"].description, "pandas, Flask")
+        self.assertEqual(self.resume.version, 2)
+
+    def test_last_item_of_a_title_wins(self):
+        items = parse_items(CSV_ITEMS + "Python,Only the last one,skill,,,,\n", "csv")
+        self.assertEqual([item["title"] for item in items], ["Python", "Data Engineer", "Python"])
+
+        response = self.client.post(
+            f"/import_resume_items/{self.resume.id}",
+            data=CSV_ITEMS + "Python,Only the last one,skill,,,,\n",
+            content_type="text/csv",
+        )
+        self.assertEqual(response.json, {"imported": 2})
+        self.assertEqual(self.items()["Python"].description, "Only the last one")
+
+    def test_invalid_items_reject_the_document(self):
+        document = {
+            "work": [
+                {"name": "ACME", "position": "Intern", "summary": "Tests", "startDate": "2020"}
+            ],
+            "education": [
+                {"institution": "TU", "area": "Physics", "startDate": "2016", "endDate": "2015"}
+            ],
+            "skills": [{"name": "Go", "keywords": ["gRPC"]}],
+        }
+        response = self.client.post(f"/import_resume_items/{self.resume.id}", json=document)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json["errors"],
+            [
+                "work[0]: Location is required for work, project, and volunteer items.",
+                "education[0]: Grade is required for education items.",
+                "education[0]: Begin date must be before end date.",
+            ],
+        )
+        self.assertEqual(list(self.items()), ["Python"])
+        self.assertEqual(self.resume.version, 1)
+
+        with self.assertRaises(ResumeImportError) as raised:
+            parse_items("title,category\nPython,hobby\n", "csv")
+        self.assertEqual(raised.exception.errors, ["The header has no column 'description'."])
+        with self.assertRaises(ResumeImportError) as raised:
+            parse_items("title,description,category\nPython,Scripts,hobby\n", "csv")
+        self.assertEqual(raised.exception.errors, ["line 2: Unknown category 'hobby'."])
+
+    def test_csv_upload_form(self):
+        response = self.client.post(
+            f"/import_resume_items/{self.resume.id}",
+            data={"file": (BytesIO(CSV_ITEMS.encode("utf-8-sig")), "resume.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(self.items()), {"Python", "Data Engineer"})
+
+        response = self.client.post(
+            f"/import_resume_items/{self.resume.id}",
+            data={"file": (BytesIO(b"title\nPython\n"), "resume.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("The header has no column", response.get_data(as_text=True))
+
+    def test_resumes_of_other_users_are_not_found(self):
+        other = Resume(language="en", user=User(name="jane", email="jane@example.com"))
+        db.session.add(other)
+        db.session.commit()
+        response = self.client.post(f"/import_resume_items/{other.id}", json=JSON_RESUME)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(other.resume_items, [])
+
+    def test_cli_command(self):
+        path = os.path.join(app.instance_path, "test_resume_import.json")
+        os.makedirs(app.instance_path, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(JSON_RESUME, file)
+        try:
+            result = app.test_cli_runner().invoke(args=["import-resume", "john@example.com", path])
+        finally:
+            os.remove(path)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 3 items", result.output)
+        self.assertEqual(len(self.items()), 3)
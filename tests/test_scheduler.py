@@ -0,0 +1,114 @@
+from unittest import TestCase
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import threading
+import time
+
+from coverletter import app
+from coverletter.scheduler import QuotaExceeded, QuotaScheduler
+
+# configure the app for testing
+app.config["TESTING"] = True
+
+
+class QuotaError(Exception):
+    pass
+
+
+def make_scheduler(**settings) -> QuotaScheduler:
+    options = dict(
+        requests_per_minute=600,
+        tokens_per_minute=100000,
+        max_wait=10,
+        max_queue_depth=10,
+        max_retries=3,
+        backoff_base=0.001,
+        backoff_max=0.01,
+    )
+    options.update(settings)
+    return QuotaScheduler(**options)
+
+
+class QuotaSchedulerCase(TestCase):
+    def test_admission_rejects_with_retry_after(self):
+        scheduler = make_scheduler(requests_per_minute=60, max_wait=5)
+        scheduler.requests.level = 0
+        scheduler.admit(tokens=100, backlog=3)
+        with self.assertRaises(QuotaExceeded) as context:
+            scheduler.admit(tokens=100, backlog=8)
+        self.assertEqual(context.exception.retry_after, 9)
+        self.assertEqual(scheduler.stats()["rejected"], 1)
+
+    def test_admission_counts_backlog_beyond_one_minute_of_quota(self):
+        scheduler = make_scheduler(requests_per_minute=60, max_wait=60, max_queue_depth=1000)
+        scheduler.requests.level = 0
+        with self.assertRaises(QuotaExceeded) as context:
+            scheduler.admit(tokens=100, backlog=199)
+        self.assertEqual(context.exception.retry_after, 200)
+
+        # calls of more tokens than a minute of quota take one minute of quota each
+        scheduler = make_scheduler(tokens_per_minute=6000, max_wait=60, max_queue_depth=1000)
+        scheduler.tokens.level = 0
+        scheduler.admit(tokens=10**6, backlog=0)
+        with self.assertRaises(QuotaExceeded) as context:
+            scheduler.admit(tokens=10**6, backlog=1)
+        self.assertEqual(context.exception.retry_after, 120)
+
+    def test_admission_limits_queue_depth(self):
+        scheduler = make_scheduler(max_queue_depth=2)
+        with self.assertRaises(QuotaExceeded):
+            scheduler.admit(tokens=100, backlog=2)
+
+    def test_acquire_waits_for_tokens(self):
+        scheduler = make_scheduler(tokens_per_minute=6000)
+        scheduler.acquire("john", 6000)
+        started = time.monotonic()
+        scheduler.acquire("john", 10)
+        self.assertGreater(time.monotonic() - started, 0.05)
+        self.assertEqual(scheduler.stats()["calls"], 2)
+
+    def test_users_are_served_round_robin(self):
+        scheduler = make_scheduler()
+        scheduler.requests.level = 0
+        served = []
+
+        def call(user):
+            scheduler.acquire(user, 1)
+            served.append(user)
+
+        threads = [threading.Thread(target=call, args=(user,)) for user in "aaab"]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        self.assertEqual(scheduler.stats()["queue_depth"], 4)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(served, ["a", "b", "a", "a"])
+        self.assertEqual(scheduler.stats()["queue_depth"], 0)
+
+    def test_retryable_errors_are_retried(self):
+        scheduler = make_scheduler()
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise QuotaError()
+            return "letter"
+
+        result = scheduler.call("john", 1, flaky, lambda error: isinstance(error, QuotaError))
+        self.assertEqual(result, "letter")
+        self.assertEqual(scheduler.stats()["retries"], 2)
+
+    def test_other_errors_are_raised(self):
+        scheduler = make_scheduler()
+
+        def broken():
+            raise ValueError("bad prompt")
+
+        with self.assertRaises(ValueError):
+            scheduler.call("john", 1, broken, lambda error: isinstance(error, QuotaError))
+        self.assertEqual(scheduler.stats()["retries"], 0)
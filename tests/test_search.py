@@ -0,0 +1,109 @@
+from unittest import TestCase
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+from coverletter import app, db
+from coverletter.db_models import (
+    User,
+    Resume,
+    Prompt,
+    CoverLetter,
+    JobPosting,
+    ModelConfig,
+    user_cache,
+)
+from coverletter.search import SEARCH_TABLE, search_cover_letters
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+
+
+class SearchCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(name="john", email="john@example.com")
+        self.other = User(name="jane", email="jane@example.com")
+        self.resume = Resume(language="en", user=self.user)
+        self.other_resume = Resume(language="en", user=self.other)
+        self.config = ModelConfig(name="PaLM", model_id="text-bison@002")
+        db.session.add_all([self.user, self.other, self.resume, self.other_resume, self.config])
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+        user_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_letter(self, company, location, text, response, resume=None) -> CoverLetter:
+        posting = JobPosting(company=company, location=location, text=text)
+        prompt = Prompt(posting=posting, resume=resume or self.resume, prompt=text)
+        coverletter = CoverLetter(prompt=prompt, config=self.config, response=response)
+        db.session.add(coverletter)
+        db.session.commit()
+        return coverletter
+
+    def test_letters_are_indexed_on_insert(self):
+        coverletter = self.add_letter("ACME", "Berlin", "Data engineering role", "Dear ACME")
+        rows = db.session.execute(
+            db.text(f"SELECT rowid, user_id, company, location FROM {SEARCH_TABLE}")
+        ).all()
+        self.assertEqual([(coverletter.id, self.user.id, "ACME", "Berlin")], rows)
+
+        db.session.delete(coverletter)
+        db.session.commit()
+        self.assertEqual(
+            0, db.session.execute(db.text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+        )
+
+    def test_search_matches_all_words_and_ranks_company_first(self):
+        in_text = self.add_letter(
+            "Initech", "Munich", "We need a Berlin data engineer", "Dear Initech"
+        )
+        in_company = self.add_letter("Berlin Data", "Berlin", "Engineering position", "Dear team")
+        self.add_letter("Globex", "Berlin", "Frontend developer", "Dear Globex")
+
+        matches = search_cover_letters(self.user.id, "berlin data engineering", 10)
+        self.assertEqual([in_company.id, in_text.id], [match[0] for match in matches])
+        self.assertGreater(matches[0][1], matches[1][1])
+
+    def test_search_is_scoped_to_the_user(self):
+        self.add_letter("ACME", "Berlin", "Data engineer", "Dear ACME", resume=self.other_resume)
+        self.assertEqual([], search_cover_letters(self.user.id, "acme", 10))
+        self.assertEqual(1, len(search_cover_letters(self.other.id, "acme", 10)))
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.add_letter("ACME", "Berlin", "Data engineer", "Dear ACME")
+        self.assertEqual(1, len(search_cover_letters(self.user.id, 'ACME: "(Berlin', 10)))
+        # OR is a word to match, not an operator
+        self.assertEqual([], search_cover_letters(self.user.id, "acme OR globex", 10))
+        self.assertEqual([], search_cover_letters(self.user.id, "*:-", 10))
+
+    def test_search_endpoint_pages_results(self):
+        letters = [
+            self.add_letter(f"Company {i}", "Berlin", "Data engineer", f"Letter {i}")
+            for i in range(3)
+        ]
+        headers = {"Accept": "application/json"}
+        first = self.client.get("/search?q=berlin&limit=2", headers=headers).get_json()
+        self.assertEqual(2, len(first["results"]))
+        self.assertEqual(2, first["next_page"])
+        second = self.client.get("/search?q=berlin&limit=2&page=2", headers=headers).get_json()
+        self.assertIsNone(second["next_page"])
+        ids = [result["id"] for result in first["results"] + second["results"]]
+        self.assertCountEqual([letter.id for letter in letters], ids)
+
+        response = self.client.get("/search?q=company")
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b"Letter 0", response.data)
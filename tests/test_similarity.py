@@ -0,0 +1,154 @@
+from unittest import TestCase, mock
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+
+import tempfile
+
+from coverletter import app, db
+from coverletter.db_models import (
+    CoverLetter,
+    GenerationJob,
+    JobPosting,
+    ModelConfig,
+    Prompt,
+    Resume,
+    User,
+    user_cache,
+)
+from coverletter.similarity import (
+    SimilarityIndex,
+    signature,
+    similar_coverletters,
+    similarity_index,
+)
+from coverletter.views import applications
+
+# configure the app for testing
+app.config["TESTING"] = True
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///:memory:"
+app.config["GENERATION_QUEUE_BACKEND"] = "inline"
+app.config["MODEL_POOL_WARMUP"] = False
+
+POSTING = (
+    "We are looking for a senior data engineer to join our platform team in Berlin. You will "
+    "design and operate batch and streaming pipelines with Spark, Kafka and Airflow, model our "
+    "warehouse in dbt and mentor two junior engineers. Five years of Python and SQL required."
+)
+NEAR_DUPLICATE = POSTING.replace("Berlin", "Munich").replace("two junior", "three junior")
+UNRELATED = (
+    "Our bakery hires a friendly shop assistant for the weekend shift. You will sell bread and "
+    "cakes, keep the counter clean and help the bakers in the early morning hours."
+)
+
+
+class SimilarityIndexCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "postings.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.app_context.pop()
+
+    def test_signatures_estimate_similarity(self):
+        agreement = (signature(POSTING) == signature(NEAR_DUPLICATE)).mean()
+        self.assertGreater(agreement, 0.6)
+        self.assertLess((signature(POSTING) == signature(UNRELATED)).mean(), 0.1)
+
+    def test_index_is_persisted_and_shared(self):
+        index = SimilarityIndex(self.path)
+        index.add([(1, POSTING), (2, UNRELATED)])
+        matches = index.query(NEAR_DUPLICATE, threshold=0.5)
+        self.assertEqual([posting_id for posting_id, _ in matches], [1])
+        self.assertGreater(matches[0][1], 0.6)
+
+        # another process reads the file and picks up later appends of the first one
+        other = SimilarityIndex(self.path)
+        self.assertEqual(other.query(POSTING, threshold=0.99), [(1, 1.0)])
+        index.add([(3, NEAR_DUPLICATE)])
+        self.assertEqual([posting_id for posting_id, _ in other.query(POSTING, 0.5)], [1, 3])
+        self.assertEqual(len(other), 3)
+
+
+class SimilarCoverLetterCase(TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        similarity_index.clear()
+        user_cache.clear()
+        self.user = User(name="john", email="john@example.com")
+        self.other = User(name="jane", email="jane@example.com")
+        self.config = ModelConfig(name="PaLM", model_id="text-bison@002")
+        db.session.add_all([self.user, self.other, self.config])
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_letter(self, user: User, text: str, company: str) -> CoverLetter:
+        posting = JobPosting.get_or_create(text=text, company=company)
+        prompt = Prompt(posting=posting, resume=Resume(language="en", user=user), prompt=text)
+        coverletter = CoverLetter(prompt=prompt, config=self.config, response=f"Dear {company}")
+        db.session.add(coverletter)
+        db.session.commit()
+        return coverletter
+
+    def test_letters_for_similar_postings_are_offered(self):
+        letter = self.add_letter(self.user, POSTING, "ACME")
+        self.add_letter(self.user, UNRELATED, "Bakery")
+        self.add_letter(self.other, NEAR_DUPLICATE, "Initech")
+
+        response = self.client.post("/similar", json={"text": NEAR_DUPLICATE})
+        similar = response.json["similar"]
+        self.assertEqual([match["cover_letter_id"] for match in similar], [letter.id])
+        self.assertEqual(similar[0]["response"], "Dear ACME")
+        self.assertEqual(self.client.post("/similar", json={}).status_code, 400)
+
+    def test_job_status_lists_similar_letters(self):
+        letter = self.add_letter(self.user, POSTING, "ACME")
+        posting = JobPosting.get_or_create(text=NEAR_DUPLICATE, company="ACME")
+        prompt = Prompt(posting=posting, resume=letter.prompt.resume, prompt=NEAR_DUPLICATE)
+        job = GenerationJob(user=self.user, prompt=prompt, config=self.config)
+        db.session.add(job)
+        db.session.commit()
+
+        # polls of a running job do not look for similar letters
+        with mock.patch.object(
+            applications, "similar_coverletters", wraps=similar_coverletters
+        ) as lookup:
+            for _ in range(3):
+                response = self.client.get(
+                    f"/jobs/{job.id}", headers={"Accept": "application/json"}
+                )
+                self.assertEqual(response.json["similar"], [])
+            self.client.get(f"/jobs/{job.id}")
+            self.assertEqual(lookup.call_count, 0)
+
+            job.cover_letter = CoverLetter(prompt=prompt, config=self.config, response="Dear ACME")
+            job.status = GenerationJob.DONE
+            db.session.commit()
+            response = self.client.get(f"/jobs/{job.id}", headers={"Accept": "application/json"})
+            self.assertEqual(lookup.call_count, 1)
+        # the letter of the job itself is not offered
+        self.assertEqual(
+            [match["cover_letter_id"] for match in response.json["similar"]], [letter.id]
+        )
+        self.assertIn(b"Your letters for similar postings", self.client.get(f"/jobs/{job.id}").data)
+
+    def test_index_is_rebuilt_from_database(self):
+        self.add_letter(self.user, POSTING, "ACME")
+        similarity_index.clear()
+        result = app.test_cli_runner().invoke(args=["index-postings"])
+        self.assertIn("Indexed 1 job postings", result.output)
+        self.assertEqual(len(similarity_index.query(POSTING, 0.9)), 1)